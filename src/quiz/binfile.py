@@ -0,0 +1,113 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+A minimal container for named NumPy arrays that loads through mmap.
+
+Layout: an 8-byte magic, a little-endian uint32 format version, a uint32 header length, a UTF-8 JSON header
+{'meta': ..., 'checksum': ..., 'sections': {name: [dtype, shape, offset]}}, then the raw array data,
+each section starting at a 64-byte aligned offset from the beginning of the file.
+"""
+import json
+import os
+import struct
+import zlib
+from typing import Dict, Tuple, Any, Optional
+
+import numpy as np
+
+ALIGN = 64
+PREFIX = struct.Struct('<8sII')
+
+
+class FormatError(ValueError):
+    pass
+
+
+def _align(n: int) -> int:
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write(filename: str, magic: bytes, version: int, arrays: Dict[str, np.ndarray], meta: Optional[Dict[str, Any]] = None):
+    """
+    Writes the arrays atomically: the file is written under a temporary name and then renamed.
+    :param magic: up to 8 bytes identifying the kind of file.
+    :param version: the format version of the kind of file.
+    :param meta: JSON-serializable metadata stored in the header.
+    """
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    checksum = 0
+    for a in arrays.values(): checksum = zlib.crc32(a.data.cast('B'), checksum)
+
+    # the header length depends on the offsets, which depend on the header length; a fixed point is reached quickly
+    data_start = 0
+    while True:
+        sections, offset = dict(), data_start
+        for name, a in arrays.items():
+            sections[name] = [a.dtype.str, list(a.shape), offset]
+            offset = _align(offset + a.nbytes)
+        header = json.dumps({'meta': meta or {}, 'checksum': checksum, 'sections': sections}).encode('utf-8')
+        start = _align(PREFIX.size + len(header))
+        if start == data_start: break
+        data_start = start
+
+    tmp = '{}.tmp{}'.format(filename, os.getpid())
+    with open(tmp, 'wb') as fout:
+        fout.write(PREFIX.pack(magic, version, len(header)))
+        fout.write(header)
+        for name, a in arrays.items():
+            fout.write(b'\0' * (sections[name][2] - fout.tell()))
+            fout.write(a.data.cast('B'))
+    os.replace(tmp, filename)
+
+
+def read_header(filename: str, magic: bytes, version: int) -> Dict[str, Any]:
+    with open(filename, 'rb') as fin:
+        prefix = fin.read(PREFIX.size)
+        if len(prefix) < PREFIX.size: raise FormatError('Truncated file: {}'.format(filename))
+        m, v, n = PREFIX.unpack(prefix)
+        if m != magic.ljust(8, b'\0'): raise FormatError('Not a {} file: {}'.format(magic.decode(), filename))
+        if v != version: raise FormatError('Unsupported version {} (expected {}): {}'.format(v, version, filename))
+        return json.loads(fin.read(n).decode('utf-8'))
+
+
+def read(filename: str, magic: bytes, version: int, mmap: bool = True, verify: bool = False) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    :param mmap: if True, the arrays are read-only views of a memory map, so processes loading the same file share
+                 its pages through the OS page cache; otherwise they are read into memory.
+    :param verify: if True, checks the CRC-32 of the data, which touches every page.
+    :return: the arrays by name and the metadata.
+    """
+    header = read_header(filename, magic, version)
+    buf = np.memmap(filename, dtype=np.uint8, mode='r') if mmap else np.fromfile(filename, dtype=np.uint8)
+    arrays, checksum = dict(), 0
+
+    for name, (dtype, shape, offset) in header['sections'].items():
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        if offset + nbytes > len(buf): raise FormatError('Truncated section {}: {}'.format(name, filename))
+        arrays[name] = buf[offset:offset + nbytes].view(dtype).reshape(shape)
+        if verify: checksum = zlib.crc32(buf[offset:offset + nbytes], checksum)
+
+    if verify and checksum != header['checksum']: raise FormatError('Checksum mismatch: {}'.format(filename))
+    return arrays, header['meta']
+
+
+def update_meta(filename: str, magic: bytes, version: int, meta: Dict[str, Any]):
+    """
+    Replaces the metadata of the file; the arrays are copied from a memory map into a new file, renamed as write() does.
+    """
+    arrays, _ = read(filename, magic, version)
+    write(filename, magic, version, arrays, meta)
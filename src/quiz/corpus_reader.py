@@ -0,0 +1,152 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import json
+import mmap
+import os
+from typing import Dict, Iterator, Iterable, Sequence, Any, Optional, TextIO
+
+FIELDS = ('source', 'tokens')
+BUFFER_SIZE = 1 << 16
+LINE_BUFFER_SIZE = 1 << 20
+
+
+def _project(document: Dict[str, Any], fields: Optional[Sequence[str]]) -> Dict[str, Any]:
+    return document if fields is None else {f: document[f] for f in fields}
+
+
+def iter_json_array(fin: TextIO, fields: Optional[Sequence[str]] = FIELDS, buffer_size: int = BUFFER_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Incrementally parses a JSON array of objects such as aesopfables.json, holding one object at a time.
+    :param fin: the input stream.
+    :param fields: the fields to keep from each object; all fields are kept if None.
+    :param buffer_size: the number of characters to read at a time.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill(i: int, size: int):
+        # drops the consumed prefix and appends at least one more chunk unless the stream ends
+        nonlocal buf, eof
+        chunk = fin.read(size)
+        if not chunk: eof = True
+        buf = buf[i:] + chunk
+        return 0
+
+    def skip(i: int) -> int:
+        # skips whitespace, refilling as needed; returns the position of the next character or len(buf) at the end
+        nonlocal buf
+        while True:
+            while i < len(buf) and buf[i].isspace(): i += 1
+            if i < len(buf) or eof: return i
+            i = fill(i, buffer_size)
+
+    pos = skip(pos)
+    if pos >= len(buf): return
+    if buf[pos] != '[': raise ValueError('Expected a JSON array')
+    pos = skip(pos + 1)
+    if pos < len(buf) and buf[pos] == ']': return
+
+    while True:
+        size = buffer_size
+        while True:
+            try:
+                document, end = decoder.raw_decode(buf, pos)
+                break
+            except json.JSONDecodeError:
+                # the object may continue beyond the buffer; read more, growing geometrically for large objects
+                if eof: raise
+                pos = fill(pos, size)
+                size *= 2
+
+        yield _project(document, fields)
+        pos = skip(end)
+        if pos >= len(buf): raise ValueError('Unterminated JSON array')
+        if buf[pos] == ']': return
+        if buf[pos] != ',': raise ValueError('Expected "," or "]" at {}'.format(buf[pos:pos + 20]))
+        pos = skip(pos + 1)
+
+
+def iter_lines(filename: str, buffer_size: int = LINE_BUFFER_SIZE, use_mmap: bool = False) -> Iterator[str]:
+    """
+    Reads the file in bulk chunks of buffer_size characters, or through a read-only memory map if use_mmap is True,
+    and yields its lines without the line breaks.
+    """
+    if use_mmap:
+        if os.path.getsize(filename) == 0: return
+        with open(filename, 'rb') as fin, mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b''): yield line.decode('utf-8').rstrip('\r\n')
+        return
+
+    with open(filename, encoding='utf-8') as fin:
+        rest = ''
+        while True:
+            chunk = fin.read(buffer_size)
+            if not chunk: break
+            lines = (rest + chunk).split('\n')
+            rest = lines.pop()
+            yield from lines
+        if rest: yield rest
+
+
+def iter_json_lines(fin: TextIO, fields: Optional[Sequence[str]] = FIELDS) -> Iterator[Dict[str, Any]]:
+    """
+    Reads one JSON object per line, skipping blank lines.
+    """
+    for line in fin:
+        if line.strip(): yield _project(json.loads(line), fields)
+
+
+def iter_documents(filename: str, fields: Optional[Sequence[str]] = FIELDS) -> Iterator[Dict[str, Any]]:
+    """
+    Streams the documents in either a JSON array file or a JSON Lines file, detected from the first character.
+    :param filename: the input file, e.g., res/vsm/aesopfables.json.
+    :param fields: the fields to keep from each document; all fields are kept if None.
+    """
+    with open(filename) as fin:
+        head = ''
+        while not head:
+            c = fin.read(1)
+            if not c: return
+            if not c.isspace(): head = c
+        fin.seek(0)
+        yield from (iter_json_array(fin, fields) if head == '[' else iter_json_lines(fin, fields))
+
+
+def write_json_lines(documents: Iterable[Dict[str, Any]], filename: str, fields: Optional[Sequence[str]] = FIELDS):
+    """
+    Converts documents, e.g., the output of iter_documents(), into a JSON Lines file.
+    """
+    with open(filename, 'w') as fout:
+        for document in documents:
+            fout.write(json.dumps(_project(document, fields)))
+            fout.write('\n')
+
+
+if __name__ == '__main__':
+    import time
+    import tracemalloc
+    from vector_space_models import frequencies
+
+    aesop_file = '../../res/vsm/aesopfables.json'
+
+    for name, load in [('json.load', lambda: json.load(open(aesop_file))), ('iter_documents', lambda: iter_documents(aesop_file))]:
+        tracemalloc.start()
+        st = time.time()
+        tfs, dfs = frequencies(load())
+        t = time.time() - st
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('{}: {:.3f}s, peak {:.1f} MB, {} documents, {} terms'.format(name, t, peak / 1e6, len(tfs), len(dfs)))
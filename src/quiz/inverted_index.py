@@ -0,0 +1,171 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import json
+import math
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import tfidf
+from quiz2 import cosine
+from similarity import normalize_rows
+from tfidf import CSRMatrix
+
+# slack on the pruning bounds so that rounding in the normalized scores never drops an exact winner
+EPSILON = 1e-9
+
+
+class InvertedIndex:
+    """
+    Term-at-a-time cosine retrieval over TF-IDF vectors with MaxScore pruning.
+    Postings hold the normalized weights of each term, sorted by document ID, with the largest weight of
+    every term as its max-score. Query terms are visited by decreasing upper bound; once the bounds of the
+    remaining terms cannot lift an unseen document above the current k-th score, those terms only probe the
+    surviving candidates (binary search into their postings) instead of scanning their postings.
+    All weights must be non-negative, which holds for TF-IDF.
+    """
+    def __init__(self, matrix: CSRMatrix):
+        """
+        :param matrix: the document vectors; their raw weights are kept to rescore the final candidates exactly.
+        """
+        self.matrix = matrix
+        normalized = normalize_rows(matrix)
+        order = np.argsort(matrix.indices, kind='stable')
+        counts = np.bincount(matrix.indices, minlength=len(matrix.vocab))
+
+        self.term_ptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.doc_ids = matrix.row_ids()[order].astype(np.int32)
+        self.weights = normalized.data[order]
+        self.max_scores = np.zeros(len(counts), dtype=np.float64)
+        nonempty = counts > 0
+        if matrix.nnz: self.max_scores[nonempty] = np.maximum.reduceat(self.weights, self.term_ptr[:-1][nonempty])
+
+    @classmethod
+    def from_frequencies(cls, tfs: Dict[str, Counter], dfs: Dict[str, int]) -> 'InvertedIndex':
+        """
+        :param tfs: the output of vector_space_models.term_frequencies().
+        :param dfs: the output of vector_space_models.document_frequencies().
+        :return: the index of the TF-IDF vectors that vector_space_models.tf_idfs() computes from them.
+        """
+        D = len(tfs)
+        vectors = {key: {t: tf * math.log(D / dfs[t]) for t, tf in counts.items()} for key, counts in tfs.items()}
+        return cls(tfidf.from_dicts(vectors))
+
+    @property
+    def keys(self) -> List[str]:
+        return self.matrix.keys
+
+    def postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        b, e = self.term_ptr[term_id], self.term_ptr[term_id + 1]
+        return self.doc_ids[b:e], self.weights[b:e]
+
+    def _candidates(self, query: Dict[str, float], k: int) -> np.ndarray:
+        """
+        :return: the IDs of the documents whose normalized cosine with the query may be among the top-k.
+        """
+        vocab = self.matrix.vocab
+        norm = math.sqrt(sum(w * w for w in query.values()))
+        if norm == 0: return np.zeros(0, dtype=np.int64)
+
+        terms = [(vocab.get(t), w / norm) for t, w in query.items()]
+        terms = [(tid, w) for tid, w in terms if tid >= 0 and w > 0 and self.max_scores[tid] > 0]
+        terms.sort(key=lambda x: x[1] * self.max_scores[x[0]], reverse=True)
+        bounds = [w * self.max_scores[tid] for tid, w in terms]
+        remaining = np.cumsum(bounds[::-1])[::-1].tolist() + [0.0]
+
+        ids = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0, dtype=np.float64)
+        theta = -1.0
+        i = 0
+
+        # essential terms: any document in their postings may still make the top-k
+        while i < len(terms):
+            if len(scores) >= k: theta = np.partition(scores, -k)[-k]
+            if remaining[i] < theta - EPSILON: break
+            tid, w = terms[i]
+            p_ids, p_weights = self.postings(tid)
+            ids, inverse = np.unique(np.concatenate((ids, p_ids)), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate((scores, p_weights * w)), minlength=len(ids))
+            i += 1
+
+        # non-essential terms: only score the candidates that can still reach the threshold
+        while i < len(terms):
+            keep = scores + remaining[i] >= theta - EPSILON
+            ids, scores = ids[keep], scores[keep]
+            tid, w = terms[i]
+            p_ids, p_weights = self.postings(tid)
+            j = np.minimum(np.searchsorted(p_ids, ids), len(p_ids) - 1)
+            hit = p_ids[j] == ids
+            scores[hit] += p_weights[j[hit]] * w
+            if len(scores) >= k: theta = np.partition(scores, -k)[-k]
+            i += 1
+
+        if len(scores) > k: ids = ids[scores >= np.partition(scores, -k)[-k] - EPSILON]
+        return ids
+
+    def search(self, query: Dict[str, float], k: int = 1) -> List[Tuple[str, float]]:
+        """
+        :param query: a {term: weight} vector.
+        :param k: the number of documents to return.
+        :return: up to k (document key, cosine similarity) pairs, best first; ties go to the earlier document.
+                 Scores are computed by quiz2.cosine(), so they match a full scan exactly.
+        """
+        candidates = self._candidates(query, k).tolist()
+        results = [(cosine(self.matrix.row(i), query), -i) for i in candidates]
+        results.sort(reverse=True)
+
+        # as in a full scan, documents sharing no term with the query fill up the rest with a score of 0
+        if len(results) < k:
+            seen = set(candidates)
+            fill = (i for i in range(len(self.keys)) if i not in seen)
+            results.extend((0.0, -i) for _, i in zip(range(k - len(results)), fill))
+
+        return [(self.keys[-i], score) for score, i in results[:k]]
+
+    def most_similar(self, X: Dict[str, Dict[str, float]]) -> Dict[str, str]:
+        """
+        :param X: the query vectors.
+        :return: the same mapping as quiz2.similar_documents(X, Y) for the vectors Y indexed here.
+        """
+        return {key: self.search(x, 1)[0][0] for key, x in X.items()}
+
+
+if __name__ == '__main__':
+    import time
+    from quiz2 import vectorize
+    from vector_space_models import term_frequencies, document_frequencies
+
+    fables = json.load(open('../../res/vsm/aesopfables.json'))
+    fables_alt = json.load(open('../../res/vsm/aesopfables-alt.json'))
+
+    def copies(documents, n):
+        return [dict(d, source='{}{}'.format(d['source'], i)) for i in range(n) for d in documents]
+
+    for n in [1, 10, 50]:
+        corpus = copies(fables, n)
+        Y, X = vectorize(corpus), vectorize(fables_alt)
+
+        st = time.time()
+        baseline = {k: max(Y, key=lambda y: cosine(Y[y], x)) for k, x in X.items()}
+        t_scan = time.time() - st
+
+        index = InvertedIndex.from_frequencies(term_frequencies(corpus), document_frequencies(corpus))
+        st = time.time()
+        out = index.most_similar(X)
+        t_index = time.time() - st
+        print('{} documents: full scan {:.3f}s, inverted index {:.3f}s, agrees: {}'.format(
+            len(Y), t_scan, t_index, out == baseline))
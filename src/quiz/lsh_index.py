@@ -0,0 +1,264 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import json
+from array import array
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from similarity import align, row_norms
+from tfidf import CSRMatrix, Vocabulary
+
+PLANE_BLOCK = 4096
+# recall@1 of about 0.97 against exact cosine search on aesopfables-alt -> aesopfables (see the benchmark below)
+N_TABLES, N_BITS, PROBES = 32, 6, 2
+
+
+class LSHIndex:
+    """
+    Approximate nearest-neighbour index over TF-IDF vectors using random-hyperplane LSH (SimHash).
+    Every vector is hashed into n_tables buckets, one per table, by the signs of its projections onto n_bits
+    random hyperplanes; a query collects the documents sharing a bucket with it in any table, optionally probing
+    the buckets one bit flip away, and re-ranks those candidates exactly.
+
+    Recall/speed knobs:
+      - n_bits: more bits make buckets smaller, so queries are faster but miss more neighbours.
+      - n_tables: more tables find more neighbours at the cost of memory and query time.
+      - probes: the number of least confident bits flipped per table to probe nearby buckets at query time.
+    The defaults suit collections of a few hundred documents such as the Aesop fables; few bits keep the buckets
+    of a small collection from being nearly empty. Larger collections need more bits to keep the candidates few,
+    and then more tables or probes to keep the recall, so tune them per corpus with the benchmark below.
+    """
+    def __init__(self, vocab: Vocabulary, n_tables: int = N_TABLES, n_bits: int = N_BITS, metric: str = 'cosine', seed: int = 0):
+        """
+        :param vocab: the vocabulary the indexed vectors are built with; it may keep growing as documents are added.
+        :param metric: 'cosine' (similarity, higher is better) or 'euclidean' (squared distance, lower is better),
+                       used to re-rank the candidates.
+        """
+        if not 0 < n_bits <= 64: raise ValueError('n_bits must be between 1 and 64: {}'.format(n_bits))
+        if metric not in {'cosine', 'euclidean'}: raise ValueError('Unknown metric: {}'.format(metric))
+        self.vocab = vocab
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.metric = metric
+        self.seed = seed
+        self.planes = np.zeros((0, n_tables * n_bits), dtype=np.float32)
+        self.tables: List[Dict[int, List[int]]] = [dict() for _ in range(n_tables)]
+        self.codes = array('Q')
+
+        # the indexed vectors, kept for exact re-ranking
+        self.keys: List[str] = []
+        self.indptr, self.indices, self.data, self.norms = array('q', [0]), array('q'), array('d'), array('d')
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _extend_planes(self, size: int):
+        # hyperplane rows are drawn per block of term IDs, so they depend only on the seed and the term ID
+        n = len(self.planes)
+        if size <= n: return
+        blocks = [np.random.default_rng((self.seed, b)).standard_normal((PLANE_BLOCK, self.planes.shape[1]), dtype=np.float32)
+                  for b in range(n // PLANE_BLOCK, (size - 1) // PLANE_BLOCK + 1)]
+        self.planes = np.vstack([self.planes[:n // PLANE_BLOCK * PLANE_BLOCK]] + blocks)
+
+    def _project(self, matrix: CSRMatrix) -> np.ndarray:
+        """
+        :return: the (n_rows x n_tables x n_bits) projections of the rows onto the hyperplanes.
+        """
+        self._extend_planes(len(self.vocab))
+        n = len(matrix.keys)
+        out = np.zeros((n, self.planes.shape[1]), dtype=np.float32)
+        nonempty = np.diff(matrix.indptr) > 0
+
+        if matrix.nnz:
+            contrib = self.planes[matrix.indices] * matrix.data[:, None].astype(np.float32)
+            out[nonempty] = np.add.reduceat(contrib, matrix.indptr[:-1][nonempty], axis=0)
+
+        return out.reshape(n, self.n_tables, self.n_bits)
+
+    def _hash(self, projections: np.ndarray) -> np.ndarray:
+        weights = np.left_shift(np.uint64(1), np.arange(self.n_bits, dtype=np.uint64))
+        return ((projections > 0).astype(np.uint64) * weights).sum(axis=2, dtype=np.uint64)
+
+    def add(self, matrix: CSRMatrix):
+        """
+        Inserts the rows of the matrix, which must be built with this index's vocabulary.
+        """
+        if matrix.vocab is not self.vocab: raise ValueError('The matrix must share the vocabulary of the index.')
+        codes = self._hash(self._project(matrix))
+        base = len(self.keys)
+
+        for table, column in zip(self.tables, codes.T.tolist()):
+            for i, code in enumerate(column):
+                table.setdefault(code, []).append(base + i)
+
+        self.codes.extend(codes.reshape(-1).tolist())
+        self.keys.extend(matrix.keys)
+        self.indptr.extend((matrix.indptr[1:] + self.indptr[-1]).tolist())
+        self.indices.extend(matrix.indices.tolist())
+        self.data.extend(matrix.data.tolist())
+        self.norms.extend(row_norms(matrix).tolist())
+
+    def _candidates(self, codes: np.ndarray, projections: np.ndarray, probes: int) -> np.ndarray:
+        """
+        :param codes: the (n_tables) bucket codes of one query.
+        :param projections: the (n_tables x n_bits) projections of the query.
+        """
+        found = []
+        flips = np.argsort(np.abs(projections), axis=1)[:, :probes]
+
+        for t, table in enumerate(self.tables):
+            code = int(codes[t])
+            found.extend(table.get(code, ()))
+            for bit in flips[t].tolist():
+                found.extend(table.get(code ^ (1 << bit), ()))
+
+        return np.unique(np.array(found, dtype=np.int64))
+
+    def _rerank(self, q_terms: np.ndarray, q_data: np.ndarray, q_norm: float, candidates: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        indptr = np.frombuffer(self.indptr, dtype=np.int64)
+        indices = np.frombuffer(self.indices, dtype=np.int64)
+        data = np.frombuffer(self.data, dtype=np.float64)
+        norms = np.frombuffer(self.norms, dtype=np.float64)
+
+        # positions of all stored entries of the candidate rows
+        lengths = indptr[candidates + 1] - indptr[candidates]
+        pos = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - indptr[candidates], lengths)
+        rows = np.repeat(np.arange(len(candidates)), lengths)
+
+        terms = indices[pos]
+        j = np.minimum(np.searchsorted(q_terms, terms), max(len(q_terms) - 1, 0))
+        weights = np.where(q_terms[j] == terms, q_data[j], 0.0) if len(q_terms) else np.zeros(len(pos))
+        dots = np.bincount(rows, weights=weights * data[pos], minlength=len(candidates))
+
+        if self.metric == 'cosine':
+            denom = q_norm * norms[candidates]
+            scores = np.divide(dots, denom, out=np.zeros_like(dots), where=denom > 0)
+            order = np.lexsort((candidates, -scores))[:k]
+        else:
+            scores = q_norm ** 2 + norms[candidates] ** 2 - 2 * dots
+            order = np.lexsort((candidates, scores))[:k]
+
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+
+    def query(self, queries: CSRMatrix, k: int = 1, probes: int = PROBES) -> List[List[Tuple[str, float]]]:
+        """
+        :param queries: the query matrix, aligned to the index's vocabulary if it uses another one.
+        :param k: the number of neighbours to return per query.
+        :param probes: the number of extra buckets probed per table.
+        :return: for each query, up to k (document key, score) pairs, best first.
+        """
+        norms = row_norms(queries)
+        queries = align(queries, self.vocab)
+        projections = self._project(queries)
+        codes = self._hash(projections)
+        out = []
+
+        for i in range(len(queries.keys)):
+            candidates = self._candidates(codes[i], projections[i], probes)
+            if len(candidates) == 0:
+                out.append([])
+                continue
+            b, e = queries.indptr[i], queries.indptr[i + 1]
+            order = np.argsort(queries.indices[b:e])
+            q_terms = queries.indices[b:e][order].astype(np.int64)
+            q_data = queries.data[b:e][order]
+            out.append([(self.keys[j], s) for j, s in self._rerank(q_terms, q_data, norms[i], candidates, k)])
+
+        return out
+
+    def most_similar(self, queries: CSRMatrix, probes: int = PROBES) -> Dict[str, str]:
+        """
+        :return: a dictionary mapping each query key to the key of its approximate nearest neighbour, or None.
+        """
+        return {key: r[0][0] if r else None for key, r in zip(queries.keys, self.query(queries, 1, probes))}
+
+    def save(self, filename: str):
+        np.savez(filename,
+                 config=np.array([self.n_tables, self.n_bits, self.seed], dtype=np.int64),
+                 metric=np.array(self.metric),
+                 terms=np.array(self.vocab.terms, dtype=str),
+                 keys=np.array(self.keys, dtype=str),
+                 codes=np.frombuffer(self.codes, dtype=np.uint64),
+                 indptr=np.frombuffer(self.indptr, dtype=np.int64),
+                 indices=np.frombuffer(self.indices, dtype=np.int64),
+                 data=np.frombuffer(self.data, dtype=np.float64),
+                 norms=np.frombuffer(self.norms, dtype=np.float64))
+
+    @classmethod
+    def load(cls, filename: str) -> 'LSHIndex':
+        """
+        :return: the index saved by save(), together with a fresh copy of its vocabulary (see the vocab field).
+        Terms and keys are stored as fixed-width unicode arrays, so nothing is unpickled from the file.
+        """
+        f = np.load(filename, allow_pickle=False)
+        n_tables, n_bits, seed = f['config'].tolist()
+        index = cls(Vocabulary(f['terms'].tolist()), n_tables, n_bits, str(f['metric']), seed)
+        index.keys = f['keys'].tolist()
+        index.codes.extend(f['codes'].tolist())
+        index.indptr = array('q', f['indptr'].tolist())
+        index.indices.extend(f['indices'].tolist())
+        index.data.extend(f['data'].tolist())
+        index.norms.extend(f['norms'].tolist())
+
+        codes = f['codes'].reshape(-1, n_tables)
+        for table, column in zip(index.tables, codes.T.tolist()):
+            for i, code in enumerate(column):
+                table.setdefault(code, []).append(i)
+
+        return index
+
+
+def recall_at_k(truth: Dict[str, str], results: List[List[Tuple[str, float]]], keys: List[str]) -> float:
+    """
+    :param truth: the exact nearest neighbour of each query key.
+    :param results: the approximate results of the queries in the order of keys.
+    :return: the fraction of queries whose exact nearest neighbour is among their returned neighbours.
+    """
+    hits = sum(1 for key, r in zip(keys, results) if truth[key] in {t for t, _ in r})
+    return hits / len(keys)
+
+
+if __name__ == '__main__':
+    import time
+    from tfidf import vectorize, to_dicts
+    from similarity import CosineSearch
+    from vector_space_models import most_similar
+
+    fables = json.load(open('../../res/vsm/aesopfables.json'))
+    fables_alt = json.load(open('../../res/vsm/aesopfables-alt.json'))
+
+    vocab = Vocabulary()
+    Y = vectorize(fables, vocab=vocab)
+    X = vectorize(fables_alt, vocab=vocab)
+    Yd, Xd = to_dicts(Y), to_dicts(X)
+
+    st = time.time()
+    truths = {'euclidean': {k: most_similar(Yd, x) for k, x in Xd.items()}}
+    print('brute force most_similar: {:.4f}s'.format(time.time() - st))
+    truths['cosine'] = CosineSearch(Y).most_similar(X)
+
+    for metric, truth in truths.items():
+        for n_tables, n_bits in [(4, 16), (8, 12), (16, 8), (32, 6), (48, 6)]:
+            index = LSHIndex(vocab, n_tables, n_bits, metric=metric)
+            index.add(Y)
+            for probes in [0, 2]:
+                default = ' (default)' if (n_tables, n_bits, probes) == (N_TABLES, N_BITS, PROBES) else ''
+                for k in [1, 5]:
+                    st = time.time()
+                    results = index.query(X, k, probes)
+                    print('{}, tables: {:2d}, bits: {:2d}, probes: {}, recall@{}: {:.3f}, {:.4f}s{}'.format(
+                        metric, n_tables, n_bits, probes, k, recall_at_k(truth, results, X.keys), time.time() - st, default))
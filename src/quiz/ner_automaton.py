@@ -0,0 +1,249 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+from collections import deque
+from typing import Iterable, Tuple, Any, List, Set, Sequence, Dict, NamedTuple, Callable, Optional
+
+import numpy as np
+
+from tfidf import Vocabulary
+
+BATCH_SIZE = 512
+
+
+class TokenBatch(NamedTuple):
+    """
+    Documents sorted by length in descending order, so that the documents still active at any position are a prefix.
+    """
+    order: np.ndarray     # order[j] = the input index of the j'th document
+    lengths: np.ndarray
+    tokens: np.ndarray    # (n_documents x max_length) token IDs; -1 for tokens in no entry and padding
+
+
+class TokenAutomaton:
+    """
+    An Aho-Corasick automaton whose transitions are over token IDs rather than characters, so every match is
+    token-aligned by construction. Transitions are stored as sorted (state * n_tokens + token) keys, and a batch of
+    documents is matched position by position, with the states of all documents stepped at once.
+    Entry e is the token sequence of spans[e], labeled values[e]; a match is a (start, end, entry ID) row,
+    the end token index being exclusive.
+    With a normalizer (e.g., ner_normalize.TokenNormalizer), entries and documents are matched on their normalized
+    tokens; entries that normalize alike are merged into one, and matches keep the offsets of the original tokens.
+    """
+    def __init__(self, vocab: Any, spans: Sequence[str], values: Sequence[Set[Any]], keys: np.ndarray,
+                 targets: np.ndarray, fail: np.ndarray, output: np.ndarray, link: np.ndarray, depth: np.ndarray,
+                 normalize: Optional[Callable[[str], str]] = None):
+        """
+        :param vocab: the token vocabulary, with get(token, default) and len().
+        :param keys: the sorted transition keys state * len(vocab) + token ID.
+        :param targets: the state each transition goes to.
+        :param fail: the failure state of every state, the longest proper suffix that is also a prefix of an entry.
+        :param output: the entry ID ending at every state, or -1.
+        :param link: the nearest state along the failure chain with an output, or -1.
+        :param depth: the number of tokens of every state.
+        :param normalize: maps a token to the form it is looked up in the vocabulary by; None for exact matching.
+        """
+        self.vocab = vocab
+        self.spans = spans
+        self.values = values
+        self.keys = keys
+        self.targets = targets
+        self.fail = fail
+        self.output = output
+        self.link = link
+        self.depth = depth
+        self.normalize = normalize
+
+    @classmethod
+    def build(cls, data: Iterable[Tuple[str, Any]], normalize: Optional[Callable[[str], str]] = None) -> 'TokenAutomaton':
+        """
+        :param data: a collection of (span, value) pairs, as quiz4.create_ac() takes; spans are split on whitespace.
+        :param normalize: applied to every token of the spans here and of the documents when matching.
+        """
+        vocab, entries = Vocabulary(), dict()
+        spans, values = [], []
+        for span, value in data:
+            tokens = span.split()
+            if normalize: tokens = map(normalize, tokens)
+            ids = tuple(vocab.add(t) for t in tokens)
+            if not ids: continue
+            e = entries.get(ids)
+            if e is None:
+                e = entries[ids] = len(spans)
+                spans.append(span)
+                values.append(set())
+            values[e].add(value)
+
+        goto: List[Dict[int, int]] = [dict()]
+        output = [-1]
+        for ids, e in entries.items():
+            s = 0
+            for t in ids:
+                nxt = goto[s].get(t)
+                if nxt is None:
+                    nxt = goto[s][t] = len(goto)
+                    goto.append(dict())
+                    output.append(-1)
+                s = nxt
+            output[s] = e
+
+        n = len(goto)
+        fail, link, depth = [0] * n, [-1] * n, [0] * n
+        queue = deque(goto[0].values())
+        for s in queue: depth[s] = 1
+        while queue:
+            s = queue.popleft()
+            for t, c in goto[s].items():
+                f = fail[s]
+                while f and t not in goto[f]: f = fail[f]
+                fail[c] = goto[f].get(t, 0)
+                link[c] = fail[c] if output[fail[c]] >= 0 else link[fail[c]]
+                depth[c] = depth[s] + 1
+                queue.append(c)
+
+        V = len(vocab)
+        trans = sorted((s * V + t, c) for s in range(n) for t, c in goto[s].items())
+        keys = np.array([k for k, _ in trans], dtype=np.int64)
+        targets = np.array([c for _, c in trans], dtype=np.int64)
+        return cls(vocab, spans, values, keys, targets, np.array(fail, dtype=np.int64),
+                   np.array(output, dtype=np.int64), np.array(link, dtype=np.int64), np.array(depth, dtype=np.int64),
+                   normalize)
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+    def encode(self, documents: Sequence[Sequence[str]]) -> TokenBatch:
+        lengths = np.array([len(d) for d in documents], dtype=np.int64)
+        order = np.argsort(-lengths, kind='stable')
+        tokens = np.full((len(documents), lengths.max(initial=0)), -1, dtype=np.int64)
+        get = self.vocab.get
+        if self.normalize:
+            # token -> ID of its normalized form, so each distinct token of the batch is normalized once
+            norm, ids = self.normalize, dict()
+            get = lambda t, default: ids[t] if t in ids else ids.setdefault(t, self.vocab.get(norm(t), default))
+        for j, i in enumerate(order.tolist()):
+            tokens[j, :lengths[i]] = [get(t, -1) for t in documents[i]]
+        return TokenBatch(order, lengths[order], tokens)
+
+    def _goto(self, states: np.ndarray, tokens: np.ndarray) -> np.ndarray:
+        """
+        :return: the next state of every (state, token) pair, following failure links until a transition exists.
+        """
+        V = len(self.vocab)
+        out = np.zeros(len(states), dtype=np.int64)
+        pending = np.flatnonzero(tokens >= 0)
+        s = states[pending]
+        while len(pending):
+            keys = s * V + tokens[pending]
+            i = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+            found = self.keys[i] == keys if len(self.keys) else np.zeros(len(keys), dtype=bool)
+            out[pending[found]] = self.targets[i[found]]
+            # the root has a transition for no other token, so those stay at 0
+            more = ~found & (s > 0)
+            pending, s = pending[more], self.fail[s[more]]
+        return out
+
+    def match_batch(self, documents: Sequence[Sequence[str]]) -> List[np.ndarray]:
+        """
+        :param documents: lists of tokens.
+        :return: for every document, an (n_matches x 3) array of (start, end, entry ID) rows sorted by end index
+                 and then from the longest match, i.e., the order of pyahocorasick's iter().
+        """
+        out = []
+        for s in range(0, len(documents), BATCH_SIZE):
+            batch = self.encode(documents[s:s + BATCH_SIZE])
+            out.extend(self._match(batch))
+        return out
+
+    def match(self, tokens: Sequence[str]) -> np.ndarray:
+        return self.match_batch([tokens])[0]
+
+    def _match(self, batch: TokenBatch) -> List[np.ndarray]:
+        n, L = batch.tokens.shape
+        states = np.zeros(n, dtype=np.int64)
+        docs, ends, states_hit = [], [], []
+
+        for i in range(L):
+            b = int(np.count_nonzero(batch.lengths > i))
+            states[:b] = self._goto(states[:b], batch.tokens[:b, i])
+            # every state along the output links of the current states is a match ending here
+            t = np.where(self.output[states[:b]] >= 0, states[:b], self.link[states[:b]])
+            d = np.flatnonzero(t >= 0)
+            t = t[d]
+            while len(d):
+                docs.append(d)
+                ends.append(np.full(len(d), i + 1, dtype=np.int64))
+                states_hit.append(t)
+                t = self.link[t]
+                d, t = d[t >= 0], t[t >= 0]
+
+        docs = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int64)
+        ends = np.concatenate(ends) if ends else np.zeros(0, dtype=np.int64)
+        hit = np.concatenate(states_hit) if states_hit else np.zeros(0, dtype=np.int64)
+        starts = ends - self.depth[hit]
+        order = np.lexsort((starts, ends, docs))
+        rows = np.stack([starts, ends, self.output[hit]], axis=1)[order]
+        bounds = np.searchsorted(docs[order], np.arange(n + 1))
+
+        out = [None] * n
+        for j, i in enumerate(batch.order.tolist()): out[i] = rows[bounds[j]:bounds[j + 1]]
+        return out
+
+    def entities(self, tokens: Sequence[str], matches: np.ndarray = None) -> List[Tuple[str, int, int, Set[Any]]]:
+        """
+        :return: the matches as the (span, start, end, values) tuples of quiz4.match(); with a normalizer,
+                 the span is the text of the matched tokens rather than that of the entry.
+        """
+        if matches is None: matches = self.match(tokens)
+        if self.normalize: return [(' '.join(tokens[s:t]), s, t, self.values[e]) for s, t, e in matches.tolist()]
+        return [(self.spans[e], s, t, self.values[e]) for s, t, e in matches.tolist()]
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    import quiz4
+
+    gaz_dir = '../../res/ner'
+    data = list(quiz4.iter_gazetteers(gaz_dir))
+    st = time.time()
+    AC = quiz4.create_ac(data)
+    print('pyahocorasick build: {:.4f}s'.format(time.time() - st))
+    st = time.time()
+    TA = TokenAutomaton.build(data)
+    print('TokenAutomaton build: {:.4f}s, {:,} entries, {:,} states'.format(time.time() - st, len(TA), len(TA.fail)))
+
+    # documents mixing gazetteer entries with filler words
+    rand = random.Random(0)
+    filler = 'the of and a to in is was for on that with'.split()
+    documents = []
+    for _ in range(2000):
+        doc = []
+        while len(doc) < 200:
+            doc.extend(rand.choice(data)[0].split() if rand.random() < 0.3 else [rand.choice(filler)])
+        documents.append(doc)
+    tokens = sum(len(d) for d in documents)
+
+    st = time.time()
+    expected = [quiz4.match(AC, d) for d in documents]
+    print('quiz4.match: {:,.0f} tokens/sec'.format(tokens / (time.time() - st)))
+    st = time.time()
+    actual = TA.match_batch(documents)
+    print('TokenAutomaton.match_batch: {:,.0f} tokens/sec'.format(tokens / (time.time() - st)))
+
+    # pyahocorasick keys on the exact span string, so compare on (start, end, values)
+    same = all(sorted((s, e, frozenset(v)) for _, s, e, v in ex) == sorted((s, e, frozenset(TA.values[i])) for s, e, i in ac.tolist())
+               for ex, ac in zip(expected, actual))
+    print('same matches: {}'.format(same))
@@ -0,0 +1,217 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+Converts between entity spans and BIO/BILOU/IOBES tags for whole batches of documents at once.
+The tags of a batch are one flat integer array with the offsets of every document, as the rows of an EncodedCorpus;
+spans are parallel arrays of document index, start and end (exclusive) token index, and label ID.
+"""
+from typing import List, Tuple, Dict, Sequence, Iterable, NamedTuple
+
+import numpy as np
+
+# the prefixes of the (begin, inside, last, unit) tokens of an entity
+SCHEMES: Dict[str, Tuple[str, str, str, str]] = {
+    'BIO': ('B', 'I', 'I', 'B'),
+    'BILOU': ('B', 'I', 'L', 'U'),
+    'IOBES': ('B', 'I', 'E', 'S'),
+}
+OUTSIDE = 'O'
+
+
+class Spans(NamedTuple):
+    doc: np.ndarray
+    start: np.ndarray
+    end: np.ndarray
+    label: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.doc)
+
+
+class Scores(NamedTuple):
+    correct: int
+    gold: int
+    pred: int
+
+    @property
+    def precision(self) -> float:
+        return 100.0 * self.correct / self.pred if self.pred else 0.0
+
+    @property
+    def recall(self) -> float:
+        return 100.0 * self.correct / self.gold if self.gold else 0.0
+
+    @property
+    def f1(self) -> float:
+        p, r = self.precision, self.recall
+        return 2 * p * r / (p + r) if p + r else 0.0
+
+
+def offsets(lengths: Sequence[int]) -> np.ndarray:
+    """
+    :return: ptr such that the tokens of document i are ptr[i]:ptr[i+1] of the flat array.
+    """
+    ptr = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=ptr[1:])
+    return ptr
+
+
+class TagCodec:
+    """
+    Tag ID 0 is O, and the tag of prefix p for label l is 1 + l * len(prefixes) + p,
+    where prefixes are the distinct prefixes of the scheme in the order they appear in SCHEMES.
+    """
+    def __init__(self, labels: Iterable[str], scheme: str = 'BILOU'):
+        self.labels: List[str] = list(labels)
+        self.label_index: Dict[str, int] = {label: i for i, label in enumerate(self.labels)}
+        self.scheme = scheme
+        roles = SCHEMES[scheme]
+        self.prefixes: List[str] = list(dict.fromkeys(roles))
+        self.begin, self.inside, self.last, self.unit = (self.prefixes.index(p) for p in roles)
+        self.tags: List[str] = [OUTSIDE] + ['{}-{}'.format(p, label) for label in self.labels for p in self.prefixes]
+        self.tag_index: Dict[str, int] = {tag: i for i, tag in enumerate(self.tags)}
+
+        # a prefix starts (ends) an entity only if no continuing token uses it, i.e., never in BIO for the end
+        P = len(self.prefixes)
+        self._starts = np.zeros(P, dtype=bool)
+        self._starts[[self.begin, self.unit]] = True
+        self._starts[[self.inside, self.last]] = False
+        self._ends = np.zeros(P, dtype=bool)
+        self._ends[[self.last, self.unit]] = True
+        self._ends[[self.begin, self.inside]] = False
+
+    def spans(self, documents: Sequence[Sequence[Tuple[str, int, int, str]]]) -> Spans:
+        """
+        :param documents: the entities of every document as (span, start, end, label) tuples, as quiz4.to_bilou() takes.
+        """
+        rows = [(d, s, e, self.label_index[label]) for d, entities in enumerate(documents) for _, s, e, label in entities]
+        cols = np.array(rows, dtype=np.int64).reshape(-1, 4).T
+        return Spans(*cols)
+
+    def encode(self, lengths: Sequence[int], spans: Spans) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param lengths: the number of tokens of every document.
+        :param spans: non-overlapping entities, e.g., as quiz4.remove_overlaps() returns.
+        :return: the flat tag IDs and the document offsets (see offsets()).
+        """
+        ptr = offsets(lengths)
+        tags = np.zeros(ptr[-1], dtype=np.int32)
+        if not len(spans): return tags, ptr
+
+        start = ptr[spans.doc] + spans.start
+        end = ptr[spans.doc] + spans.end
+        base = 1 + spans.label * len(self.prefixes)
+        # inside tokens first, so that the begin and last tokens of 2-token entities overwrite nothing
+        n = np.maximum(end - start - 2, 0)
+        first = np.cumsum(n) - n
+        tags[np.repeat(start + 1 - first, n) + np.arange(n.sum())] = np.repeat(base + self.inside, n)
+        tags[end - 1] = base + self.last
+        tags[start] = np.where(end - start == 1, base + self.unit, base + self.begin)
+        return tags, ptr
+
+    def decode(self, tags: np.ndarray, ptr: np.ndarray) -> Spans:
+        """
+        Reads entities as conlleval does: an entity starts at a begin or unit prefix, or where the label changes,
+        or after an O, a last or unit prefix, or the document start, so that ill-formed sequences still decode.
+        :return: the entities of every document in order.
+        """
+        tags = np.asarray(tags, dtype=np.int64)
+        P = len(self.prefixes)
+        inside = tags > 0
+        label = (tags - 1) // P
+        prefix = (tags - 1) % P
+
+        boundary = np.zeros(len(tags), dtype=bool)
+        boundary[ptr[:-1][ptr[:-1] < len(tags)]] = True   # the first token of every non-empty document
+        prev = np.roll(np.arange(len(tags)), 1)
+        start = inside & (boundary | ~inside[prev] | (label[prev] != label) | self._starts[prefix] | self._ends[prefix[prev]])
+        # an entity ends where the next token is O, starts a new entity, or begins another document
+        following = np.append(start[1:] | ~inside[1:] | boundary[1:], True)
+        end = inside & following
+
+        starts, ends = np.flatnonzero(start), np.flatnonzero(end) + 1
+        doc = np.searchsorted(ptr, starts, side='right') - 1
+        return Spans(doc, starts - ptr[doc], ends - ptr[doc], label[starts])
+
+    def to_strings(self, tags: np.ndarray, ptr: np.ndarray) -> List[List[str]]:
+        names = np.array(self.tags, dtype=object)[tags]
+        return [names[ptr[i]:ptr[i + 1]].tolist() for i in range(len(ptr) - 1)]
+
+    def from_strings(self, documents: Sequence[Sequence[str]]) -> Tuple[np.ndarray, np.ndarray]:
+        index = self.tag_index
+        return np.array([index[t] for tags in documents for t in tags], dtype=np.int32), offsets([len(d) for d in documents])
+
+
+def evaluate(gold: Spans, pred: Spans) -> Scores:
+    """
+    :return: the span-level counts, where a predicted entity is correct if its document, offsets and label all match.
+    """
+    # one integer key per span; the spans of a batch are unique, so matches are the intersection
+    M = int(max(gold.end.max(initial=0), pred.end.max(initial=0))) + 1
+    L = int(max(gold.label.max(initial=0), pred.label.max(initial=0))) + 1
+    def keys(s: Spans) -> np.ndarray:
+        return ((s.doc * M + s.start) * M + s.end) * L + s.label
+    correct = len(np.intersect1d(keys(gold), keys(pred), assume_unique=True))
+    return Scores(correct, len(gold), len(pred))
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    import quiz4
+
+    rand = random.Random(0)
+    labels = ['country', 'language', 'us_city', 'us_state', 'us_people_male']
+    lengths, documents = [], []
+    for _ in range(50000):
+        n, entities, i = rand.randint(1, 60), [], 0
+        while True:
+            i += rand.randint(0, 5)
+            e = i + rand.randint(1, 4)
+            if e > n: break
+            entities.append(('', i, e, rand.choice(labels)))
+            i = e
+        lengths.append(n)
+        documents.append(entities)
+    tokens = sum(lengths)
+
+    for scheme in SCHEMES:
+        codec = TagCodec(labels, scheme)
+        spans = codec.spans(documents)
+        tags, ptr = codec.encode(lengths, spans)
+        assert all(np.array_equal(a, b) for a, b in zip(codec.decode(tags, ptr), spans)), scheme
+    print('round trip: ok')
+
+    codec = TagCodec(labels)
+    spans = codec.spans(documents)
+    st = time.time()
+    expected = [quiz4.to_bilou(['w'] * n, entities) for n, entities in zip(lengths, documents)]
+    print('quiz4.to_bilou: {:,.0f} tokens/sec'.format(tokens / (time.time() - st)))
+    st = time.time()
+    tags, ptr = codec.encode(lengths, spans)
+    print('TagCodec.encode: {:,.0f} tokens/sec'.format(tokens / (time.time() - st)))
+    assert codec.to_strings(tags, ptr) == expected
+    st = time.time()
+    decoded = codec.decode(tags, ptr)
+    print('TagCodec.decode: {:,.0f} tokens/sec'.format(tokens / (time.time() - st)))
+
+    # drop and relabel some predictions for the evaluation
+    keep = np.array([rand.random() < 0.9 for _ in range(len(decoded))])
+    label = np.where(np.array([rand.random() < 0.05 for _ in range(len(decoded))]), 0, decoded.label)
+    pred = Spans(decoded.doc[keep], decoded.start[keep], decoded.end[keep], label[keep])
+    st = time.time()
+    scores = evaluate(spans, pred)
+    print('evaluate: {:.4f}s, P {:.2f} R {:.2f} F1 {:.2f}'.format(time.time() - st, scores.precision, scores.recall, scores.f1))
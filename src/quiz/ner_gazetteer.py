@@ -0,0 +1,205 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+Compiles a gazetteer directory into a TokenAutomaton file in the binfile container: the token vocabulary and
+entry spans as StringTables, the transition, failure and output arrays, and the labels of every entry as a bitmask
+over the label names stored in the header, as well as the settings of its TokenNormalizer if any.
+Loading maps the file, so services start without reading any gazetteer.
+
+Usage: python ner_gazetteer.py DIRNAME FILENAME [--normalize] [--benchmark]
+"""
+import argparse
+import glob
+import hashlib
+import os
+from typing import Dict, List, Set, Sequence, Any, Optional
+
+import numpy as np
+
+import binfile
+from ner_automaton import TokenAutomaton
+from ner_normalize import TokenNormalizer
+from string_table import StringTable
+
+MAGIC = b'NERGAZ'
+VERSION = 1
+MAX_LABELS = 64
+
+
+class LabelSets:
+    """
+    The label set of every entry, stored as uint64 bitmasks over a list of up to 64 label names.
+    """
+    def __init__(self, masks: np.ndarray, labels: Sequence[str]):
+        self.masks = masks
+        self.labels = list(labels)
+
+    @classmethod
+    def build(cls, values: Sequence[Set[str]]) -> 'LabelSets':
+        labels = sorted({v for vs in values for v in vs})
+        if len(labels) > MAX_LABELS: raise ValueError('At most {} labels are supported: {}'.format(MAX_LABELS, len(labels)))
+        bit = {label: 1 << i for i, label in enumerate(labels)}
+        return cls(np.array([sum(bit[v] for v in vs) for vs in values], dtype=np.uint64), labels)
+
+    def __len__(self) -> int:
+        return len(self.masks)
+
+    def __getitem__(self, i: int) -> Set[str]:
+        mask = int(self.masks[i])
+        return {label for j, label in enumerate(self.labels) if mask >> j & 1}
+
+
+def sources(dirname: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(dirname, '*.txt')))
+
+
+def _digest(filename: str) -> str:
+    h = hashlib.sha1()
+    with open(filename, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1 << 20), b''): h.update(chunk)
+    return h.hexdigest()
+
+
+def _fingerprint(filename: str) -> Dict[str, Any]:
+    stat = os.stat(filename)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': _digest(filename)}
+
+
+def _fingerprints(dirname: str) -> Dict[str, Dict[str, Any]]:
+    return {os.path.basename(f): _fingerprint(f) for f in sources(dirname)}
+
+
+def save(filename: str, automaton: TokenAutomaton, meta: Optional[Dict[str, Any]] = None):
+    """
+    :param automaton: an automaton whose values are sets of label strings, e.g., built from quiz4.iter_gazetteers().
+    :param meta: JSON-serializable metadata stored in the header, e.g., the fingerprints of the sources.
+    """
+    vocab = automaton.vocab if isinstance(automaton.vocab, StringTable) else StringTable.build(automaton.vocab.terms)
+    spans = automaton.spans if isinstance(automaton.spans, StringTable) else StringTable.build(automaton.spans)
+    values = automaton.values if isinstance(automaton.values, LabelSets) else LabelSets.build(automaton.values)
+    arrays = dict(vocab.arrays('vocab'))
+    arrays.update(spans.arrays('spans'))
+    arrays['masks'] = values.masks
+    arrays['keys'] = np.asarray(automaton.keys, dtype=np.int64)
+    for name in ['targets', 'fail', 'output', 'link', 'depth']:
+        arrays[name] = np.asarray(getattr(automaton, name), dtype=np.int32)
+    normalizer = automaton.normalize.config() if automaton.normalize else None
+    binfile.write(filename, MAGIC, VERSION, arrays, dict(meta or {}, labels=values.labels, normalizer=normalizer))
+
+
+def load(filename: str, mmap: bool = True) -> TokenAutomaton:
+    arrays, meta = binfile.read(filename, MAGIC, VERSION, mmap)
+    normalizer = meta.get('normalizer')
+    return TokenAutomaton(StringTable.from_arrays(arrays, 'vocab'), StringTable.from_arrays(arrays, 'spans'),
+                          LabelSets(arrays['masks'], meta['labels']), arrays['keys'], arrays['targets'],
+                          arrays['fail'], arrays['output'], arrays['link'], arrays['depth'],
+                          TokenNormalizer.from_config(normalizer) if normalizer else None)
+
+
+def compile_gazetteers(dirname: str, filename: str, normalizer: Optional[TokenNormalizer] = None):
+    """
+    Builds the automaton of every *.txt file in the directory, labeled by the file name as quiz4.read_gazetteers()
+    does, and saves it with the modification time, size and SHA-1 of every source.
+    :param normalizer: if given, entries and documents are matched on their normalized tokens.
+    """
+    import quiz4
+    automaton = TokenAutomaton.build(quiz4.iter_gazetteers(dirname), normalizer)
+    save(filename, automaton, {'sources': _fingerprints(dirname)})
+
+
+def _current_sources(dirname: str, meta: Dict[str, Any], normalizer: Optional[TokenNormalizer] = None) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    :param meta: the metadata of the compiled file.
+    :return: the fingerprints of the sources if the compiled file is up to date, with the modification times and sizes
+             of the sources that were touched but not changed refreshed; None if the file must be rebuilt.
+    """
+    if meta.get('normalizer') != (normalizer.config() if normalizer else None): return None
+    recorded = meta.get('sources', {})
+    current = sources(dirname)
+    if sorted(recorded) != [os.path.basename(f) for f in current]: return None
+
+    fingerprints = dict()
+    for f in current:
+        r, stat = recorded[os.path.basename(f)], os.stat(f)
+        size = r.get('size', stat.st_size)   # files compiled before sizes were recorded
+        if stat.st_mtime == r['mtime'] and stat.st_size == size: fingerprints[os.path.basename(f)] = r
+        # a changed modification time alone does not trigger a rebuild if the content is the same
+        elif stat.st_size == size and _digest(f) == r['sha1']:
+            fingerprints[os.path.basename(f)] = dict(r, mtime=stat.st_mtime, size=stat.st_size)
+        else: return None
+    return fingerprints
+
+
+def cached_gazetteers(dirname: str, filename: str, normalizer: Optional[TokenNormalizer] = None) -> TokenAutomaton:
+    """
+    Loads the compiled automaton from filename, or compiles the gazetteers in dirname there first if the file
+    does not exist, was written by another format version or with other normalization settings,
+    or a source was added, removed or changed. If sources were only touched, their new modification times are
+    written back to the file, so that they are not hashed again on every later call.
+    """
+    try:
+        meta = binfile.read_header(filename, MAGIC, VERSION)['meta']
+        fingerprints = _current_sources(dirname, meta, normalizer)
+        if fingerprints is not None:
+            if fingerprints != meta.get('sources'): binfile.update_meta(filename, MAGIC, VERSION, dict(meta, sources=fingerprints))
+            return load(filename)
+    except (OSError, binfile.FormatError):
+        pass
+
+    compile_gazetteers(dirname, filename, normalizer)
+    return load(filename)
+
+
+def benchmark(dirname: str, filename: str):
+    import time
+    import quiz4
+
+    if os.path.exists(filename): os.remove(filename)
+    st = time.time()
+    quiz4.read_gazetteers(dirname)
+    print('quiz4.read_gazetteers: {:.4f}s'.format(time.time() - st))
+    st = time.time()
+    cached_gazetteers(dirname, filename)
+    print('compile: {:.4f}s, {:,} bytes'.format(time.time() - st, os.path.getsize(filename)))
+    st = time.time()
+    automaton = cached_gazetteers(dirname, filename)
+    print('load: {:.4f}s'.format(time.time() - st))
+
+    # a touched source is hashed once, and its new modification time is recorded instead of recompiling
+    source = sources(dirname)[0]
+    os.utime(source)
+    for label in ['load after touch', 'load']:
+        st = time.time()
+        cached_gazetteers(dirname, filename)
+        print('{}: {:.4f}s'.format(label, time.time() - st))
+
+    tokens = 'Jinho is a professor at Emory University in Atlanta , Georgia in the United States of America'.split()
+    print(automaton.entities(tokens))
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description='Compiles a gazetteer directory into an automaton file.')
+    parser.add_argument('dirname', help='the directory of *.txt gazetteers, one entry per line, labeled by file name')
+    parser.add_argument('filename', help='the automaton file to write')
+    parser.add_argument('-n', '--normalize', action='store_true', help='matches on case-folded, normalized tokens')
+    parser.add_argument('-b', '--benchmark', action='store_true', help='compares compiling and loading with quiz4.read_gazetteers()')
+    args = parser.parse_args(argv)
+    if args.benchmark: benchmark(args.dirname, args.filename)
+    else: compile_gazetteers(args.dirname, args.filename, TokenNormalizer() if args.normalize else None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+from bisect import bisect_right
+from typing import Tuple, List, Dict, Set, Sequence, Callable
+
+Entity = Tuple[str, int, int, Set[str]]   # (span, start token index, end token index (exclusive), values)
+Weight = Callable[[Entity], float]
+
+
+def span_length(entity: Entity) -> float:
+    """
+    :return: the number of tokens the entity covers; maximizing it maximizes the covered tokens.
+    """
+    return entity[2] - entity[1]
+
+
+def label_priority(priorities: Dict[str, float], default: float = 1.0) -> Weight:
+    """
+    :param priorities: the weight of each label, e.g., {'us_city': 2.0, 'us_state': 1.0}.
+    :return: a weight function of the highest priority among the entity's labels.
+    """
+    return lambda e: max((priorities.get(v, default) for v in e[3]), default=default)
+
+
+def confidence(scores: Dict[Tuple[str, str], float], default: float = 1.0) -> Weight:
+    """
+    :param scores: the confidence of each (span, label) gazetteer entry.
+    :return: a weight function of the highest confidence among the entity's labels.
+    """
+    return lambda e: max((scores.get((e[0], v), default) for v in e[3]), default=default)
+
+
+def product(*weights: Weight) -> Weight:
+    """
+    :return: a weight function that multiplies the given ones, e.g., product(span_length, label_priority(p))
+             to prefer covering more tokens with higher-priority labels.
+    """
+    def weight(e: Entity) -> float:
+        w = 1.0
+        for f in weights: w *= f(e)
+        return w
+    return weight
+
+
+def schedule(entities: Sequence[Entity], weight: Weight = span_length) -> List[Entity]:
+    """
+    Weighted interval scheduling in O(n log n): sorts the entities by end index, and for each one finds the last
+    compatible entity (one that ends at or before its start) by binary search, then keeps the better of
+    skipping it or taking it on top of the best solution up to the compatible one.
+    Among solutions of equal weight, the one with fewer (hence longer) entities wins.
+    :return: the non-overlapping entities of the maximum total weight, sorted by end index.
+    """
+    order = sorted(entities, key=lambda e: (e[2], e[1]))
+    ends = [e[2] for e in order]
+    # best[j] = (total weight, -number of entities) of the first j entities; took[j] = whether entity j-1 is in it
+    best: List[Tuple[float, int]] = [(0.0, 0)]
+    took, prev = [False], [0]
+
+    for j, e in enumerate(order):
+        p = bisect_right(ends, e[1], 0, j)
+        take = (best[p][0] + weight(e), best[p][1] - 1)
+        if take > best[j]:
+            best.append(take)
+            took.append(True)
+            prev.append(p)
+        else:
+            best.append(best[j])
+            took.append(False)
+            prev.append(j)
+
+    out, j = [], len(order)
+    while j > 0:
+        if took[j]: out.append(order[j - 1])
+        j = prev[j]
+    out.reverse()
+    return out
+
+
+if __name__ == '__main__':
+    import itertools
+    import random
+    import time
+    import quiz4
+
+    def overlaps(n: int, length: int, seed: int = 0) -> List[Entity]:
+        rand = random.Random(seed)
+        out = []
+        for i in range(n):
+            s = rand.randrange(n)
+            out.append(('e{}'.format(i), s, s + rand.randint(1, length), {'label'}))
+        return out
+
+    def disjoint(subset: Sequence[Entity]) -> bool:
+        subset = sorted(subset, key=lambda e: e[1])
+        return all(a[2] <= b[1] for a, b in zip(subset, subset[1:]))
+
+    # exhaustive check against every subset on small clusters
+    for seed in range(200):
+        entities = overlaps(10, 4, seed)
+        subsets = (c for k in range(len(entities) + 1) for c in itertools.combinations(entities, k))
+        best = max(sum(map(span_length, c)) for c in subsets if disjoint(c))
+        assert sum(map(span_length, schedule(entities))) == best
+
+    for n in [30, 1000, 10000, 100000]:
+        entities = overlaps(n, 8)
+        st = time.time()
+        kept = schedule(entities)
+        print('{:>7,} spans: {:.4f}s, {:,} kept covering {:,} tokens'.format(n, time.time() - st, len(kept), sum(map(span_length, kept))))
+
+    entities = overlaps(14, 8)
+    st = time.time()
+    quiz4.bf_remove(list(entities))
+    print('bf_remove on 14 spans: {:.4f}s'.format(time.time() - st))
@@ -0,0 +1,135 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+Token normalization shared by building and matching a TokenAutomaton, so that "atlanta", "ATLANTA" and "Atlanta",
+or "St. Louis" and "Saint Louis", reach the same entry instead of each variant being added to the automaton.
+Every token maps to exactly one normalized token, so a match over the normalized tokens has the token offsets
+of the original ones.
+"""
+import unicodedata
+from typing import Dict, Any, Optional
+
+CACHE_SIZE = 1 << 16
+
+# ASCII equivalents of the punctuation that varies across sources
+PUNCTUATION = str.maketrans({
+    '‘': "'", '’': "'", '‚': "'", '‛': "'",
+    '“': '"', '”': '"', '„': '"', '‟': '"',
+    '‐': '-', '‑': '-', '‒': '-', '–': '-', '—': '-', '−': '-',
+    '.': None,
+})
+
+# abbreviations in place names, after case folding and punctuation normalization
+ALIASES = {
+    'st': 'saint',
+    'ste': 'sainte',
+    'ft': 'fort',
+    'mt': 'mount',
+    'pt': 'point',
+}
+
+
+class TokenNormalizer:
+    """
+    Maps a token to its normalized form: case folding, diacritic removal (é -> e), punctuation normalization
+    (curly quotes and dashes to ASCII, periods dropped so "St." -> "St"), then an alias table (st -> saint).
+    A token that would be left empty, e.g., ".", is kept as it is.
+    """
+    def __init__(self, casefold: bool = True, diacritics: bool = True, punctuation: bool = True,
+                 aliases: Optional[Dict[str, str]] = None):
+        """
+        :param aliases: normalized token -> normalized token; ALIASES if None, none if empty.
+        """
+        self.casefold = casefold
+        self.diacritics = diacritics
+        self.punctuation = punctuation
+        self.aliases = ALIASES if aliases is None else aliases
+        self._cache: Dict[str, str] = dict()
+
+    def __call__(self, token: str) -> str:
+        n = self._cache.get(token)
+        if n is None:
+            # the vocabulary of a stream is open-ended, so the cache is bounded by starting over
+            if len(self._cache) >= CACHE_SIZE: self._cache.clear()
+            n = self._cache[token] = self.normalize(token)
+        return n
+
+    def normalize(self, token: str) -> str:
+        n = token
+        if self.diacritics:
+            n = ''.join(c for c in unicodedata.normalize('NFKD', n) if not unicodedata.combining(c))
+        if self.casefold:
+            n = n.casefold()
+        if self.punctuation:
+            n = n.translate(PUNCTUATION) or token
+        return self.aliases.get(n, n)
+
+    def config(self) -> Dict[str, Any]:
+        """
+        :return: the JSON-serializable settings, stored with a compiled automaton so that it matches as it was built.
+        """
+        return {'casefold': self.casefold, 'diacritics': self.diacritics, 'punctuation': self.punctuation,
+                'aliases': self.aliases}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'TokenNormalizer':
+        return cls(**config)
+
+    def __getstate__(self):
+        return self.config()
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__init__(**state)
+
+
+if __name__ == '__main__':
+    import random
+    import time
+    import quiz4
+    from ner_automaton import TokenAutomaton
+
+    def nbytes(automaton: TokenAutomaton) -> int:
+        return sum(getattr(automaton, name).nbytes for name in ['keys', 'targets', 'fail', 'output', 'link', 'depth'])
+
+    def variants(span: str):
+        yield span
+        yield span.lower()
+        yield span.upper()
+        yield span.replace('Saint ', 'St. ').replace('Fort ', 'Ft. ').replace('Mount ', 'Mt. ')
+
+    data = list(quiz4.iter_gazetteers('../../res/ner'))
+    normalizer = TokenNormalizer()
+    automata = [('exact', TokenAutomaton.build(data)),
+                ('exact + variants', TokenAutomaton.build((v, label) for span, label in data for v in variants(span))),
+                ('normalized', TokenAutomaton.build(data, normalizer))]
+    for label, automaton in automata:
+        print('{:16}: {:,} entries, {:,} states, {:,} tokens, {:,} bytes'.format(
+            label, len(automaton), len(automaton.fail), len(automaton.vocab), nbytes(automaton)))
+
+    rand = random.Random(0)
+    filler = 'the of and a to in is was for on that with'.split()
+    documents = []
+    for _ in range(2000):
+        doc = []
+        while len(doc) < 200:
+            doc.extend(rand.choice(list(variants(rand.choice(data)[0]))).split() if rand.random() < 0.3 else [rand.choice(filler)])
+        documents.append(doc)
+    tokens = sum(len(d) for d in documents)
+
+    for label, automaton in automata:
+        st = time.time()
+        matches = automaton.match_batch(documents)
+        print('{:16}: {:,.0f} tokens/sec, {:,} matches'.format(label, tokens / (time.time() - st), sum(len(m) for m in matches)))
@@ -0,0 +1,248 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+The gazetteer tagger as one pipeline: tokenize -> match -> remove overlaps -> BILOU, over a stream of documents.
+Documents are cut into chunks that workers run through every stage, each worker loading the compiled automaton
+(see ner_gazetteer) once; parallel.ordered_map bounds the chunks in flight, so a slow writer holds back the reader,
+and yields the results in the input order.
+
+Usage: python ner_pipeline.py GAZETTEERS INPUT [-o OUTPUT] [-w WORKERS] [-t quiz1] [-n] [--cache DIR]
+       python ner_pipeline.py GAZETTEERS --check-backpressure [-w WORKERS]
+where GAZETTEERS is a compiled automaton file or a directory of *.txt gazetteers, and INPUT has one document per line.
+A directory is compiled into the cache directory, never into the directory itself.
+The output is in the CoNLL format: a token and its tag per line, and a blank line after each document.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from typing import List, Tuple, Dict, Set, Sequence, Iterable, Iterator, Callable, Optional
+
+import ner_gazetteer
+import quiz1
+import quiz4
+from corpus_reader import iter_lines
+from ner_automaton import TokenAutomaton
+from ner_intervals import Weight, label_priority, product, span_length
+from ner_normalize import TokenNormalizer
+from parallel import chunked, ordered_map
+
+CHUNK_SIZE = 256
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'cs329-ner')
+STAGES = ('tokenize', 'match', 'overlaps', 'bilou')
+TOKENIZERS: Dict[str, Callable[[str], List[str]]] = {'whitespace': str.split, 'quiz1': quiz1.tokenize}
+
+
+class Tagger:
+    """
+    Runs the stages over a chunk of documents and adds the seconds spent in each stage to a Counter.
+    """
+    def __init__(self, automaton: TokenAutomaton, tokenizer: str = 'whitespace', priorities: Optional[Dict[str, float]] = None):
+        """
+        :param tokenizer: the name of the tokenizer in TOKENIZERS.
+        :param priorities: the priority of each label; overlaps are then resolved by span length times the priority
+                           of the entity's best label, and an entity with several labels takes the best one
+                           (alphabetically first among ties). By span length and the alphabetically first label if None.
+        """
+        self.automaton = automaton
+        self.tokenize = TOKENIZERS[tokenizer]
+        self.priorities = priorities or dict()
+        self.weight: Weight = product(span_length, label_priority(self.priorities)) if priorities else span_length
+
+    def label(self, values: Set[str]) -> str:
+        return min(values, key=lambda v: (-self.priorities.get(v, 1.0), v))
+
+    def tag(self, documents: Sequence[str], times: Counter) -> List[Tuple[List[str], List[str]]]:
+        """
+        :return: the tokens and BILOU tags of every document.
+        """
+        st = time.perf_counter()
+        tokens = [self.tokenize(d) for d in documents]
+        t = time.perf_counter()
+        times['tokenize'] += t - st
+
+        matches = self.automaton.match_batch(tokens)
+        st = time.perf_counter()
+        times['match'] += st - t
+
+        entities = [quiz4.remove_overlaps(self.automaton.entities(ts, m), self.weight) for ts, m in zip(tokens, matches)]
+        t = time.perf_counter()
+        times['overlaps'] += t - st
+
+        tags = [quiz4.to_bilou(ts, [(span, s, e, self.label(values)) for span, s, e, values in es])
+                for ts, es in zip(tokens, entities)]
+        times['bilou'] += time.perf_counter() - t
+        return list(zip(tokens, tags))
+
+
+def to_conll(tagged: Iterable[Tuple[List[str], List[str]]]) -> str:
+    return ''.join(''.join('{}\t{}\n'.format(w, t) for w, t in zip(tokens, tags)) + '\n' for tokens, tags in tagged)
+
+
+_tagger: Optional[Tagger] = None
+
+
+def _init_worker(gazetteers: str, tokenizer: str, priorities: Optional[Dict[str, float]], normalize: bool, cache_dir: Optional[str]):
+    global _tagger
+    _tagger = Tagger(load_automaton(gazetteers, normalize, cache_dir), tokenizer, priorities)
+
+
+def _run_chunk(documents: List[str]) -> Tuple[str, Counter]:
+    counts = Counter()
+    tagged = _tagger.tag(documents, counts)
+    st = time.perf_counter()
+    text = to_conll(tagged)
+    counts['format'] += time.perf_counter() - st
+    counts['documents'] += len(documents)
+    counts['tokens'] += sum(len(tokens) for tokens, _ in tagged)
+    counts['entities'] += sum(sum(t[0] in 'BU' for t in tags) for _, tags in tagged)
+    return text, counts
+
+
+def cache_file(dirname: str, normalize: bool = False, cache_dir: Optional[str] = None) -> str:
+    """
+    :return: the compiled automaton file of the gazetteer directory in the cache directory (CACHE_DIR if None),
+             named after the directory and a hash of its absolute path so that directories do not share a file.
+    """
+    path = os.path.realpath(dirname)
+    name = '{}-{}{}.gaz'.format(os.path.basename(path), hashlib.sha1(path.encode('utf-8')).hexdigest()[:12], '.norm' if normalize else '')
+    return os.path.join(cache_dir or CACHE_DIR, name)
+
+
+def load_automaton(gazetteers: str, normalize: bool = False, cache_dir: Optional[str] = None) -> TokenAutomaton:
+    """
+    :param gazetteers: a compiled automaton file, or a directory of *.txt gazetteers that is compiled into
+                       cache_file() unless that is up to date.
+    :param normalize: if True, a directory is compiled with a TokenNormalizer; a file keeps the settings it was compiled with.
+    :param cache_dir: the directory of the compiled files, created if missing; CACHE_DIR if None.
+    """
+    if os.path.isdir(gazetteers):
+        filename = cache_file(gazetteers, normalize, cache_dir)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        return ner_gazetteer.cached_gazetteers(gazetteers, filename, TokenNormalizer() if normalize else None)
+    return ner_gazetteer.load(gazetteers)
+
+
+def run(documents: Iterable[str], gazetteers: str, workers: int = 0, chunk_size: int = CHUNK_SIZE,
+        tokenizer: str = 'whitespace', priorities: Optional[Dict[str, float]] = None, normalize: bool = False,
+        stats: Optional[Counter] = None, cache_dir: Optional[str] = None) -> Iterator[str]:
+    """
+    :param documents: the documents; read lazily, so this can be a stream over a large file.
+    :param gazetteers: see load_automaton(); the automaton is compiled here once, then memory-mapped by every worker.
+    :param workers: the number of processes; 0 uses every available core, 1 runs in this process.
+    :param normalize: see load_automaton().
+    :param stats: if given, accumulates the document, token and entity counts and the seconds spent in each stage
+                  summed over the workers, plus 'wait', the seconds this process spent waiting for results.
+    :param cache_dir: see load_automaton().
+    :return: the CoNLL output of every chunk, in the input order.
+    """
+    if os.path.isdir(gazetteers): load_automaton(gazetteers, normalize, cache_dir)
+    stats = Counter() if stats is None else stats
+    results = ordered_map(_run_chunk, chunked(documents, chunk_size), workers, initializer=_init_worker,
+                          initargs=(gazetteers, tokenizer, priorities, normalize, cache_dir))
+    while True:
+        st = time.perf_counter()
+        result = next(results, None)
+        stats['wait'] += time.perf_counter() - st
+        if result is None: return
+        text, counts = result
+        stats.update(counts)
+        yield text
+
+
+def check_backpressure(gazetteers: str, n_documents: int = 50000, workers: int = 2, chunk_size: int = CHUNK_SIZE,
+                       delay: float = 0.001, cache_dir: Optional[str] = None) -> Tuple[int, int]:
+    """
+    Streams n_documents generated documents through run() to a consumer that sleeps after every chunk, and checks
+    that the reader never gets more than the chunks in flight ahead of it, so memory does not grow with the input.
+    :param workers: at least 2, so that the documents go through the process pool.
+    :param cache_dir: see load_automaton().
+    :return: the most documents read but not yet consumed at any time, and the peak memory allocated by this process
+             in bytes over the second half of the stream beyond the peak over the first half.
+    """
+    # parallel.ordered_map keeps 2 * workers chunks in flight, and chunked() holds one more while it is filled
+    bound = (2 * workers + 1) * chunk_size
+    template = 'Jinho is a professor at Emory University in Atlanta , Georgia and document {} speaks English .'
+    read = [0]
+
+    def documents() -> Iterator[str]:
+        for i in range(n_documents):
+            read[0] += 1
+            yield template.format(i)
+
+    stats, lag, half = Counter(), 0, None
+    tracemalloc.start()
+    try:
+        for _ in run(documents(), gazetteers, workers, chunk_size, stats=stats, cache_dir=cache_dir):
+            lag = max(lag, read[0] - stats['documents'])
+            if half is None and stats['documents'] >= n_documents // 2:
+                half = tracemalloc.get_traced_memory()[1]
+                tracemalloc.reset_peak()
+            time.sleep(delay)
+        growth = tracemalloc.get_traced_memory()[1] - half
+    finally:
+        tracemalloc.stop()
+
+    if stats['documents'] != n_documents: raise AssertionError('{:,} of {:,} documents tagged'.format(stats['documents'], n_documents))
+    if lag > bound: raise AssertionError('the reader got {:,} documents ahead of the consumer; at most {:,} expected'.format(lag, bound))
+    if growth > half: raise AssertionError('peak memory grew by {:,} bytes over the second half'.format(growth))
+    return lag, growth
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description='Tags a file of documents, one per line, with gazetteers in BILOU.')
+    parser.add_argument('gazetteers', help='a compiled automaton file or a directory of *.txt gazetteers')
+    parser.add_argument('input', nargs='?', help='one document per line')
+    parser.add_argument('-o', '--output', help='the output file; standard output by default')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='the number of processes; 0 for every core')
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE, help='the number of documents per task')
+    parser.add_argument('-t', '--tokenizer', choices=sorted(TOKENIZERS), default='whitespace')
+    parser.add_argument('-n', '--normalize', action='store_true', help='matches on case-folded, normalized tokens')
+    parser.add_argument('--cache', default=CACHE_DIR, help='the directory a gazetteer directory is compiled into; {} by default'.format(CACHE_DIR))
+    parser.add_argument('--check-backpressure', action='store_true',
+                        help='streams generated documents to a slow consumer and checks that memory stays bounded')
+    args = parser.parse_args(argv)
+
+    if args.check_backpressure:
+        lag, growth = check_backpressure(args.gazetteers, workers=max(args.workers, 2), chunk_size=args.chunk_size,
+                                         cache_dir=args.cache)
+        print('backpressure: at most {:,} documents read ahead, second-half peak memory {:+,} bytes over the first half'.format(lag, growth))
+        return
+    if args.input is None: parser.error('the following arguments are required: input')
+
+    stats = Counter()
+    st = time.time()
+    documents = (line for line in iter_lines(args.input) if line.strip())
+    fout = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for text in run(documents, args.gazetteers, args.workers, args.chunk_size, args.tokenizer,
+                        normalize=args.normalize, stats=stats, cache_dir=args.cache):
+            fout.write(text)
+    finally:
+        if fout is not sys.stdout: fout.close()
+
+    elapsed = time.time() - st
+    print('{:,} documents, {:,} tokens, {:,} entities in {:.2f}s: {:,.0f} tokens/sec'.format(
+        stats['documents'], stats['tokens'], stats['entities'], elapsed, stats['tokens'] / max(elapsed, 1e-9)), file=sys.stderr)
+    print(', '.join('{} {:.2f}s'.format(stage, stats[stage]) for stage in STAGES + ('format', 'wait')), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import json
+import threading
+from collections import Counter
+from typing import Dict, Iterable, Any, List, Optional, Tuple
+
+import numpy as np
+
+import tfidf
+from tfidf import CSRMatrix, Vocabulary
+
+
+class Layers:
+    """
+    An immutable mapping stored as a stack of dicts, oldest first, where a newer layer overrides the older ones and
+    a None value marks a deletion. with_changes() returns a new mapping that shares every layer but the top ones,
+    which are merged as in a binary counter whenever the new layer is at least as large as the one below, so there
+    are O(log n) layers and each entry is copied O(log n) times over its lifetime rather than on every version.
+    Iteration follows the order of the last change of every key, as a dict that re-inserts updated keys does.
+    """
+    def __init__(self, layers: Tuple[Dict[Any, Any], ...] = (), size: int = 0):
+        self.layers = layers
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        for layer in reversed(self.layers):
+            if key in layer:
+                value = layer[key]
+                return default if value is None else value
+        return default
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key) is not None
+
+    def with_changes(self, changes: Dict[Any, Any], size: int) -> 'Layers':
+        """
+        :param changes: the new value of every changed key, None if deleted, in the order of their last change.
+        :param size: the number of keys after the changes.
+        """
+        if not changes: return self
+        layers, top = list(self.layers), dict(changes)
+        while layers and len(layers[-1]) <= len(top):
+            top = _merge(layers.pop(), top)
+        # nothing below the bottom layer to delete from
+        if not layers: top = {k: v for k, v in top.items() if v is not None}
+        layers.append(top)
+        return Layers(tuple(layers), size)
+
+    def items(self) -> Iterable[Tuple[Any, Any]]:
+        flat = dict()
+        for layer in self.layers: flat = _merge(flat, layer)
+        return ((k, v) for k, v in flat.items() if v is not None)
+
+
+def _merge(older: Dict[Any, Any], newer: Dict[Any, Any]) -> Dict[Any, Any]:
+    merged = dict(older)
+    for k, v in newer.items():
+        merged.pop(k, None)
+        merged[k] = v
+    return merged
+
+
+class Snapshot:
+    """
+    An immutable view of a TfIdfModel: the documents, D and the document frequencies as of one version.
+    Updates applied to the model afterwards are not visible here. A snapshot shares its Layers with the previous
+    one except for the entries changed in between, and IDF weights are computed from the frequencies when read.
+    """
+    def __init__(self, version: int, docs: Layers, dfs: Layers, vocab: Vocabulary, V: int):
+        """
+        :param V: the vocabulary size as of this version.
+        """
+        self.version = version
+        self.docs = docs
+        self.dfs = dfs
+        self.vocab = vocab
+        self.V = V
+        self._idf = None
+        self._matrix = None
+
+    @property
+    def D(self) -> int:
+        return len(self.docs)
+
+    @property
+    def keys(self) -> List[str]:
+        return [k for k, _ in self.docs.items()]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.docs
+
+    @property
+    def idf(self) -> np.ndarray:
+        """
+        :return: the IDF weights of the whole vocabulary; computed on first use.
+        """
+        if self._idf is None:
+            dfs = np.zeros(self.V, dtype=np.int64)
+            for t, df in self.dfs.items(): dfs[t] = df
+            self._idf = tfidf.idf(dfs, self.D)
+        return self._idf
+
+    def vector(self, key: str) -> Dict[str, float]:
+        """
+        Weighs the document with the frequencies of its own terms only, so this does not depend on the vocabulary size.
+        """
+        doc = self.docs.get(key)
+        if doc is None: raise KeyError(key)
+        ids, counts = doc
+        if self._idf is not None: idf = self._idf[ids]
+        else: idf = tfidf.idf(np.array([self.dfs.get(t, 0) for t in ids.tolist()], dtype=np.int64), self.D)
+        terms = self.vocab.terms
+        return {terms[t]: w for t, w in zip(ids.tolist(), (counts * idf).tolist())}
+
+    def matrix(self) -> CSRMatrix:
+        """
+        :return: the TF-IDF matrix of all documents, in insertion order; built on first use.
+        """
+        if self._matrix is None:
+            items = list(self.docs.items())
+            docs = [d for _, d in items]
+            lengths = [len(ids) for ids, _ in docs]
+            indptr = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))).astype(np.int64)
+            indices = np.concatenate([ids for ids, _ in docs]) if docs else np.zeros(0, dtype=np.int32)
+            counts = np.concatenate([c for _, c in docs]) if docs else np.zeros(0, dtype=np.int64)
+            self._matrix = CSRMatrix([k for k, _ in items], indptr, indices, counts * self.idf[indices], self.vocab)
+        return self._matrix
+
+    def to_dicts(self) -> Dict[str, Dict[str, float]]:
+        return tfidf.to_dicts(self.matrix())
+
+
+class TfIdfModel:
+    """
+    A TF-IDF model that documents can be added to, removed from and updated in without a full rebuild.
+    Document frequencies and D are maintained on every update, together with the documents and frequencies changed
+    since the last snapshot, which are all a new snapshot copies. Snapshots are published either lazily on the first
+    snapshot() after a change (refresh_every=0) or once every refresh_every updates, in which case readers keep
+    seeing the previous snapshot in between.
+    All methods are thread-safe; readers work on snapshots and never observe a partially applied update.
+    """
+    def __init__(self, vocab: Optional[Vocabulary] = None, refresh_every: int = 0):
+        self.vocab = Vocabulary() if vocab is None else vocab
+        self.refresh_every = refresh_every
+        self.docs: Dict[str, Tuple[np.ndarray, np.ndarray]] = dict()
+        self.dfs = np.zeros(1024, dtype=np.int64)
+        self.version = 0
+        self.pending = 0
+        self._doc_changes: Dict[str, Optional[Tuple[np.ndarray, np.ndarray]]] = dict()
+        self._df_changes: Dict[int, int] = dict()
+        self._lock = threading.Lock()
+        self._snapshot = Snapshot(0, Layers(), Layers(), self.vocab, 0)
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.docs
+
+    def _count(self, tokens: str) -> Tuple[np.ndarray, np.ndarray]:
+        tc = Counter(tokens.split())
+        ids = np.array([self.vocab.add(t) for t in tc], dtype=np.int32)
+        if len(self.vocab) > len(self.dfs):
+            self.dfs = np.concatenate((self.dfs, np.zeros(max(len(self.vocab), 2 * len(self.dfs)) - len(self.dfs), dtype=np.int64)))
+        return ids, np.fromiter(tc.values(), dtype=np.int64, count=len(tc))
+
+    def _add(self, key: str, tokens: str):
+        ids, counts = self._count(tokens)
+        self.docs[key] = (ids, counts)
+        self.dfs[ids] += 1
+        self._record(key, (ids, counts), ids)
+
+    def _remove(self, key: str):
+        ids, _ = self.docs.pop(key)
+        self.dfs[ids] -= 1
+        self._record(key, None, ids)
+
+    def _record(self, key: str, doc: Optional[Tuple[np.ndarray, np.ndarray]], ids: np.ndarray):
+        # re-inserted so that the changes are in the order of the last change, as the keys of self.docs
+        self._doc_changes.pop(key, None)
+        self._doc_changes[key] = doc
+        self._df_changes.update(zip(ids.tolist(), self.dfs[ids].tolist()))
+
+    def _changed(self):
+        self.version += 1
+        self.pending += 1
+        if self.refresh_every and self.pending >= self.refresh_every: self._publish()
+
+    def _publish(self):
+        prev, D = self._snapshot, len(self.docs)
+        docs = prev.docs.with_changes(self._doc_changes, D)
+        dfs = prev.dfs.with_changes(self._df_changes, len(self.vocab))
+        self._snapshot = Snapshot(self.version, docs, dfs, self.vocab, len(self.vocab))
+        self._doc_changes, self._df_changes = dict(), dict()
+        self.pending = 0
+
+    def add(self, key: str, tokens: str):
+        """
+        :param key: the document key, which must not be in the model yet.
+        :param tokens: the whitespace-separated tokens of the document, as in the 'tokens' field of a fable.
+        """
+        with self._lock:
+            if key in self.docs: raise ValueError('Document already exists: {}'.format(key))
+            self._add(key, tokens)
+            self._changed()
+
+    def add_all(self, fables: Iterable[Dict[str, Any]]):
+        """
+        Adds or updates every document, each with the 'source' and 'tokens' fields, as one change.
+        """
+        with self._lock:
+            for fable in fables:
+                key = tfidf.document_key(fable['source'])
+                if key in self.docs: self._remove(key)
+                self._add(key, fable['tokens'])
+            self._changed()
+
+    def remove(self, key: str):
+        with self._lock:
+            if key not in self.docs: raise KeyError(key)
+            self._remove(key)
+            self._changed()
+
+    def update(self, key: str, tokens: str):
+        """
+        Replaces the document with the key, or adds it if it does not exist.
+        """
+        with self._lock:
+            if key in self.docs: self._remove(key)
+            self._add(key, tokens)
+            self._changed()
+
+    def refresh(self) -> Snapshot:
+        """
+        Publishes the current state regardless of the refresh schedule.
+        """
+        with self._lock:
+            if self._snapshot.version != self.version: self._publish()
+            return self._snapshot
+
+    def snapshot(self) -> Snapshot:
+        """
+        :return: the latest published snapshot; with lazy refreshing, the current state is published first.
+        """
+        with self._lock:
+            if not self.refresh_every and self._snapshot.version != self.version: self._publish()
+            return self._snapshot
+
+
+if __name__ == '__main__':
+    import time
+
+    fables = json.load(open('../../res/vsm/aesopfables.json'))
+    fables = list({tfidf.document_key(f['source']): f for f in fables}.values())
+    # a larger collection with distinct keys, so that copying it per snapshot would show
+    corpus = [dict(f, source='{}{}'.format(f['source'], i)) for i in range(20) for f in fables]
+    keys = [tfidf.document_key(f['source']) for f in corpus]
+
+    model = TfIdfModel()
+    model.add_all(corpus[:-100])
+    model.snapshot()
+    st = time.time()
+    for key, fable in zip(keys[-100:], corpus[-100:]):
+        model.add(key, fable['tokens'])
+        model.snapshot().vector(key)
+    print('100 interleaved additions and snapshots over {:,} documents: {:.4f}s'.format(len(corpus), time.time() - st))
+
+    st = time.time()
+    for i in range(10):
+        tfidf.vectorize(corpus[:len(corpus) - 100 + i + 1])
+    print('10 full rebuilds: {:.4f}s'.format(time.time() - st))
+
+    print(model.snapshot().to_dicts() == tfidf.to_dicts(tfidf.vectorize(corpus)))
+    # the documents of keys[:50] move to keys[50:100], which replaces the tokens there
+    for key in keys[:50]: model.remove(key)
+    for key, fable in zip(keys[50:100], corpus[:50]): model.update(key, fable['tokens'])
+    moved = [dict(f, source=g['source']) for f, g in zip(corpus[:50], corpus[50:100])]
+    print(model.snapshot().to_dicts() == tfidf.to_dicts(tfidf.vectorize(moved + corpus[100:])))
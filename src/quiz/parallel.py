@@ -0,0 +1,68 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import itertools
+import multiprocessing
+import os
+from collections import deque
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, TypeVar, Any
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def cpu_count() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def chunked(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """
+    :return: consecutive lists of up to size items, read lazily from the iterable.
+    """
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk: return
+        yield chunk
+
+
+def ordered_map(fn: Callable[[T], R], items: Iterable[T], workers: int = 0, max_pending: Optional[int] = None,
+                initializer: Optional[Callable] = None, initargs: Sequence[Any] = ()) -> Iterator[R]:
+    """
+    Applies fn to every item in a process pool and yields the results in the input order.
+    At most max_pending items are in flight at a time, so a slow consumer holds back the reader (backpressure)
+    and memory stays bounded however long the input is.
+    :param fn: a picklable (module-level) function.
+    :param workers: the number of processes; 0 uses every available core, 1 runs in this process.
+    :param max_pending: the number of items in flight; 2 * workers by default.
+    :param initializer: called once in every worker with initargs, e.g., to load a model.
+    """
+    workers = workers or cpu_count()
+    if workers == 1:
+        if initializer: initializer(*initargs)
+        yield from map(fn, items)
+        return
+
+    max_pending = max_pending or 2 * workers
+    with multiprocessing.Pool(workers, initializer, initargs) as pool:
+        pending = deque()
+        for item in items:
+            if len(pending) >= max_pending: yield pending.popleft().get()
+            pending.append(pool.apply_async(fn, (item,)))
+        while pending:
+            yield pending.popleft().get()
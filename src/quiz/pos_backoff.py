@@ -0,0 +1,265 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+from typing import List, Tuple, Dict, Any, Sequence, Iterable, Callable, Optional, Set, Union
+
+import numpy as np
+
+from pos_common import DUMMY
+from pos_corpus import EncodedCorpus, encode, WORD, TAG
+from pos_features import Template, TEMPLATES, WORD_CLASSES, count, feature_keys
+
+# (template, minimum count) from the most to the least specific context; keys seen fewer times back off
+DEFAULT_CHAIN = (('pw_cw_nw', 2), ('cw_pw', 2), ('cw_nw', 2), ('cw', 1), ('s3', 2), ('s2', 2), ('s1', 2), ('shape', 1))
+ALPHA = 1.0
+# the number of words outside the compiled ones whose predictions are kept after their first use
+CACHE_SIZE = 1 << 16
+Context = Tuple[Optional[str], Optional[str], Optional[str]]   # (previous, current, next) word; None if not known
+
+
+def _key_function(template: Template) -> Tuple[Callable[[Context], Any], List[int]]:
+    """
+    :return: the function from a context to the template's key, and the context positions the key needs.
+    """
+    getters, positions = [], []
+    for field, offset in template.fields:
+        if field == TAG or not -1 <= offset <= 1:
+            raise ValueError('{} needs ({}, {}), which is not in the (pw, cw, nw) context'.format(template.name, field, offset))
+        i, fn = offset + 1, WORD_CLASSES.get(field)
+        getters.append((lambda c, i=i: c[i]) if fn is None else (lambda c, i=i, fn=fn: c[i] if c[i] == DUMMY else fn(c[i])))
+        positions.append(i)
+    if len(getters) == 1: return getters[0], positions
+    return (lambda c: tuple(get(c) for get in getters)), positions
+
+
+class Level:
+    """
+    One step of the backoff chain: the best (tag, score) of every key of a template.
+    """
+    def __init__(self, template: Template, table: Dict[Any, Tuple[str, float]]):
+        self.template = template
+        self.table = table
+        self.key, self.positions = _key_function(template)
+
+    def context(self, key: Any) -> Context:
+        """
+        :return: the words of the context that the key determines.
+        """
+        c = [None, None, None]
+        for (field, offset), value in zip(self.template.fields, key if len(self.template.fields) > 1 else (key,)):
+            if field == WORD: c[offset + 1] = value
+        return tuple(c)
+
+    def __getstate__(self):
+        return self.template, self.table
+
+    def __setstate__(self, state: Tuple[Template, Dict[Any, Tuple[str, float]]]):
+        self.__init__(*state)
+
+
+def _level(corpus: EncodedCorpus, template: Template, min_count: int, prior: np.ndarray, alpha: float) -> Level:
+    """
+    Precomputes the argmax of the tag distribution of every key, smoothed toward the prior:
+    (count(key, tag) + alpha * prior(tag)) / (count(key) + alpha).
+    """
+    table = count(corpus, template)
+    n = len(table.ptr) - 1
+    if n == 0: return Level(template, dict())
+    lengths = np.diff(table.ptr)
+    rows = np.repeat(np.arange(n), lengths)
+    totals = np.add.reduceat(table.counts, table.ptr[:-1])
+    smoothed = (table.counts + alpha * prior[table.tags]) / (totals[rows] + alpha)
+    # stable: among equal scores, the tag listed first, i.e., the most frequent and then the first seen
+    best = np.lexsort((-smoothed, rows))[table.ptr[:-1]]
+
+    tags = corpus.tags.terms
+    keep = (totals >= min_count).tolist()
+    best_tags, best_scores = table.tags[best].tolist(), smoothed[best].tolist()
+    return Level(template, {key: (tags[best_tags[i]], best_scores[i])
+                            for i, key in enumerate(feature_keys(corpus, template, table)) if keep[i]})
+
+
+def _by_word(level: Level) -> Dict[str, Dict[Any, Tuple[str, float]]]:
+    """
+    :return: the keys of the level, which must include the current word, grouped by the current word.
+    """
+    groups = dict()
+    for key, v in level.table.items(): groups.setdefault(level.context(key)[1], dict())[key] = v
+    return groups
+
+
+class BackoffTagger:
+    """
+    Tags every token with the best tag of the most specific context in the chain that was seen in training,
+    e.g., the (pw, cw, nw) trigram, then the word, then its suffixes and shape, and finally the most frequent tag,
+    so unknown words get a real prediction instead of XX. The levels are merged into one table from the current
+    word to its prediction (see compile()), so tagging a token is a single dictionary probe for most words.
+    """
+    def __init__(self, levels: Sequence[Level], default: Tuple[str, float]):
+        self.levels = list(levels)
+        self.default = default
+        self.compile()
+
+    @classmethod
+    def train(cls, data: Union[EncodedCorpus, Iterable[List[Tuple[str, str]]]], chain: Sequence[Tuple[str, int]] = DEFAULT_CHAIN,
+              alpha: float = ALPHA, prune: bool = True) -> 'BackoffTagger':
+        """
+        :param data: the training set, as returned by quiz3.read_data() or pos_corpus.read_corpus().
+        :param chain: (template name in pos_features.TEMPLATES, minimum count) pairs from the most specific context.
+        :param alpha: the weight of the tag prior in the smoothed scores.
+        :param prune: if True, drops the keys whose level predicts the same tag as the rest of the chain would.
+        """
+        corpus = data if isinstance(data, EncodedCorpus) else encode(data)
+        prior = np.bincount(corpus.tag_ids, minlength=len(corpus.tags)) / max(len(corpus), 1)
+        t = int(np.argmax(prior[1:])) + 1 if len(corpus.tags) > 1 else 0
+        tagger = cls([_level(corpus, TEMPLATES[name], min_count, prior, alpha) for name, min_count in chain],
+                     (corpus.tags.terms[t], float(prior[t])))
+        if prune: tagger.prune()
+        tagger.compile(corpus.words.terms)
+        return tagger
+
+    def compile(self, words: Iterable[str] = ()):
+        """
+        Builds the table from the current word to (prediction, probes). The levels keyed by the current word alone,
+        e.g., cw, the suffixes and the shape, are resolved into the prediction once per word. The keys of the levels
+        that also need the previous or next word are grouped by their current word, and only the groups of the levels
+        before the resolving one are kept as probes, in the chain order; most words have none.
+        Call this again after changing the levels.
+        :param words: the words to resolve up front, e.g., the training vocabulary; others are resolved on first use.
+        """
+        self._sources: List[Optional[Dict[Any, Dict]]] = []
+        for level in self.levels:
+            if all(offset == 0 for _, offset in level.template.fields):
+                self._sources.append(None)
+            elif (WORD, 0) in level.template.fields:
+                self._sources.append(_by_word(level))
+            else:
+                # keyed without the current word, so the whole level is probed for every word
+                self._sources.append({None: level.table} if level.table else dict())
+        self.table: Dict[str, Tuple[Tuple[str, float], Tuple[Tuple[int, Dict], ...]]] = dict()
+        for word in words: self.table[word] = self._resolve(word)
+        self._capacity = len(self.table) + CACHE_SIZE
+
+    def _resolve(self, word: str) -> Tuple[Tuple[str, float], Tuple[Tuple[int, Dict], ...]]:
+        probes = []
+        for l, (level, source) in enumerate(zip(self.levels, self._sources)):
+            if source is None:
+                v = level.table.get(level.key((None, word, None)))
+                if v is not None: return v, tuple(probes)
+            else:
+                table = source.get(word, source.get(None))
+                if table: probes.append((l, table))
+        return self.default, tuple(probes)
+
+    def _outcomes(self, context: Context, start: int, groups: List[Optional[Dict[str, Dict]]]) -> Optional[Set[str]]:
+        """
+        :param context: the words that a key fixes; None stands for any word.
+        :param groups: the keys of every level grouped by their current word, None if they are keyed without it.
+        :return: the tags that the levels from start on can predict for the contexts the given one matches,
+                 or None if that cannot be told, i.e., a level keyed without the current word needs a missing word.
+        """
+        tags = set()
+        for level, group in zip(self.levels[start:], groups[start:]):
+            if all(context[i] is not None for i in level.positions):
+                v = level.table.get(level.key(context))
+                if v is not None:
+                    tags.add(v[0])
+                    return tags
+            elif group is None or context[1] is None:
+                return None
+            else:
+                # any key of the level that agrees on the known words fires for some of the contexts; the rest fall through
+                for key, (tag, _) in group.get(context[1], dict()).items():
+                    if all(a is None or b is None or a == b for a, b in zip(context, level.context(key))): tags.add(tag)
+        tags.add(self.default[0])
+        return tags
+
+    def prune(self):
+        """
+        Removes the keys that do not change the predicted tag. Levels are pruned from the least specific, so that
+        the rest of the chain a key is compared against is already pruned; the tags predicted for any context stay
+        the same, but the score then comes from the level that still has the key. A key that leaves a word open,
+        e.g., the nw of a cw_pw key, is compared against every key of the later levels it may back off to,
+        e.g., all cw_nw keys with the same cw, and removed only if they all predict its tag.
+        Keys whose current word is open, e.g., those of the suffix levels, are compared only when the rest of
+        the chain needs no other word.
+        """
+        groups: List[Optional[Dict[str, Dict]]] = [None] * len(self.levels)
+        for l in range(len(self.levels) - 1, -1, -1):
+            level = self.levels[l]
+            for key, (tag, _) in list(level.table.items()):
+                if self._outcomes(level.context(key), l + 1, groups) == {tag}: del level.table[key]
+            if (WORD, 0) in level.template.fields: groups[l] = _by_word(level)
+        self.compile(list(self.table))
+
+    def predict_token(self, tokens: Sequence[str], i: int) -> Tuple[str, float]:
+        word = tokens[i]
+        entry = self.table.get(word)
+        if entry is None:
+            entry = self._resolve(word)
+            if len(self.table) < self._capacity: self.table[word] = entry
+        v, probes = entry
+        if probes:
+            context = (tokens[i - 1] if i > 0 else DUMMY, word, tokens[i + 1] if i + 1 < len(tokens) else DUMMY)
+            for l, table in probes:
+                p = table.get(self.levels[l].key(context))
+                if p is not None: return p
+        return v
+
+    def predict(self, tokens: Sequence[str]) -> List[Tuple[str, float]]:
+        """
+        :return: a list of tuple where each tuple represents a pair of (POS, score) of the corresponding token.
+        """
+        return [self.predict_token(tokens, i) for i in range(len(tokens))]
+
+    def sizes(self) -> Dict[str, int]:
+        return {level.template.name: len(level.table) for level in self.levels}
+
+
+if __name__ == '__main__':
+    import time
+    import quiz3
+
+    data = quiz3.read_data('../../res/pos/wsj-pos.dev.gold.tsv')
+    n = int(len(data) * 0.8)
+    trn_data, dev_data = data[:n], data[n:]
+    args = (quiz3.create_cw_dict(trn_data), quiz3.create_cw_pp_dict(trn_data), quiz3.create_pw_dict(trn_data),
+            quiz3.create_nw_dict(trn_data), quiz3.create_cw_pw_dict(trn_data), quiz3.create_cw_nw_dict(trn_data),
+            1.0, 0.5, 0.5, 0.5, 0.5, 0.5)
+    known = set(args[0])
+    tokens = sum(len(s) for s in dev_data)
+
+    def report(label: str, predict: Callable[[Sequence[str]], List[Tuple[str, float]]]):
+        correct, unknown, unknown_correct = 0, 0, 0
+        st = time.time()
+        pred = [predict([w for w, _ in s]) for s in dev_data]
+        elapsed = time.time() - st
+        for s, ps in zip(dev_data, pred):
+            for (w, g), (p, _) in zip(s, ps):
+                correct += g == p
+                if w not in known:
+                    unknown += 1
+                    unknown_correct += g == p
+        print('{:22}: {:5.2f}% (unknown words {:5.2f}%), {:.2f} us/token'.format(
+            label, 100.0 * correct / tokens, 100.0 * unknown_correct / unknown, 1e6 * elapsed / tokens))
+
+    for prune in [False, True]:
+        st = time.time()
+        backoff = BackoffTagger.train(trn_data, prune=prune)
+        print('train (prune={}): {:.2f}s, {}'.format(prune, time.time() - st, backoff.sizes()))
+        report('backoff' + (' (pruned)' if prune else ''), backoff.predict)
+
+    report('quiz3.predict', lambda t: quiz3.predict(t, *args))
+    report('quiz3.predict + backoff', lambda t: quiz3.predict(t, *args, backoff))
@@ -0,0 +1,24 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+Constants shared by quiz3 and the pos_* modules. This module imports nothing from them,
+so that every one of them can import it at module level.
+"""
+
+# the word and tag before the first and after the last token of a sentence
+DUMMY = '!@#$'
+# the tag of a token that no feature fires for and nothing backs off for
+UNKNOWN_TAG = 'XX'
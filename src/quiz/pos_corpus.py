@@ -0,0 +1,149 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+from array import array
+from typing import List, Tuple, Iterable, Iterator, NamedTuple
+
+import numpy as np
+
+from corpus_reader import LINE_BUFFER_SIZE, iter_lines
+from pos_common import DUMMY
+from tfidf import Vocabulary
+
+WORD, TAG = 'w', 't'
+
+
+def iter_sentences(filename: str, buffer_size: int = LINE_BUFFER_SIZE, use_mmap: bool = False) -> Iterator[List[Tuple[str, str]]]:
+    """
+    Streams the sentences of a TSV corpus such as res/pos/wsj-pos.dev.gold.tsv, one (word, pos) list at a time.
+    The last sentence is kept even if the file does not end with a blank line.
+    """
+    sentence = []
+    for line in iter_lines(filename, buffer_size, use_mmap):
+        l = line.split()
+        if l:
+            sentence.append((l[0], l[1]))
+        elif sentence:
+            yield sentence
+            sentence = []
+    if sentence: yield sentence
+
+
+class EncodedCorpus(NamedTuple):
+    """
+    A tagged corpus with words and tags interned to integer IDs; ID 0 is DUMMY in both vocabularies.
+    Token j of sentence i is at starts[i] + j in the flat uint32 word_ids and tag_ids arrays.
+    """
+    words: Vocabulary
+    tags: Vocabulary
+    word_ids: np.ndarray
+    tag_ids: np.ndarray
+    starts: np.ndarray    # (n_sentences + 1) offsets of the sentences
+
+    def __len__(self) -> int:
+        return len(self.word_ids)
+
+    @property
+    def num_sentences(self) -> int:
+        return len(self.starts) - 1
+
+    def sentence(self, i: int) -> List[Tuple[str, str]]:
+        s, e = int(self.starts[i]), int(self.starts[i + 1])
+        words, tags = self.words.terms, self.tags.terms
+        return [(words[w], tags[t]) for w, t in zip(self.word_ids[s:e].tolist(), self.tag_ids[s:e].tolist())]
+
+    def sentences(self) -> Iterator[List[Tuple[str, str]]]:
+        """
+        :return: the sentences as quiz3.read_data() returns them, built one at a time.
+        """
+        return (self.sentence(i) for i in range(self.num_sentences))
+
+    def column(self, field: str, offset: int) -> np.ndarray:
+        """
+        :return: the ID of the word or tag at the offset from every token, or 0 (DUMMY) outside its sentence.
+        """
+        ids = self.word_ids if field == WORD else self.tag_ids
+        lengths = np.diff(self.starts)
+        start = np.repeat(self.starts[:-1], lengths)
+        j = np.arange(len(ids)) + offset
+        valid = (j >= start) & (j < start + np.repeat(lengths, lengths))
+        return np.where(valid, ids[np.clip(j, 0, max(len(ids) - 1, 0))].astype(np.int64), 0)
+
+
+class _Builder:
+    def __init__(self):
+        self.words, self.tags = Vocabulary([DUMMY]), Vocabulary([DUMMY])
+        self.word_ids, self.tag_ids, self.starts = array('I'), array('I'), array('q', [0])
+
+    def add(self, word: str, pos: str):
+        self.word_ids.append(self.words.add(word))
+        self.tag_ids.append(self.tags.add(pos))
+
+    def end_sentence(self):
+        if len(self.word_ids) > self.starts[-1]: self.starts.append(len(self.word_ids))
+
+    def build(self) -> EncodedCorpus:
+        self.end_sentence()
+        return EncodedCorpus(self.words, self.tags, np.frombuffer(self.word_ids, dtype=np.uint32),
+                             np.frombuffer(self.tag_ids, dtype=np.uint32), np.frombuffer(self.starts, dtype=np.int64))
+
+
+def encode(data: Iterable[List[Tuple[str, str]]]) -> EncodedCorpus:
+    """
+    Reads the corpus once; it can be any iterable of sentences, e.g., iter_sentences() over a large file.
+    :param data: a list of tuple lists where each inner list represents a sentence and every tuple is a (word, pos) pair.
+    """
+    builder = _Builder()
+    for sentence in data:
+        for word, pos in sentence: builder.add(word, pos)
+        builder.end_sentence()
+    return builder.build()
+
+
+def read_corpus(filename: str, buffer_size: int = LINE_BUFFER_SIZE, use_mmap: bool = False) -> EncodedCorpus:
+    """
+    Reads a TSV corpus straight into an EncodedCorpus, without creating a tuple per token.
+    """
+    builder = _Builder()
+    add_word, add_tag = builder.words.add, builder.tags.add
+    word_ids, tag_ids = builder.word_ids.append, builder.tag_ids.append
+    for line in iter_lines(filename, buffer_size, use_mmap):
+        l = line.split()
+        if l:
+            word_ids(add_word(l[0]))
+            tag_ids(add_tag(l[1]))
+        else:
+            builder.end_sentence()
+    return builder.build()
+
+
+if __name__ == '__main__':
+    import time
+    import tracemalloc
+    import quiz3
+
+    filename = '../../res/pos/wsj-pos.dev.gold.tsv'
+    for label, read in [('quiz3.read_data', quiz3.read_data), ('read_corpus', read_corpus),
+                        ('read_corpus (mmap)', lambda f: read_corpus(f, use_mmap=True))]:
+        tracemalloc.start()
+        st = time.time()
+        corpus = read(filename)
+        elapsed = time.time() - st
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del corpus
+        print('{}: {:.4f}s, {:,} KB retained, {:,} KB peak'.format(label, elapsed, size // 1024, peak // 1024))
+
+    print(list(read_corpus(filename).sentences()) == quiz3.read_data(filename))
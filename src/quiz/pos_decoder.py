@@ -0,0 +1,517 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import time
+from typing import List, Tuple, Dict, Any, Sequence, Iterator, NamedTuple, Optional, Union
+
+import numpy as np
+
+from pos_common import DUMMY, UNKNOWN_TAG
+from pos_corpus import EncodedCorpus
+
+BATCH_SIZE = 512
+# insertion ranks: order * RANK_STRIDE + the position of the tag in the feature's list
+RANK_STRIDE = 1 << 16
+NO_RANK = np.iinfo(np.int32).max
+# the features of quiz3.predict() in the order of its args; cw_pp depends on the previous tag
+FEATURES = ('cw', 'cw_pp', 'pw', 'nw', 'cw_pw', 'cw_nw')
+STATIC_FEATURES = ('cw', 'pw', 'nw', 'cw_pw', 'cw_nw')
+
+
+class FeatureTable:
+    """
+    A {feature key: [(tag, prob), ...]} dictionary flattened into arrays.
+    Integer keys are sorted so that a batch of keys is looked up with one binary search;
+    row i holds the tag IDs tags[ptr[i]:ptr[i+1]] with the probabilities probs[ptr[i]:ptr[i+1]].
+    """
+    def __init__(self, keys: np.ndarray, ptr: np.ndarray, tags: np.ndarray, probs: np.ndarray):
+        self.keys = keys
+        self.ptr = ptr
+        self.tags = tags
+        self.probs = probs
+
+    @classmethod
+    def build(cls, entries: Dict[int, List[Tuple[int, float]]]) -> 'FeatureTable':
+        keys = np.array(sorted(entries), dtype=np.int64)
+        rows = [entries[k] for k in keys.tolist()]
+        ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(r) for r in rows], out=ptr[1:])
+        tags = np.array([t for r in rows for t, _ in r], dtype=np.int16)
+        probs = np.array([p for r in rows for _, p in r], dtype=np.float64)
+        return cls(keys, ptr, tags, probs)
+
+    def rows(self, keys: np.ndarray) -> np.ndarray:
+        """
+        :return: the row of every key, or -1 for the keys that are negative or not in the table.
+        """
+        if len(self.keys) == 0: return np.full(len(keys), -1, dtype=np.int64)
+        i = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where((self.keys[i] == keys) & (keys >= 0), i, -1)
+
+    def entries(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: for every entry of the given rows, the index into rows it belongs to and its position in the table.
+        """
+        found = np.flatnonzero(rows >= 0)
+        r = rows[found]
+        lengths = self.ptr[r + 1] - self.ptr[r]
+        pos = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths - self.ptr[r], lengths)
+        return np.repeat(found, lengths), pos
+
+    def scatter(self, out: np.ndarray, rows: np.ndarray, weight: float) -> np.ndarray:
+        """
+        Adds weight * prob to out[i, tag] for every entry of rows[i].
+        :return: whether each row was found.
+        """
+        idx, pos = self.entries(rows)
+        out[idx, self.tags[pos]] += self.probs[pos] * weight
+        return rows >= 0
+
+    def rank(self, out: np.ndarray, rows: np.ndarray, order: int):
+        """
+        Lowers out[i, tag] to the insertion rank of every entry of rows[i], where the feature is the order'th to be added.
+        """
+        idx, pos = self.entries(rows)
+        tags = self.tags[pos]
+        out[idx, tags] = np.minimum(out[idx, tags], order * RANK_STRIDE + pos - self.ptr[rows[idx]])
+
+
+class PositionEntries(NamedTuple):
+    """
+    The table entries of one feature over a batch, grouped by token position: the entries at position i are ptr[i]:ptr[i+1].
+    """
+    ptr: np.ndarray
+    sentences: np.ndarray   # the sentence each entry belongs to, in the batch order
+    tags: np.ndarray
+    probs: np.ndarray
+
+
+def by_position(table: FeatureTable, rows: np.ndarray, max_length: int) -> PositionEntries:
+    """
+    :param rows: the table rows of the (n_sentences x max_length) tokens, flattened.
+    """
+    idx, pos = table.entries(rows)
+    sentences, positions = np.divmod(idx, max_length)
+    order = np.argsort(positions, kind='stable')
+    ptr = np.searchsorted(positions[order], np.arange(max_length + 1))
+    return PositionEntries(ptr, sentences[order], table.tags[pos[order]], table.probs[pos[order]])
+
+
+def first_max(scores: np.ndarray, rank: np.ndarray) -> np.ndarray:
+    """
+    :return: the highest-scoring tag of every row; among equal scores, the one with the lowest rank, as max() over
+             the scores dict of quiz3.predict() returns the tag inserted first.
+    """
+    top = scores.max(axis=1, keepdims=True)
+    return np.argmin(np.where(scores == top, rank, NO_RANK), axis=1)
+
+
+class Batch(NamedTuple):
+    """
+    Sentences as word IDs, sorted by decreasing length so that the sentences still active at a position are a prefix.
+    """
+    order: np.ndarray     # order[j] is the input index of the j'th sentence in the batch
+    lengths: np.ndarray   # the length of each sentence in the batch order
+    words: np.ndarray     # (n_sentences x max_length) word IDs; -1 for unknown words and padding
+    # the (n_sentences x max_length) tag IDs and scores of the decoder's fallback, if it has one
+    fallback_tags: Optional[np.ndarray] = None
+    fallback_scores: Optional[np.ndarray] = None
+
+
+class Prepared(NamedTuple):
+    """
+    A batch with everything greedy decoding needs that does not depend on the weights or the previous tags.
+    """
+    batch: Batch
+    entries: Dict[str, PositionEntries]   # for each static feature
+    rank: np.ndarray                      # (n_sentences x max_length x n_tags) insertion ranks of the static features
+    fired: np.ndarray                     # (n_sentences x max_length) whether any static feature fired
+
+
+class Decoder:
+    """
+    Vectorized decoding for the quiz3 tagger. Words and tags are mapped to integer IDs, the six probability
+    dictionaries become FeatureTables, and whole batches of sentences are scored at once: the five features that
+    do not depend on the previous tag are looked up for all tokens in one go, and cw_pp is looked up
+    position by position across all sentences of the batch, either greedily as in quiz3.predict() or with
+    exact Viterbi search over the previous tag. As in quiz3.predict(), a fallback such as pos_backoff.BackoffTagger
+    tags the tokens no feature fires for, which otherwise get XX.
+    """
+    def __init__(self, *args):
+        """
+        :param args: the parameters returned by quiz3.train(), optionally followed by a fallback as quiz3.predict() takes.
+        """
+        dicts, weights = args[:6], args[6:12]
+        fallback = args[12] if len(args) > 12 else None
+        tags = sorted({t for d in dicts for probs in d.values() for t, _ in probs})
+        words = {DUMMY}
+        for name, d in zip(FEATURES, dicts):
+            for key in d:
+                if name == 'cw_pp': words.add(key[0])
+                elif isinstance(key, tuple): words.update(key)
+                else: words.add(key)
+        words = sorted(words)
+
+        self._init(words, {w: i for i, w in enumerate(words)}, tags, {t: i for i, t in enumerate(tags)}, weights, fallback)
+        self.tables = {name: FeatureTable.build({self._key(name, key): [(self.tag_index[t], p) for t, p in probs]
+                                                 for key, probs in d.items()})
+                       for name, d in zip(FEATURES, dicts)}
+
+    def _init(self, words: Sequence[str], word_index: Any, tags: Sequence[str], tag_index: Any, weights: Sequence[float],
+              fallback: Any = None):
+        """
+        :param word_index: anything with get(word, default), e.g., a dict or a string_table.StringTable.
+        :param fallback: anything with predict_token(tokens, i), e.g., pos_backoff.BackoffTagger.
+        """
+        self.words, self.word_index = words, word_index
+        self.tags, self.tag_index = tags, tag_index
+        self.weights = dict(zip(FEATURES, weights))
+        self.fallback = fallback
+        T = len(self.tags)
+        self.DUMMY, self.UNKNOWN = T, T + 1
+        self.n_prev = T + 2
+
+    @classmethod
+    def from_tables(cls, words: Any, tags: Any, tables: Dict[str, FeatureTable], weights: Sequence[float],
+                    fallback: Any = None) -> 'Decoder':
+        """
+        Creates a decoder without the dictionaries, e.g., from a model file (see pos_model).
+        :param words: the sorted words, with get(word, default) returning the ID of a word as string_table.StringTable does.
+        :param tags: the sorted tags, likewise.
+        :param tables: the FeatureTable of every feature in FEATURES.
+        :param fallback: see _init().
+        """
+        decoder = cls.__new__(cls)
+        decoder._init(words, words, tags, tags, weights, fallback)
+        decoder.tables = tables
+        return decoder
+
+    def _key(self, name: str, key: Any) -> int:
+        V, w = len(self.words), self.word_index
+        if name == 'cw_pp':
+            cw, pp = key
+            return w[cw] * self.n_prev + (self.DUMMY if pp == DUMMY else self.tag_index[pp])
+        if name == 'cw_pw' or name == 'cw_nw': return w[key[0]] * V + w[key[1]]
+        return w[key]
+
+    def encode(self, sentences: Sequence[Sequence[str]]) -> Batch:
+        lengths = np.array([len(s) for s in sentences], dtype=np.int64)
+        order = np.argsort(-lengths, kind='stable')
+        words = np.full((len(sentences), lengths.max(initial=0)), -1, dtype=np.int64)
+        get = self.word_index.get
+        for j, i in enumerate(order.tolist()):
+            words[j, :lengths[i]] = [get(t, -1) for t in sentences[i]]
+        return self._with_fallback(Batch(order, lengths[order], words), sentences)
+
+    def _with_fallback(self, batch: Batch, sentences: Sequence[Sequence[str]]) -> Batch:
+        """
+        :param sentences: the sentences of the batch in the input order.
+        :return: the batch with the fallback's tag IDs and scores of every token; UNKNOWN for the tags the decoder does not know.
+        """
+        if self.fallback is None: return batch
+        n, L = batch.words.shape
+        tags = np.full((n, L), self.UNKNOWN, dtype=np.int64)
+        scores = np.zeros((n, L), dtype=np.float64)
+        # cw fires for every word in its table, so only the other tokens can need the fallback
+        cw = self.tables['cw'].rows(batch.words.reshape(-1)).reshape(n, L)
+        js, ks = np.nonzero((np.arange(L)[None, :] < batch.lengths[:, None]) & (cw < 0))
+        order, get, predict = batch.order.tolist(), self.tag_index.get, self.fallback.predict_token
+        for j, k in zip(js.tolist(), ks.tolist()):
+            t, scores[j, k] = predict(sentences[order[j]], k)
+            tags[j, k] = get(t, self.UNKNOWN)
+        return batch._replace(fallback_tags=tags, fallback_scores=scores)
+
+    def _fallback(self, batch: Batch) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the tag IDs and scores of the tokens no feature fires for: the fallback's, or UNKNOWN and 0.
+        """
+        if batch.fallback_tags is not None: return batch.fallback_tags, batch.fallback_scores
+        return np.full(batch.words.shape, self.UNKNOWN, dtype=np.int64), np.zeros(batch.words.shape, dtype=np.float64)
+
+    @staticmethod
+    def pad(ids: np.ndarray, starts: np.ndarray, order: np.ndarray, fill: int = -1) -> np.ndarray:
+        """
+        :param ids: the IDs of consecutive sentences, where sentence i is ids[starts[i]:starts[i+1]].
+        :return: the (n_sentences x max_length) IDs of the sentences in the given order, padded with fill.
+        """
+        lengths = np.diff(starts)[order]
+        cols = np.arange(lengths.max(initial=0))
+        mask = cols < lengths[:, None]
+        out = np.full(mask.shape, fill, dtype=np.int64)
+        out[mask] = ids[(starts[:-1][order][:, None] + cols)[mask]]
+        return out
+
+    def encode_ids(self, ids: np.ndarray, starts: np.ndarray) -> Batch:
+        """
+        Same as encode(), for sentences whose words are already mapped to the decoder's word IDs.
+        :param ids: the word IDs of consecutive sentences (-1 for unknown words); sentence i is ids[starts[i]:starts[i+1]].
+        """
+        lengths = np.diff(starts)
+        order = np.argsort(-lengths, kind='stable')
+        return Batch(order, lengths[order], self.pad(ids, starts, order))
+
+    def corpus_batches(self, corpus: EncodedCorpus, batch_size: int = BATCH_SIZE) -> Iterator[Tuple[Batch, np.ndarray]]:
+        """
+        Maps the corpus vocabularies to the decoder's IDs once and slices the corpus into batches,
+        without turning it back into strings.
+        :return: every batch with the (n_sentences x max_length) gold tag IDs in the batch order; -1 for the tags
+                 the decoder does not know and for padding.
+        """
+        word_map = np.array([self.word_index.get(w, -1) for w in corpus.words.terms], dtype=np.int64)
+        tag_map = np.array([self.tag_index.get(t, -1) for t in corpus.tags.terms], dtype=np.int64)
+        words, tags = word_map[corpus.word_ids], tag_map[corpus.tag_ids]
+        terms = corpus.words.terms
+
+        for s in range(0, corpus.num_sentences, batch_size):
+            starts = corpus.starts[s:s + batch_size + 1]
+            batch = self.encode_ids(words, starts)
+            if self.fallback is not None:
+                # the fallback works on strings, so only the sentences of this batch are turned back into them
+                bounds = starts.tolist()
+                batch = self._with_fallback(batch, [[terms[w] for w in corpus.word_ids[b:e].tolist()]
+                                                    for b, e in zip(bounds, bounds[1:])])
+            yield batch, self.pad(tags, starts, batch.order)
+
+    def static_rows(self, batch: Batch) -> Dict[str, np.ndarray]:
+        """
+        :return: for each feature that does not depend on the previous tag, the table row of every token in the batch
+                 flattened in the (n_sentences x max_length) order, or -1 where the feature does not fire.
+        """
+        n, L = batch.words.shape
+        V = len(self.words)
+        dummy = self.word_index.get(DUMMY)
+        cw = batch.words
+        pw = np.full_like(cw, dummy)
+        pw[:, 1:] = cw[:, :-1]
+        nw = np.full_like(cw, dummy)
+        nw[:, :-1] = cw[:, 1:]
+        ends = np.flatnonzero(batch.lengths > 0)   # empty sentences have no last token
+        nw[ends, batch.lengths[ends] - 1] = dummy
+        valid = np.arange(L)[None, :] < batch.lengths[:, None]
+
+        keys = {'cw': cw, 'pw': pw, 'nw': nw,
+                'cw_pw': np.where((pw >= 0) & (cw >= 0), pw * V + cw, -1),
+                'cw_nw': np.where((cw >= 0) & (nw >= 0), cw * V + nw, -1)}
+        return {name: self.tables[name].rows(np.where(valid, keys[name], -1).reshape(-1)) for name in STATIC_FEATURES}
+
+    def _static_scores(self, batch: Batch) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the (n_sentences x max_length x n_tags) scores of the features that do not depend on the previous tag,
+                 and whether any of them fired for each token.
+        """
+        n, L = batch.words.shape
+        scores = np.zeros((n * L, len(self.tags)), dtype=np.float64)
+        fired = np.zeros(n * L, dtype=bool)
+        for name, rows in self.static_rows(batch).items():
+            fired |= self.tables[name].scatter(scores, rows, self.weights[name])
+        return scores.reshape(n, L, len(self.tags)), fired.reshape(n, L)
+
+    def _pp_scores(self, out: np.ndarray, rank: np.ndarray, words: np.ndarray, prev: np.ndarray, weight: float) -> np.ndarray:
+        """
+        Adds the weighted cw_pp scores of the words given their previous tags to out and lowers the insertion ranks.
+        :return: whether the feature fired for each word.
+        """
+        table = self.tables['cw_pp']
+        rows = table.rows(np.where(words >= 0, words * self.n_prev + prev, -1))
+        table.rank(rank, rows, FEATURES.index('cw_pp'))
+        return table.scatter(out, rows, weight)
+
+    def _pp_matrix(self, words: np.ndarray) -> np.ndarray:
+        """
+        :return: the (n_words x n_prev x n_tags) weighted cw_pp scores of the words for every previous tag.
+        """
+        n, P, T = len(words), self.n_prev, len(self.tags)
+        keys = np.where(words[:, None] >= 0, words[:, None] * P + np.arange(P)[None, :], -1).reshape(-1)
+        scores = np.zeros((n * P, T), dtype=np.float64)
+        self.tables['cw_pp'].scatter(scores, self.tables['cw_pp'].rows(keys), self.weights['cw_pp'])
+        return scores.reshape(n, P, T)
+
+    def prepare(self, batch: Batch) -> Prepared:
+        n, L = batch.words.shape
+        rank = np.full((n * L, len(self.tags)), NO_RANK, dtype=np.int32)
+        fired = np.zeros(n * L, dtype=bool)
+        entries = dict()
+        for name, rows in self.static_rows(batch).items():
+            entries[name] = by_position(self.tables[name], rows, L)
+            self.tables[name].rank(rank, rows, FEATURES.index(name))
+            fired |= rows >= 0
+        return Prepared(batch, entries, rank.reshape(n, L, len(self.tags)), fired.reshape(n, L))
+
+    def greedy(self, prepared: Prepared, weights: Optional[Sequence[float]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Adds the features up in the same order as quiz3.predict() and breaks ties the same way, so the tags are identical.
+        :param weights: the feature weights in the order of FEATURES; the decoder's own by default.
+        :return: the (n_sentences x max_length) tag IDs and scores in the batch order.
+        """
+        w = dict(zip(FEATURES, weights)) if weights is not None else self.weights
+        batch = prepared.batch
+        n, L = batch.words.shape
+        tags = np.full((n, L), self.UNKNOWN, dtype=np.int64)
+        best = np.zeros((n, L), dtype=np.float64)
+        prev = np.full(n, self.DUMMY, dtype=np.int64)
+        fallback_tags, fallback_scores = self._fallback(batch)
+
+        for i in range(L):
+            b = int(np.count_nonzero(batch.lengths > i))
+            scores = np.zeros((b, len(self.tags)), dtype=np.float64)
+            rank = prepared.rank[:b, i].copy()
+            fired = prepared.fired[:b, i].copy()
+            for name in FEATURES:
+                if name == 'cw_pp':
+                    fired |= self._pp_scores(scores, rank, batch.words[:b, i], prev[:b], w[name])
+                else:
+                    e = prepared.entries[name]
+                    s, t = e.ptr[i], e.ptr[i + 1]
+                    scores[e.sentences[s:t], e.tags[s:t]] += e.probs[s:t] * w[name]
+            t = first_max(scores, rank)
+            # the fallback's tag is the previous tag of the next token, as in quiz3.predict()
+            tags[:b, i] = np.where(fired, t, fallback_tags[:b, i])
+            best[:b, i] = np.where(fired, scores[np.arange(b), t], fallback_scores[:b, i])
+            prev[:b] = tags[:b, i]
+
+        return tags, best
+
+    def _viterbi(self, batch: Batch) -> Tuple[np.ndarray, np.ndarray]:
+        static, static_fired = self._static_scores(batch)
+        n, L, T = static.shape
+        back = np.zeros((n, L, T), dtype=np.int16)
+        delta = np.zeros((n, T), dtype=np.float64)
+
+        for i in range(L):
+            b = int(np.count_nonzero(batch.lengths > i))
+            pp = self._pp_matrix(batch.words[:b, i])
+            if i == 0:
+                delta[:b] = pp[:, self.DUMMY] + static[:b, 0]
+                continue
+            cand = delta[:b, :, None] + pp[:, :T]
+            back[:b, i] = np.argmax(cand, axis=1)
+            delta[:b] = np.take_along_axis(cand, back[:b, i][:, None, :].astype(np.int64), axis=1)[:, 0] + static[:b, i]
+
+        # follow the back pointers from the best final tag of each sentence
+        tags = np.full((n, L), self.UNKNOWN, dtype=np.int64)
+        last = np.argmax(delta, axis=1)
+        for i in range(L - 1, -1, -1):
+            ending = batch.lengths == i + 1
+            tags[ending, i] = last[ending]
+            if i + 1 < L:
+                active = batch.lengths > i + 1
+                tags[active, i] = back[active, i + 1, tags[active, i + 1]]
+
+        # the local score of every token given its chosen previous tag
+        best = np.zeros((n, L), dtype=np.float64)
+        fired = np.zeros((n, L), dtype=bool)
+        for i in range(L):
+            b = int(np.count_nonzero(batch.lengths > i))
+            prev = np.full(b, self.DUMMY, dtype=np.int64) if i == 0 else tags[:b, i - 1]
+            scores, rank = static[:b, i].copy(), np.zeros((b, T), dtype=np.int32)
+            fired[:b, i] = static_fired[:b, i] | self._pp_scores(scores, rank, batch.words[:b, i], prev, self.weights['cw_pp'])
+            best[:b, i] = scores[np.arange(b), tags[:b, i]]
+
+        # the fallback only replaces the tags no feature fires for; it does not take part in the search
+        fallback_tags, fallback_scores = self._fallback(batch)
+        return np.where(fired, tags, fallback_tags), np.where(fired, best, fallback_scores)
+
+    def search(self, batch: Batch, method: str = 'greedy') -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the (n_sentences x max_length) tag IDs and scores in the batch order.
+        """
+        if method == 'greedy': return self.greedy(self.prepare(batch))
+        if method == 'viterbi': return self._viterbi(batch)
+        raise ValueError('Unknown decoding method: {}'.format(method))
+
+    def decode(self, sentences: Sequence[Sequence[str]], method: str = 'greedy') -> List[List[Tuple[str, float]]]:
+        """
+        :param sentences: lists of tokens.
+        :param method: 'greedy', which makes the same decisions as quiz3.predict(), or 'viterbi', which finds the tag
+                       sequence maximizing the sum of the token scores.
+        :return: for every sentence, the (POS, score) pair of each token as quiz3.predict() returns them.
+        """
+        out = [None] * len(sentences)
+        labels = list(self.tags) + [UNKNOWN_TAG, UNKNOWN_TAG]
+
+        for s in range(0, len(sentences), BATCH_SIZE):
+            batch = self.encode(sentences[s:s + BATCH_SIZE])
+            tags, scores = self.search(batch, method)
+            for j, i in enumerate(batch.order.tolist()):
+                n = batch.lengths[j]
+                out[s + i] = [(labels[t], p) for t, p in zip(tags[j, :n].tolist(), scores[j, :n].tolist())]
+                if self.fallback is None: continue
+                # the fallback's tags the decoder does not know are UNKNOWN in the batch
+                for k in np.flatnonzero(tags[j, :n] == self.UNKNOWN).tolist():
+                    out[s + i][k] = self.fallback.predict_token(sentences[s + i], k)
+
+        return out
+
+
+def evaluate(decoder: Decoder, data: Union[EncodedCorpus, List[List[Tuple[str, str]]]], method: str = 'greedy') -> Tuple[float, float]:
+    """
+    :param data: sentences of (word, pos) pairs, as returned by quiz3.read_data(), or an EncodedCorpus,
+                 which is evaluated on tag IDs without building any strings.
+    :return: the accuracy in percent and the throughput in tokens per second.
+    """
+    if isinstance(data, EncodedCorpus):
+        st, correct = time.time(), 0
+        for batch, gold in decoder.corpus_batches(data):
+            tags, _ = decoder.search(batch, method)
+            correct += int(np.count_nonzero(tags == gold))
+        elapsed = time.time() - st
+        return 100.0 * correct / len(data), len(data) / elapsed if elapsed > 0 else float('inf')
+
+    sentences = [[w for w, _ in s] for s in data]
+    gold = [[p for _, p in s] for s in data]
+    st = time.time()
+    pred = decoder.decode(sentences, method)
+    elapsed = time.time() - st
+
+    total = sum(len(s) for s in sentences)
+    correct = sum(g == p for gs, ps in zip(gold, pred) for g, (p, _) in zip(gs, ps))
+    return 100.0 * correct / total, total / elapsed if elapsed > 0 else float('inf')
+
+
+if __name__ == '__main__':
+    import quiz3
+
+    data = quiz3.read_data('../../res/pos/wsj-pos.dev.gold.tsv')
+    n = int(len(data) * 0.8)
+    trn_data, dev_data = data[:n], data[n:]
+    args = (quiz3.create_cw_dict(trn_data), quiz3.create_cw_pp_dict(trn_data), quiz3.create_pw_dict(trn_data),
+            quiz3.create_nw_dict(trn_data), quiz3.create_cw_pw_dict(trn_data), quiz3.create_cw_nw_dict(trn_data),
+            1.0, 0.5, 0.5, 0.5, 0.5, 0.5)
+    tokens = sum(len(s) for s in dev_data)
+
+    st = time.time()
+    acc = quiz3.evaluate(dev_data, *args)
+    print('quiz3.predict: {:5.2f}%, {:,.0f} tokens/sec'.format(acc, tokens / (time.time() - st)))
+
+    decoder = Decoder(*args)
+    for method in ['greedy', 'viterbi']:
+        acc, tps = evaluate(decoder, dev_data, method)
+        print('{}: {:5.2f}%, {:,.0f} tokens/sec'.format(method, acc, tps))
+
+    # empty sentences get no tags, as quiz3.predict() returns for them, whether or not the batch has others
+    for method in ['greedy', 'viterbi']:
+        assert decoder.decode([[]], method) == [[]], method
+        assert decoder.decode([['the', 'cat'], []], method) == [quiz3.predict(['the', 'cat'], *args), []], method
+
+    # unknown words are tagged by the backoff chain instead of XX, with the same tags as quiz3.predict() gets
+    from pos_backoff import BackoffTagger
+    backoff = BackoffTagger.train(trn_data)
+    decoder = Decoder(*args, backoff)
+    sentences = [[w for w, _ in s] for s in dev_data]
+    print('greedy + backoff == quiz3.predict + backoff:',
+          decoder.decode(sentences) == [quiz3.predict(s, *args, backoff) for s in sentences])
+    for method in ['greedy', 'viterbi']:
+        acc, tps = evaluate(decoder, dev_data, method)
+        print('{} + backoff: {:5.2f}%, {:,.0f} tokens/sec'.format(method, acc, tps))
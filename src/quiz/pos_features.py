@@ -0,0 +1,191 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import re
+from typing import List, Tuple, Dict, Iterable, Sequence, Callable, NamedTuple, Optional, Union
+
+import numpy as np
+
+from pos_common import DUMMY
+from pos_corpus import EncodedCorpus, encode, WORD, TAG
+from tfidf import Vocabulary
+
+_SHAPES = [(re.compile(r'[A-Z]+'), 'X'), (re.compile(r'[a-z]+'), 'x'), (re.compile(r'[0-9]+'), 'd')]
+
+
+def word_shape(word: str) -> str:
+    """
+    :return: the word with every run of uppercase letters, lowercase letters and digits collapsed into X, x and d,
+             e.g., 'Xx' for 'Apple', 'd,d.d' for '1,000.50'.
+    """
+    for pattern, c in _SHAPES: word = pattern.sub(c, word)
+    return word
+
+
+# fields computed from the word at their offset, e.g., ('s3', 0) is the last three characters of the current word
+WORD_CLASSES: Dict[str, Callable[[str], str]] = {
+    's1': lambda w: w[-1:],
+    's2': lambda w: w[-2:],
+    's3': lambda w: w[-3:],
+    'shape': word_shape,
+}
+
+
+class Template(NamedTuple):
+    """
+    A context template: the feature of token i is made of the (field, offset) values in the order of fields,
+    where field is WORD, TAG or one of WORD_CLASSES and the value is DUMMY outside the sentence. A template of
+    one field yields plain string keys, and a template of several fields yields tuple keys, as the
+    quiz3.create_*_dict() functions do.
+    """
+    name: str
+    fields: Tuple[Tuple[str, int], ...]
+
+
+# the templates of the quiz3.create_*_dict() functions with the same key layouts, and word classes of the current word
+TEMPLATES = {t.name: t for t in [
+    Template('cw', ((WORD, 0),)),
+    Template('pp', ((TAG, -1),)),
+    Template('pw', ((WORD, -1),)),
+    Template('nw', ((WORD, 1),)),
+    Template('cw_pp', ((WORD, 0), (TAG, -1))),
+    Template('cw_pw', ((WORD, -1), (WORD, 0))),
+    Template('cw_nw', ((WORD, 0), (WORD, 1))),
+    Template('pw_cw_nw', ((WORD, -1), (WORD, 0), (WORD, 1))),
+    Template('s1', (('s1', 0),)),
+    Template('s2', (('s2', 0),)),
+    Template('s3', (('s3', 0),)),
+    Template('shape', (('shape', 0),)),
+]}
+
+
+class CountTable(NamedTuple):
+    """
+    The (feature, tag) counts of a template. Features are in the order they are first seen and feature i has
+    the tag IDs tags[ptr[i]:ptr[i+1]] with counts[ptr[i]:ptr[i+1]], in descending order of counts and, among
+    equal counts, in the order they are first seen, as Counter.most_common() returns them.
+    """
+    first: np.ndarray     # the index of the first token of each feature, from which its key can be read
+    ptr: np.ndarray
+    tags: np.ndarray
+    counts: np.ndarray
+
+
+def _check(template: Template):
+    for field, offset in template.fields:
+        if field not in {WORD, TAG} and field not in WORD_CLASSES: raise ValueError('Unknown field in {}: {}'.format(template.name, field))
+        if field == TAG and offset >= 0: raise ValueError('{} uses the tag at offset {}, which is not known while tagging'.format(template.name, offset))
+
+
+def column(corpus: EncodedCorpus, field: str, offset: int) -> Tuple[np.ndarray, Sequence[str]]:
+    """
+    :return: the ID of the field at the offset from every token (0 for DUMMY) and the strings of the IDs.
+    """
+    if field == WORD: return corpus.column(WORD, offset), corpus.words.terms
+    if field == TAG: return corpus.column(TAG, offset), corpus.tags.terms
+    # maps the word vocabulary to the classes once instead of every token
+    fn, classes = WORD_CLASSES[field], Vocabulary([DUMMY])
+    ids = np.array([0] + [classes.add(fn(w)) for w in corpus.words.terms[1:]], dtype=np.int64)
+    return ids[corpus.column(WORD, offset)], classes.terms
+
+
+def count(corpus: EncodedCorpus, template: Template) -> CountTable:
+    _check(template)
+    (field, offset), rest = template.fields[0], template.fields[1:]
+    key, _ = column(corpus, field, offset)
+    # renumbers the keys after every field so that the combined key never exceeds n_tokens * vocabulary size
+    for field, offset in rest:
+        ids, terms = column(corpus, field, offset)
+        _, key = np.unique(key * len(terms) + ids, return_inverse=True)
+
+    T = len(corpus.tags)
+    pairs, first, counts = np.unique(key * T + corpus.tag_ids, return_index=True, return_counts=True)
+    if len(pairs) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return CountTable(empty, np.zeros(1, dtype=np.int64), empty, empty)
+
+    # pairs are sorted by key, so the pairs of each feature are contiguous
+    keys = pairs // T
+    bounds = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    feature_first = np.minimum.reduceat(first, bounds)
+    row_order = np.argsort(feature_first, kind='stable')
+    row = np.empty(len(bounds), dtype=np.int64)
+    row[row_order] = np.arange(len(bounds))
+    pair_row = row[np.repeat(np.arange(len(bounds)), np.diff(np.r_[bounds, len(pairs)]))]
+
+    order = np.lexsort((first, -counts, pair_row))
+    ptr = np.zeros(len(bounds) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pair_row, minlength=len(bounds)), out=ptr[1:])
+    return CountTable(feature_first[row_order], ptr, pairs[order] % T, counts[order])
+
+
+def feature_keys(corpus: EncodedCorpus, template: Template, table: CountTable) -> List:
+    """
+    :return: the dictionary key of every feature in the table: a string for one field, a tuple for several.
+    """
+    columns = []
+    for field, offset in template.fields:
+        ids, terms = column(corpus, field, offset)
+        columns.append([terms[i] for i in ids[table.first].tolist()])
+    return columns[0] if len(columns) == 1 else list(zip(*columns))
+
+
+def to_probs(corpus: EncodedCorpus, template: Template, table: CountTable) -> Dict[object, List[Tuple[str, float]]]:
+    """
+    :return: the same dictionary as quiz3.to_probs() over the Counters of the template.
+    """
+    features = feature_keys(corpus, template, table)
+
+    tags = corpus.tags.terms
+    tag_ids, counts, ptr = table.tags.tolist(), table.counts.tolist(), table.ptr.tolist()
+    probs = dict()
+    for i, feature in enumerate(features):
+        s, e = ptr[i], ptr[i + 1]
+        total = sum(counts[s:e])
+        probs[feature] = [(tags[t], c / total) for t, c in zip(tag_ids[s:e], counts[s:e])]
+    return probs
+
+
+def extract(data: Union[EncodedCorpus, Iterable[List[Tuple[str, str]]]], templates: Optional[Sequence[Template]] = None) -> Dict[str, Dict]:
+    """
+    Counts the features of every template in one pass over the corpus instead of one per create_*_dict() function.
+    :param data: an EncodedCorpus, e.g., from pos_corpus.read_corpus(), or a list of tuple lists where each inner list
+                 represents a sentence and every tuple is a (word, pos) pair.
+    :param templates: the templates to extract; all of TEMPLATES by default.
+    :return: a dictionary where the key is the template name and the value is the same dictionary as
+             the corresponding quiz3.create_*_dict() function returns.
+    """
+    templates = list(TEMPLATES.values()) if templates is None else templates
+    corpus = data if isinstance(data, EncodedCorpus) else encode(data)
+    return {t.name: to_probs(corpus, t, count(corpus, t)) for t in templates}
+
+
+if __name__ == '__main__':
+    import time
+    import quiz3
+
+    data = quiz3.read_data('../../res/pos/wsj-pos.dev.gold.tsv')
+    creates = {'cw': quiz3.create_cw_dict, 'pp': quiz3.create_pp_dict, 'pw': quiz3.create_pw_dict,
+               'nw': quiz3.create_nw_dict, 'cw_pp': quiz3.create_cw_pp_dict, 'cw_pw': quiz3.create_cw_pw_dict,
+               'cw_nw': quiz3.create_cw_nw_dict, 'pw_cw_nw': quiz3.create_pw_cw_nw_dict}
+
+    st = time.time()
+    expected = {name: create(data) for name, create in creates.items()}
+    print('create_*_dict: {:.4f}s'.format(time.time() - st))
+
+    st = time.time()
+    actual = extract(data)
+    print('extract: {:.4f}s'.format(time.time() - st))
+    print('identical: {}'.format(all(list(actual[n].items()) == list(expected[n].items()) for n in creates)))
@@ -0,0 +1,119 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+The model file of the quiz3 tagger, in the binfile container: the sorted words and tags as StringTables,
+and for every feature the sorted integer keys, row offsets, int16 tag IDs and float32 probabilities of its
+FeatureTable, so that loading neither unpickles nor rebuilds a dictionary.
+"""
+from typing import Dict, Any
+
+import numpy as np
+
+import binfile
+from pos_decoder import Decoder, FeatureTable, FEATURES
+from string_table import StringTable
+
+MAGIC = b'POSMODEL'
+VERSION = 1
+
+
+def save(filename: str, decoder: Decoder, dtype: np.dtype = np.float32):
+    """
+    :param decoder: the tagger, e.g., Decoder(*quiz3.train(trn_data, dev_data)).
+    :param dtype: the type of the probabilities; float32 halves the tables, float64 keeps the scores
+                  bit-identical to quiz3.predict().
+    """
+    words = decoder.words if isinstance(decoder.words, StringTable) else StringTable.build(decoder.words)
+    tags = decoder.tags if isinstance(decoder.tags, StringTable) else StringTable.build(decoder.tags)
+    arrays = dict(words.arrays('words'))
+    arrays.update(tags.arrays('tags'))
+    for name in FEATURES:
+        table = decoder.tables[name]
+        arrays[name + '.keys'] = np.asarray(table.keys, dtype=np.int64)
+        arrays[name + '.ptr'] = np.asarray(table.ptr, dtype=np.int64)
+        arrays[name + '.tags'] = np.asarray(table.tags, dtype=np.int16)
+        arrays[name + '.probs'] = np.asarray(table.probs, dtype=dtype)
+    binfile.write(filename, MAGIC, VERSION, arrays, {'weights': [decoder.weights[name] for name in FEATURES]})
+
+
+def load(filename: str, mmap: bool = True, verify: bool = False, fallback: Any = None) -> Decoder:
+    """
+    :param mmap: if True, only the header is read up front and every table is a read-only view of a memory map,
+                 so all tagger processes loading the same file share one copy through the OS page cache.
+    :param verify: if True, checks the CRC-32 of the tables first, which reads the whole file.
+    :param fallback: tags the tokens no feature fires for, e.g., a pos_backoff.BackoffTagger; not stored in the file.
+    """
+    arrays, meta = binfile.read(filename, MAGIC, VERSION, mmap, verify)
+    tables: Dict[str, FeatureTable] = {
+        name: FeatureTable(arrays[name + '.keys'], arrays[name + '.ptr'], arrays[name + '.tags'], arrays[name + '.probs'])
+        for name in FEATURES}
+    words = StringTable.from_arrays(arrays, 'words')
+    tags = StringTable.from_arrays(arrays, 'tags')
+    return Decoder.from_tables(words, tags, tables, meta['weights'], fallback)
+
+
+def _rss() -> int:
+    """
+    :return: the resident set size of this process in KB (Linux only).
+    """
+    with open('/proc/self/status') as fin:
+        return next(int(line.split()[1]) for line in fin if line.startswith('VmRSS:'))
+
+
+def _measure(queue, fn, filename: str):
+    import time
+    before = _rss()
+    st = time.time()
+    model = fn(filename)
+    elapsed, rss = time.time() - st, _rss() - before
+    del model  # released only after the RSS is read
+    queue.put((elapsed, rss))
+
+
+def _load_pickle(filename: str):
+    import pickle
+    with open(filename, 'rb') as fin: return pickle.load(fin)
+
+
+if __name__ == '__main__':
+    import multiprocessing
+    import os
+    import pickle
+    import quiz3
+    from pos_decoder import evaluate
+
+    data = quiz3.read_data('../../res/pos/wsj-pos.dev.gold.tsv')
+    n = int(len(data) * 0.8)
+    trn_data, dev_data = data[:n], data[n:]
+    args = (quiz3.create_cw_dict(trn_data), quiz3.create_cw_pp_dict(trn_data), quiz3.create_pw_dict(trn_data),
+            quiz3.create_nw_dict(trn_data), quiz3.create_cw_pw_dict(trn_data), quiz3.create_cw_nw_dict(trn_data),
+            1.0, 0.5, 0.5, 0.5, 0.5, 0.5)
+    pickle_file, model_file = '/tmp/quiz3.pkl', '/tmp/quiz3.posmodel'
+    with open(pickle_file, 'wb') as fout: pickle.dump(args, fout)
+    save(model_file, Decoder(*args))
+
+    # each load runs in a fresh process so that the RSS growth is its own
+    ctx = multiprocessing.get_context('spawn')
+    for label, fn, filename in [('pickle', _load_pickle, pickle_file), ('model', load, model_file)]:
+        queue = ctx.Queue()
+        p = ctx.Process(target=_measure, args=(queue, fn, filename))
+        p.start()
+        elapsed, rss = queue.get()
+        p.join()
+        print('{:6}: {:,} bytes, load {:.4f}s, +{:,} KB RSS'.format(label, os.path.getsize(filename), elapsed, rss))
+
+    print('pickle: {:5.2f}%'.format(quiz3.evaluate(dev_data, *args)))
+    print('model : {:5.2f}%'.format(evaluate(load(model_file, verify=True), dev_data)[0]))
@@ -0,0 +1,153 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+Batch tagging and evaluation over a process pool. Sentences are cut into chunks and tagged by workers that each
+load the model once; a model file (see pos_model) is memory-mapped, so all workers share one copy of the tables.
+
+Usage: python pos_tagger.py MODEL INPUT [-o OUTPUT] [-w WORKERS] [--method viterbi] [--evaluate] [--backoff TRAIN]
+where INPUT has one token per line (extra columns are ignored unless --evaluate) and a blank line after each sentence.
+"""
+import argparse
+import sys
+import time
+from typing import List, Tuple, Sequence, Iterable, Iterator, NamedTuple, Optional, Union
+
+import pos_model
+from corpus_reader import iter_lines
+from parallel import chunked, ordered_map
+from pos_backoff import BackoffTagger
+from pos_corpus import iter_sentences, read_corpus
+from pos_decoder import Decoder, BATCH_SIZE
+
+_decoder: Optional[Decoder] = None
+_method = 'greedy'
+
+
+def _init_worker(model: Union[str, Decoder], method: str, fallback: Optional[BackoffTagger] = None):
+    global _decoder, _method
+    _decoder = pos_model.load(model, fallback=fallback) if isinstance(model, str) else model
+    if fallback is not None: _decoder.fallback = fallback
+    _method = method
+
+
+def _tag_chunk(sentences: List[Sequence[str]]) -> List[List[Tuple[str, float]]]:
+    return _decoder.decode(sentences, _method)
+
+
+def _format_chunk(sentences: List[Sequence[str]]) -> str:
+    return ''.join(''.join('{}\t{}\n'.format(w, p) for w, (p, _) in zip(s, pred)) + '\n'
+                   for s, pred in zip(sentences, _tag_chunk(sentences)))
+
+
+def _evaluate_chunk(sentences: List[List[Tuple[str, str]]]) -> Tuple[int, int, int]:
+    pred = _tag_chunk([[w for w, _ in s] for s in sentences])
+    correct = sum(g == p for s, ps in zip(sentences, pred) for (_, g), (p, _) in zip(s, ps))
+    return len(sentences), sum(len(s) for s in sentences), correct
+
+
+def tag(sentences: Iterable[Sequence[str]], model: Union[str, Decoder], workers: int = 0, chunk_size: int = BATCH_SIZE,
+        method: str = 'greedy', fallback: Optional[BackoffTagger] = None) -> Iterator[List[Tuple[str, float]]]:
+    """
+    :param sentences: lists of tokens; read lazily, so this can be a stream over a large file.
+    :param model: the path to a pos_model file, which every worker memory-maps, or a Decoder, which is sent to every worker once.
+    :param workers: the number of processes; 0 uses every available core, 1 tags in this process.
+    :param chunk_size: the number of sentences sent to a worker at a time.
+    :param method: 'greedy' or 'viterbi'; see Decoder.decode().
+    :param fallback: tags the tokens no feature fires for instead of XX, sent to every worker once; the decoder's own if None.
+    :return: for every sentence in the input order, the (POS, score) pair of each token as quiz3.predict() returns them.
+    """
+    initargs = (model, method, fallback)
+    for pred in ordered_map(_tag_chunk, chunked(sentences, chunk_size), workers, initializer=_init_worker, initargs=initargs):
+        yield from pred
+
+
+class Progress(NamedTuple):
+    sentences: int
+    tokens: int
+    correct: int
+    chunk_accuracy: float
+    tokens_per_sec: float
+
+    @property
+    def accuracy(self) -> float:
+        return 100.0 * self.correct / self.tokens if self.tokens else 0.0
+
+
+def evaluate(data: Iterable[List[Tuple[str, str]]], model: Union[str, Decoder], workers: int = 0,
+             chunk_size: int = BATCH_SIZE, method: str = 'greedy', fallback: Optional[BackoffTagger] = None) -> Iterator[Progress]:
+    """
+    :param data: sentences of (word, pos) pairs, e.g., pos_corpus.iter_sentences() over a gold file.
+    :param fallback: see tag().
+    :return: the running totals after every chunk, in the input order; the last one holds the overall accuracy.
+    """
+    st = time.time()
+    sentences, tokens, correct = 0, 0, 0
+    chunks = chunked(data, chunk_size)
+    for n, t, c in ordered_map(_evaluate_chunk, chunks, workers, initializer=_init_worker, initargs=(model, method, fallback)):
+        sentences, tokens, correct = sentences + n, tokens + t, correct + c
+        yield Progress(sentences, tokens, correct, 100.0 * c / t if t else 0.0, tokens / max(time.time() - st, 1e-9))
+
+
+def read_tokens(filename: str) -> Iterator[List[str]]:
+    """
+    :return: the tokens of every sentence in the file, one per line in the first column, one sentence per blank-line block.
+    """
+    sentence = []
+    for line in iter_lines(filename):
+        l = line.split()
+        if l:
+            sentence.append(l[0])
+        elif sentence:
+            yield sentence
+            sentence = []
+    if sentence: yield sentence
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description='Tags or evaluates a file of sentences with a quiz3 model file.')
+    parser.add_argument('model', help='the model file written by pos_model.save()')
+    parser.add_argument('input', help='one token per line, a blank line after each sentence')
+    parser.add_argument('-o', '--output', help='the output file; standard output by default')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='the number of processes; 0 for every core')
+    parser.add_argument('-c', '--chunk-size', type=int, default=BATCH_SIZE, help='the number of sentences per task')
+    parser.add_argument('-m', '--method', choices=['greedy', 'viterbi'], default='greedy')
+    parser.add_argument('-e', '--evaluate', action='store_true', help='reads gold tags from the second column and reports accuracy')
+    parser.add_argument('-b', '--backoff', metavar='TRAIN',
+                        help='a training file in the input format with gold tags; tags the tokens no feature fires for '
+                             'with a pos_backoff.BackoffTagger trained on it instead of XX')
+    args = parser.parse_args(argv)
+    fallback = BackoffTagger.train(read_corpus(args.backoff)) if args.backoff else None
+
+    if args.evaluate:
+        progress = None
+        for progress in evaluate(iter_sentences(args.input), args.model, args.workers, args.chunk_size, args.method, fallback):
+            print('{:,} sentences, {:,} tokens: chunk {:5.2f}%, total {:5.2f}%, {:,.0f} tokens/sec'.format(
+                progress.sentences, progress.tokens, progress.chunk_accuracy, progress.accuracy, progress.tokens_per_sec),
+                file=sys.stderr)
+        if progress: print('{:5.2f}'.format(progress.accuracy))
+        return
+
+    fout = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        chunks = chunked(read_tokens(args.input), args.chunk_size)
+        for text in ordered_map(_format_chunk, chunks, args.workers, initializer=_init_worker, initargs=(args.model, args.method, fallback)):
+            fout.write(text)
+    finally:
+        if fout is not sys.stdout: fout.close()
+
+
+if __name__ == '__main__':
+    main()
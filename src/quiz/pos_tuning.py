@@ -0,0 +1,168 @@
+# ========================================================================
+# Copyright 2020 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import itertools
+import random
+from typing import List, Tuple, Dict, Sequence, Iterable, Iterator, NamedTuple, Optional, Union
+
+import numpy as np
+
+from parallel import ordered_map
+from pos_corpus import EncodedCorpus, encode
+from pos_decoder import Decoder, FEATURES
+
+GRID = (0.1, 0.5, 1.0)
+# larger batches than for tagging: fewer passes over the positions per configuration, and the cache is built once
+BATCH_SIZE = 4096
+
+
+class Trial(NamedTuple):
+    weights: Tuple[float, ...]   # in the order of pos_decoder.FEATURES
+    accuracy: float
+
+
+class FeatureCache:
+    """
+    A dataset with every feature lookup done once: the sentences are encoded and prepared for greedy decoding,
+    so evaluating a weight configuration only adds up the cached probabilities and follows the previous tags.
+    """
+    def __init__(self, dicts: Sequence[Dict], data: Union[EncodedCorpus, List[List[Tuple[str, str]]]], batch_size: int = BATCH_SIZE):
+        """
+        :param dicts: the six probability dictionaries in the order of quiz3.predict().
+        :param data: the sentences of (word, pos) pairs to evaluate on, or an EncodedCorpus of them.
+        """
+        self.decoder = Decoder(*dicts, *([1.0] * len(FEATURES)))
+        corpus = data if isinstance(data, EncodedCorpus) else encode(data)
+        self.batches, self.gold = [], []
+        self.size = len(corpus)
+
+        for batch, gold in self.decoder.corpus_batches(corpus, batch_size):
+            self.batches.append(self.decoder.prepare(batch))
+            self.gold.append(gold)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def accuracy(self, weights: Sequence[float]) -> float:
+        """
+        :param weights: the feature weights in the order of pos_decoder.FEATURES.
+        :return: the accuracy in percent of greedy decoding with the weights; the same as quiz3.evaluate().
+        """
+        correct = 0
+        for prepared, gold in zip(self.batches, self.gold):
+            tags, _ = self.decoder.greedy(prepared, weights)
+            correct += int(np.count_nonzero(tags == gold))
+        return 100.0 * correct / self.size
+
+
+_cache: Optional[FeatureCache] = None
+
+
+def _init_worker(cache: FeatureCache):
+    global _cache
+    _cache = cache
+
+
+def _evaluate(weights: Tuple[float, ...]) -> Trial:
+    return Trial(weights, _cache.accuracy(weights))
+
+
+def evaluate_all(cache: FeatureCache, configs: Iterable[Tuple[float, ...]], workers: int = 1) -> Iterator[Trial]:
+    """
+    :param workers: the number of processes; the cache is sent to each worker once.
+    :return: the trials of the weight configurations in the input order.
+    """
+    return ordered_map(_evaluate, configs, workers, initializer=_init_worker, initargs=(cache,))
+
+
+def _best(trials: Iterable[Trial], best: Optional[Trial] = None) -> Optional[Trial]:
+    for trial in trials:
+        if best is None or trial.accuracy > best.accuracy: best = trial
+    return best
+
+
+def grid_search(cache: FeatureCache, grid: Sequence[float] = GRID, workers: int = 1) -> Trial:
+    """
+    :return: the best of all len(grid) ** 6 configurations; ties go to the earliest in itertools.product() order.
+    """
+    return _best(evaluate_all(cache, itertools.product(grid, repeat=len(FEATURES)), workers))
+
+
+def random_search(cache: FeatureCache, grid: Sequence[float] = GRID, trials: int = 100, patience: int = 30,
+                  seed: int = 0, workers: int = 1) -> Trial:
+    """
+    Evaluates configurations drawn from the grid without replacement.
+    :param trials: the maximum number of configurations to evaluate.
+    :param patience: stops early once this many consecutive configurations have not improved the best accuracy.
+    """
+    configs = list(itertools.product(grid, repeat=len(FEATURES)))
+    random.Random(seed).shuffle(configs)
+    best, stale = None, 0
+    for trial in evaluate_all(cache, configs[:trials], workers):
+        if best is None or trial.accuracy > best.accuracy: best, stale = trial, 0
+        else: stale += 1
+        if stale >= patience: break
+    return best
+
+
+def coordinate_ascent(cache: FeatureCache, grid: Sequence[float] = GRID, init: Optional[Sequence[float]] = None,
+                      max_rounds: int = 10, workers: int = 1) -> Trial:
+    """
+    Tunes one weight at a time over the grid, keeping the others fixed, and stops after the first round
+    over all weights that does not improve the accuracy.
+    :param init: the starting weights; the middle of the grid for every feature by default.
+    """
+    weights = tuple(init) if init else (grid[len(grid) // 2],) * len(FEATURES)
+    best = Trial(weights, cache.accuracy(weights))
+
+    for _ in range(max_rounds):
+        start = best.accuracy
+        for f in range(len(FEATURES)):
+            configs = [best.weights[:f] + (v,) + best.weights[f + 1:] for v in grid if v != best.weights[f]]
+            best = _best(evaluate_all(cache, configs, workers), best)
+        if best.accuracy <= start: break
+
+    return best
+
+
+SEARCHES = {'grid': grid_search, 'random': random_search, 'coordinate': coordinate_ascent}
+
+
+if __name__ == '__main__':
+    import time
+    import quiz3
+
+    data = quiz3.read_data('../../res/pos/wsj-pos.dev.gold.tsv')
+    n = int(len(data) * 0.8)
+    trn_data, dev_data = data[:n], data[n:]
+    dicts = (quiz3.create_cw_dict(trn_data), quiz3.create_cw_pp_dict(trn_data), quiz3.create_pw_dict(trn_data),
+             quiz3.create_nw_dict(trn_data), quiz3.create_cw_pw_dict(trn_data), quiz3.create_cw_nw_dict(trn_data))
+    weights = (1.0, 0.5, 0.5, 0.5, 0.5, 0.5)
+
+    st = time.time()
+    acc = quiz3.evaluate(dev_data, *dicts, *weights)
+    print('quiz3.evaluate: {:5.2f}%, {:.4f}s per configuration'.format(acc, time.time() - st))
+
+    st = time.time()
+    cache = FeatureCache(dicts, dev_data)
+    print('cache: {:.4f}s'.format(time.time() - st))
+    st = time.time()
+    acc = cache.accuracy(weights)
+    print('cache.accuracy: {:5.2f}%, {:.4f}s per configuration'.format(acc, time.time() - st))
+
+    for name, search in SEARCHES.items():
+        st = time.time()
+        trial = search(cache)
+        print('{}: {:5.2f}% {} in {:.2f}s'.format(name, trial.accuracy, trial.weights, time.time() - st))
@@ -13,6 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ========================================================================
+import re
+from functools import lru_cache
+from typing import List, Tuple, Dict, Iterable, Iterator, NamedTuple, Optional, Union
+
 digits = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine', 'ten', 'eleven', 'twelve',
           'thirteen', 'fourteen', 'fifteen', 'sixteen', 'seventeen', 'eighteen', 'nineteen']
 tens = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
@@ -23,8 +27,79 @@ ordinals = ['half', 'halves', 'first', 'second', 'third', 'fourth', 'fifth', 'si
             'fortieth', 'fiftieth', 'sixtieth', 'seventieth', 'eightieth', 'ninetieth', 'hundredth', 'thousandth', 'millionth', 'billionth', 'trillionth']
 any = digits + tens + exp + hundred
 
+# the class of every number word, for recognizing phrases without scanning the lists above
+NUMBER, SCALE, ORDINAL, POINT, HYPHEN = range(5)
+NUMBER_WORDS: Dict[str, int] = {w: NUMBER for w in digits + tens if w}
+NUMBER_WORDS.update((w, SCALE) for w in exp + hundred if w)
+NUMBER_WORDS.update((w, ORDINAL) for w in ordinals)
+NUMBER_WORDS.update({'point': POINT, '-': HYPHEN})
+
+# the value and role of every number word, for converting phrases without scanning the lists above
+UNIT, TEN, HUNDRED, MULTIPLIER = range(4)
+GRAMMAR: Dict[str, Tuple[int, int]] = {w: (i, UNIT) for i, w in enumerate(digits)}
+GRAMMAR.update((w, (i * 10, TEN)) for i, w in enumerate(tens) if w)
+GRAMMAR.update((w, (100, HUNDRED)) for w in hundred)
+GRAMMAR.update((w, (10 ** (3 * i), MULTIPLIER)) for i, w in enumerate(exp) if w)
+# the cardinal of every ordinal but the fractions "half" and "halves"
+ORDINAL_GRAMMAR: Dict[str, Tuple[int, int]] = {o: GRAMMAR[c] for o, c in zip(ordinals[2:], digits[1:] + tens[2:] + hundred + exp[1:])}
+DECIMAL_DIGITS: Dict[str, str] = {w: str(i) for i, w in enumerate(digits[:10])}
+CACHE_SIZE = 1 << 16
+
+TOKEN = re.compile(r'-|[^\s-]+')
+START_CHARS = frozenset('"?!')
+ENDS = ["n't", '.', ',', '"', '?', '!']
+END_CHARS = frozenset(e[-1] for e in ENDS)
+ABBREVIATIONS = frozenset(['Mr', 'Ms'])
+
+
+def iter_tokens(text: str) -> Iterator[Tuple[str, int, int]]:
+    """
+    Splits the text on whitespace and hyphens, then splits leading quotes and marks and trailing punctuation and
+    "n't" off every piece, except the period of an abbreviation ("Mr."), iterating instead of recursing.
+    :return: a generator of (token, start, end) with the character offsets (end exclusive) of every token in the text.
+    """
+    for m in TOKEN.finditer(text):
+        i, j = m.span()
+        # most pieces are plain words
+        if text[i] not in START_CHARS and text[j - 1] not in END_CHARS:
+            yield m.group(), i, j
+            continue
+
+        while i < j and text[i] in START_CHARS:
+            yield text[i], i, i + 1
+            i += 1
+
+        ends = []
+        while i < j:
+            end = next((e for e in ENDS if text.endswith(e, i, j)), None)
+            if end is None or (end == '.' and text[i:j - 1] in ABBREVIATIONS): break
+            ends.append((j - len(end), j))
+            j -= len(end)
+
+        if i < j: yield text[i:j], i, j
+        for k, l in reversed(ends): yield text[k:l], k, l
+
+
+def tokenize_with_offsets(text: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """
+    :return: the tokens and their (start, end) offsets, as the tokens and offsets of elit_tokenizer's sentences.
+    """
+    tokens, offsets = [], []
+    for token, start, end in iter_tokens(text):
+        tokens.append(token)
+        offsets.append((start, end))
+    return tokens, offsets
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token, _, _ in iter_tokens(text)]
+
+
 ### Code adapted from class discussion: https://github.com/emory-courses/computational-linguistics/blob/master/src/string_matching.py
-def tokenize(text):
+def _tokenize_recursive(text):
+    """
+    The original recursive tokenizer, kept as the reference of the benchmark; it also emits empty tokens.
+    """
     STARTS = ['"', '?', '!']
     ENDS = ["n't", '.', ',', '"', '?', '!']
     tokens = text.split()
@@ -61,105 +136,133 @@ def tokenize(text):
 
     return new_tokens
 
-def digit_conversion(list):
-    nums = list.copy()
-    for j in range(len(nums)):
-        nums[j] = nums[j].lower()
-    number = []
-    i = 0
-    while i < len(nums):
-        if nums[i] in tens and nums[i + 1] in digits:
-            number.append(((tens.index(nums[i]) * 10) + digits.index(nums[i + 1])))
-            i += 2
-        elif nums[i] in tens:
-            number.append(tens.index(nums[i]) * 10)
-            i += 1
-        elif nums[i] in digits:
-            number.append(digits.index(nums[i]))
-            i += 1
-        elif nums[i] in exp and not number:
-            number.append(10 ** (3 * exp.index(nums[i])))
-            i += 1
-        elif nums[i] in hundred and not number:
-            number.append(100)
-            i += 1
-        elif nums[i] in exp:
-            number[-1] *= (10 ** (3 * exp.index(nums[i])))
-            i += 1
-        elif nums[i] in hundred:
-            number[-1] *= 100
-            i += 1
-        else:
-            i += 1
+class Number(NamedTuple):
+    value: Union[int, float]
+    text: str   # the replacement, e.g., '365', '24th' or '34.65'
 
-    return sum(number)
 
-def normalize(text):
-    # TODO: to be updated
-    tokens = tokenize(text)
-    tokens.append('.') ### to handle index out of bound exception:: see below
-    tokens = ['.'] + tokens ### to handle index out of bound exception:: see below
-    words_list = []
-    num_list = []
-    i = 1
-
-    while i < len(tokens):
-        if tokens[i].lower() in any + ordinals:
-            j = i + 1
-            while(tokens[j].lower() in any or tokens[j] == '-' or tokens[j].lower() in ordinals or tokens[j] == 'point'):
-                j += 1
-            words_list.append(list(tokens[i:j]))
-            i = j
-        else:
-            i += 1
+def _cardinal(words: Iterable[Tuple[int, int]]) -> Tuple[int, bool]:
+    """
+    :param words: the (value, role) of every word.
+    :return: the value, and whether the words make one well-formed number; otherwise, a word that cannot continue
+             the number so far starts another one, and the numbers are summed, e.g., 6 + 200 for "six two hundred".
+    """
+    done = total = current = 0
+    prev, last, well_formed = None, None, True   # last: the smallest multiplier of the current number
+    for value, role in words:
+        if role == UNIT: bad = prev == UNIT or (prev == TEN and value >= 10)
+        elif role == TEN: bad = prev in (UNIT, TEN)
+        elif role == HUNDRED: bad = prev == HUNDRED or current >= 100
+        else: bad = prev == MULTIPLIER or (last is not None and value >= last)
 
-    i = 0
-    while len(words_list) > 0 and i < len(words_list):
-        if 'point' in words_list[i]:
-            del words_list[i]
-        else:
-            i += 1
+        if bad:
+            well_formed = False
+            done += total + current
+            total = current = 0
+            prev = last = None
 
-    i = 0
-    while len(words_list) > 0 and i < len(words_list):
-        if set(words_list[i]).intersection(ordinals):
-            del words_list[i]
+        if role == HUNDRED:
+            current = (current if prev in (UNIT, TEN) else 1) * value
+        elif role == MULTIPLIER:
+            total += (current if prev in (UNIT, TEN, HUNDRED) else 1) * value
+            current, last = 0, value
         else:
+            current += value
+        prev = role
+    return done + total + current, well_formed
+
+
+def _ordinal_suffix(n: int) -> str:
+    if 10 <= n % 100 <= 20: return 'th'
+    return {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def convert(phrase: Tuple[str, ...]) -> Optional[Number]:
+    """
+    Converts a phrase through GRAMMAR; repeated phrases cost one cache lookup (see convert.cache_info()).
+    :param phrase: lowercased number words without hyphens, e.g., ('three', 'hundred', 'sixty', 'five'),
+                   ('thirty', 'four', 'point', 'six', 'five') or ('twenty', 'fourth').
+    :return: the number, or None if a decimal or an ordinal is not well-formed, e.g., the fraction "two third".
+    """
+    if 'point' in phrase:
+        i = phrase.index('point')
+        fraction = [DECIMAL_DIGITS.get(w) for w in phrase[i + 1:]]
+        if not fraction or None in fraction or not all(w in GRAMMAR for w in phrase[:i]): return None
+        integer, well_formed = _cardinal(GRAMMAR[w] for w in phrase[:i])
+        if not well_formed: return None
+        text = '{}.{}'.format(integer, ''.join(fraction))
+        return Number(float(text), text)
+
+    last = ORDINAL_GRAMMAR.get(phrase[-1]) if phrase else None
+    if last:
+        if not all(w in GRAMMAR for w in phrase[:-1]): return None
+        value, well_formed = _cardinal([GRAMMAR[w] for w in phrase[:-1]] + [last])
+        return Number(value, str(value) + _ordinal_suffix(value)) if well_formed else None
+
+    if not all(w in GRAMMAR for w in phrase): return None
+    value, _ = _cardinal(GRAMMAR[w] for w in phrase)
+    return Number(value, str(value))
+
+
+def digit_conversion(list):
+    """
+    :return: the value of the number words in the list, ignoring any other word, e.g., 1000000 for "a million".
+    """
+    number = convert(tuple(w for w in map(str.lower, list) if w in GRAMMAR))
+    return number.value
+
+
+def number_phrases(tokens: List[str], ordinals: bool = False, decimals: bool = False) -> Iterator[Tuple[int, int, str]]:
+    """
+    Recognizes number phrases in one pass: a phrase starts at a number word and runs over number words, ordinals,
+    "point" and hyphens. A preceding "a" or "an" is part of a phrase that starts with a scale word
+    ("a hundred", "a hundred twenty", "a Hundred-Million"), whatever follows it.
+    :param ordinals: if True, converts ordinal phrases ("twenty-fourth" -> "24th"); otherwise they are left as they are.
+    :param decimals: if True, converts decimal phrases ("four point six five" -> "4.65"); otherwise they are left as they are.
+    :return: the (start token index, end token index (exclusive), replacement) of every phrase to replace.
+    """
+    classes = [NUMBER_WORDS.get(t.lower()) for t in tokens]
+    i, n = 0, len(tokens)
+    while i < n:
+        if classes[i] not in (NUMBER, SCALE, ORDINAL):
             i += 1
+            continue
 
-    for x in range(len(words_list)):
-        idx = tokens.index(words_list[x][0]) - 1
-        count = 0
-        if tokens[idx] in ['a', 'A']:
-            for z in range(len(words_list[x])):
-                if words_list[x][z].lower() in exp + hundred or words_list[x][z].lower() == '-':
-                    count += 1
-        if count == len(words_list[x]):
-            words_list[x].insert(0, tokens[idx])
-
-    for k in range(len(words_list)):
-        if '-' in words_list[k]:
-            w = words_list[k].copy()
-            w.remove('-')
-            num_list.append(digit_conversion(w))
-        else:
-            num_list.append(digit_conversion(words_list[k]))
-
-    # Handling single hyphenation
-    # Handling (a series) of hyphenation (crazy case)
-    for n in range(len(words_list)):
-        for p in range(len(words_list[n])):
-            if '-' in words_list[n]:
-                idx = words_list[n].index('-')
-                words_list[n][idx] = words_list[n][idx - 1] + '-' + words_list[n][idx + 1]
-                words_list[n].remove(words_list[n][idx - 1])
-                words_list[n].remove(words_list[n][idx])
-
-    for m in range(len(words_list)):
-        str1 = ' '.join(words_list[m])
-        text = text.replace(str1, str(num_list[m]))
+        j = i + 1
+        while j < n and classes[j] is not None: j += 1
+        end = j
+        while classes[end - 1] in (HYPHEN, POINT): end -= 1
+
+        phrase = classes[i:end]
+        if (ordinals or ORDINAL not in phrase) and (decimals or POINT not in phrase):
+            number = convert(tuple(tokens[k].lower() for k in range(i, end) if classes[k] != HYPHEN))
+            if number is not None:
+                start = i - 1 if i > 0 and classes[i] == SCALE and tokens[i - 1].lower() in ('a', 'an') else i
+                yield start, end, number.text
+        i = j
 
-    return text
+
+def normalize(text: str, ordinals: bool = False, decimals: bool = False) -> str:
+    """
+    Replaces every number phrase (see number_phrases()) with its digits, by character offset in a single pass.
+    """
+    tokens, offsets = tokenize_with_offsets(text)
+    return replace_phrases(text, offsets, number_phrases(tokens, ordinals, decimals))
+
+
+def replace_phrases(text: str, offsets: List[Tuple[int, int]], phrases: Iterable[Tuple[int, int, str]]) -> str:
+    """
+    :param offsets: the character offsets of the tokens.
+    :param phrases: the (start token index, end token index (exclusive), replacement) of every phrase, in order.
+    """
+    out, prev = [], 0
+    for start, end, replacement in phrases:
+        out.append(text[prev:offsets[start][0]])
+        out.append(replacement)
+        prev = offsets[end - 1][1]
+    out.append(text[prev:])
+    return ''.join(out)
 
 
 def normalize_extra(text):
@@ -177,7 +280,9 @@ if __name__ == '__main__':
         'There is a two story building costing a Hundred-Million dollars',
         'Andy has two third apples and one million five hundred sixty four halves bananas',
         'Ondy wins thirty-four point six five percents',
-        'I am the first one to get a six two hundred twenty-fourth battery'
+        'I am the first one to get a six two hundred twenty-fourth battery',
+        'It costs a hundred twenty dollars',
+        'She told a thousand and one stories'
     ]
 
     T = [
@@ -189,7 +294,9 @@ if __name__ == '__main__':
         'There is a 2 story building costing 100000000 dollars',
         'Andy has two third apples and one million five hundred sixty four halves bananas',
         'Ondy wins thirty-four point six five percents',
-        'I am the first one to get a six two hundred twenty-fourth battery'
+        'I am the first one to get a six two hundred twenty-fourth battery',
+        'It costs 120 dollars',
+        'She told 1000 and 1 stories'
     ]
 
     correct = 0
@@ -198,3 +305,26 @@ if __name__ == '__main__':
             correct += 1
 
     print('Score: {}/{}'.format(correct, len(S)))
+
+    import time
+    for n in [1000, 10000]:
+        text = ' '.join(S * n)
+        st = time.time()
+        normalize(text)
+        elapsed = time.time() - st
+        print('normalize: {:,} chars in {:.2f}s, {:,.0f} chars/sec'.format(len(text), elapsed, len(text) / elapsed))
+
+    text = ' '.join(S * 10000 + ['-'.join(['well'] * 500)] * 100)
+    for name, fn in [('_tokenize_recursive', _tokenize_recursive), ('tokenize', tokenize)]:
+        st = time.time()
+        tokens = [t for t in fn(text) if t]
+        print('{}: {:,} tokens, {:,.0f} chars/sec'.format(name, len(tokens), len(text) / (time.time() - st)))
+
+    phrases = [tuple(p.split()) for p in ['one hundred', 'twenty five', 'three hundred sixty five', 'thirty four point six five',
+                                          'twenty fourth', 'two million three hundred thousand']] * 100000
+    convert.cache_clear()
+    for name, fn in [('uncached', convert.__wrapped__), ('cached', convert)]:
+        st = time.time()
+        for p in phrases: fn(p)
+        print('convert ({}): {:,.0f} phrases/sec'.format(name, len(phrases) / (time.time() - st)))
+    print(convert.cache_info())
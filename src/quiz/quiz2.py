@@ -13,11 +13,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ========================================================================
-import json
-import math
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable
 
-from vector_space_models import term_frequencies, document_frequencies
+import tfidf
+import vsm_store
+from similarity import CosineSearch
 
 
 def cosine(x1: Dict[str, float], x2: Dict[str, float]) -> float:
@@ -27,55 +27,35 @@ def cosine(x1: Dict[str, float], x2: Dict[str, float]) -> float:
     x22 = sum((s3) ** 2 for term, s3 in x2.items()) ** 0.5
     return inner_product / (x11 * x22)
 
-def vectorize(documents: List[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
-    # Feel free to update this function
-    def ntf(documents):
-        tfs = term_frequencies(documents)
-        alpha = 0.2
-        out = dict()
-
-        for key, counts in tfs.items():
-            argmax = max(dict(counts.items()).values())
-            out[key] = {t: alpha + (1.0 - alpha) * (tf / argmax) for t, tf in counts.items()}
-        return out
-
-    def wf(documents):
-        tfs = term_frequencies(documents)
-        out = dict()
-
-        for key, counts in tfs.items():
-            out[key] = {t: 1 + math.log(tf) if tf > 0.0 else 0 for t, tf in counts.items()}
-        return out
-
-    def tf_idfs(fables) -> Dict[str, Dict[str, int]]:
-        tfs = term_frequencies(fables)
-        dfs = document_frequencies(fables)
-        out = dict()
-        D = len(tfs)
-
-        for dkey, term_counts in tfs.items():
-            out[dkey] = {t: tf * math.log(D / dfs[t]) for t, tf in term_counts.items()}
-
-        return out
-
-    return tf_idfs(documents)
+def vectorize(documents: Iterable[Dict[str, Any]], scheme: str = 'tfidf') -> Dict[str, Dict[str, int]]:
+    """
+    :param documents: an iterable of documents, each with the 'source' and 'tokens' fields.
+    :param scheme: the weighting scheme, one of 'tfidf', 'ntf', 'wf' (see tfidf.SCHEMES).
+    """
+    return tfidf.to_dicts(tfidf.vectorize(documents, scheme))
 
 def similar_documents(X: Dict[str, Dict[str, float]], Y: Dict[str, Dict[str, float]]) -> Dict[str, str]:
-    # Feel free to update this function
-    def most_similar(Y: Dict[str, Dict[str, float]], X: Dict[str, float]) -> str:
-        dic = {}
-        for key in Y.keys():
-            dic[key] = cosine(Y[str(key)], X)
-        return max(dic.items(), key=lambda x: x[1])[0]
-
-    return {k: most_similar(Y, x) for k, x in X.items()}
+    """
+    :param X: the query vectors.
+    :param Y: the candidate vectors.
+    :return: a dictionary mapping each key in X to the key in Y with the highest cosine similarity.
+    """
+    vocab = tfidf.Vocabulary()
+    Y = tfidf.from_dicts(Y, vocab)
+    X = tfidf.from_dicts(X, vocab)
+    return CosineSearch(Y).most_similar(X)
 
 if __name__ == '__main__':
-    fables = json.load(open('../../res/vsm/aesopfables.json'))
-    fables_alt = json.load(open('../../res/vsm/aesopfables-alt.json'))
-
-    v_fables = vectorize(fables)
-    v_fables_alt = vectorize(fables_alt)
-
-    for x, y in similar_documents(v_fables_alt, v_fables).items():
+    import os
+    import sys
+    import tempfile
+
+    # vectorized corpora are cached outside the tracked resources, in the directory given as the first argument
+    # or a temporary one, and reloaded through mmap on later runs
+    cache_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(tempfile.gettempdir(), 'cs329-vsm')
+    os.makedirs(cache_dir, exist_ok=True)
+    v_fables = vsm_store.cached_vectorize('../../res/vsm/aesopfables.json', os.path.join(cache_dir, 'aesopfables.vsm'))
+    v_fables_alt = vsm_store.cached_vectorize('../../res/vsm/aesopfables-alt.json', os.path.join(cache_dir, 'aesopfables-alt.vsm'))
+
+    for x, y in CosineSearch(v_fables.matrix).most_similar(v_fables_alt.matrix).items():
         print('{} -> {}'.format(x, y))
\ No newline at end of file
@@ -13,24 +13,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ========================================================================
-import pickle
 from collections import Counter
 from typing import List, Tuple, Dict, Any
 
-DUMMY = '!@#$'
+import pos_decoder
+import pos_features
+import pos_tagger
+import pos_tuning
+from pos_common import DUMMY, UNKNOWN_TAG
+
 
 def read_data(filename: str):
     data, sentence = [], []
-    fin = open(filename)
-
-    for line in fin:
-        l = line.split()
-        if l:
-            sentence.append((l[0], l[1]))
-        else:
-            data.append(sentence)
-            sentence = []
-
+    with open(filename) as fin:
+        for line in fin:
+            l = line.split()
+            if l:
+                sentence.append((l[0], l[1]))
+            else:
+                data.append(sentence)
+                sentence = []
+
+    if sentence: data.append(sentence)
     return data
 
 
@@ -43,7 +47,16 @@ def to_probs(model: Dict[Any, Counter]) -> Dict[str, List[Tuple[str, float]]]:
     return probs
 
 
-def evaluate(data: List[List[Tuple[str, str]]], *args):
+def evaluate(data: List[List[Tuple[str, str]]], *args, workers: int = 1):
+    """
+    :param workers: if not 1, tags with pos_tagger.evaluate() over this many processes (0 for every core),
+                    which gives the same accuracy as predict().
+    """
+    if workers != 1:
+        progress = None
+        for progress in pos_tagger.evaluate(data, pos_decoder.Decoder(*args), workers): pass
+        return progress.accuracy if progress else 0.0
+
     total, correct = 0, 0
     for sentence in data:
         tokens, gold = tuple(zip(*sentence))
@@ -136,48 +149,32 @@ def create_pw_cw_nw_dict(data: List[List[Tuple[str, str]]]) -> Dict[str, List[Tu
             model.setdefault((prev_word, curr_word, next_word), Counter()).update([curr_pos])
     return to_probs(model)
 
-def train(trn_data: List[List[Tuple[str, str]]], dev_data: List[List[Tuple[str, str]]]) -> Tuple:
+def train(trn_data: List[List[Tuple[str, str]]], dev_data: List[List[Tuple[str, str]]], search: str = 'grid', workers: int = 1) -> Tuple:
     """
-    :param trn_data: the training set
-    :param dev_data: the development set
+    :param trn_data: the training set, as returned by read_data() or pos_corpus.read_corpus()
+    :param dev_data: the development set, likewise
+    :param search: the weight search in pos_tuning.SEARCHES; 'grid' tries every combination of 0.1, 0.5 and 1.0.
+    :param workers: the number of processes evaluating weight configurations.
     :return: a tuple of all parameters necessary to perform part-of-speech tagging
     """
-    # TODO: to be updated
-
-    cw_dict = create_cw_dict(trn_data)
-    pp_dict = create_pp_dict(trn_data)
-    pw_dict = create_pw_dict(trn_data)
-    nw_dict = create_nw_dict(trn_data)
-    cw_pp_dict = create_cw_pp_dict(trn_data)
-    cw_pw_dict = create_cw_pw_dict(trn_data)
-    cw_nw_dict = create_cw_nw_dict(trn_data)
-    pw_cw_nw_dict = create_pw_cw_nw_dict(trn_data)
-    best_acc, best_args = -1, None
-    grid = [0.1, 0.5, 1.0]
-
-    for cw_weight in grid:
-        for cw_pp_weight in grid:
-            for pw_weight in grid:
-                for nw_weight in grid:
-                    for cw_pw_weight in grid:
-                        for cw_nw_weight in grid:
-                            args = (cw_dict, cw_pp_dict, pw_dict, nw_dict, cw_pw_dict, cw_nw_dict, cw_weight, cw_pp_weight, pw_weight, nw_weight, cw_pw_weight, cw_nw_weight)
-                            acc = evaluate(dev_data, *args)
-                            print('{:5.2f}% - cw: {:3.1f}, cw_pp: {:3.1f}, pw: {:3.1f}, nw: {:3.1f}, cw_pw: {:3.1f}, cw_nw: {:3.1f}'.format(acc, cw_weight, cw_pp_weight, pw_weight, nw_weight, cw_pw_weight, cw_nw_weight))
-                            if acc > best_acc: best_acc, best_args = acc, args
-
-    return best_args
+    features = pos_features.extract(trn_data, [pos_features.TEMPLATES[name] for name in pos_tuning.FEATURES])
+    dicts = tuple(features.values())
+
+    cache = pos_tuning.FeatureCache(dicts, dev_data)
+    best = pos_tuning.SEARCHES[search](cache, workers=workers)
+    print('{:5.2f}% - cw: {:3.1f}, cw_pp: {:3.1f}, pw: {:3.1f}, nw: {:3.1f}, cw_pw: {:3.1f}, cw_nw: {:3.1f}'.format(best.accuracy, *best.weights))
+    return dicts + best.weights
 
 
 def predict(tokens: List[str], *args) -> List[Tuple[str, float]]:
     """
     :param tokens: a list of tokens.
-    :param args: a variable number of arguments
+    :param args: a variable number of arguments; the parameters returned by train(), optionally followed by
+                 a fallback such as pos_backoff.BackoffTagger that tags the tokens no feature fires for.
     :return: a list of tuple where each tuple represents a pair of (POS, score) of the corresponding token.
     """
-    # TODO: to be updated
-
-    cw_dict, cw_pp_dict, pw_dict, nw_dict, cw_pw_dict, cw_nw_dict, cw_weight, cw_pp_weight, pw_weight, nw_weight, cw_pw_weight, cw_nw_weight = args
+    cw_dict, cw_pp_dict, pw_dict, nw_dict, cw_pw_dict, cw_nw_dict, cw_weight, cw_pp_weight, pw_weight, nw_weight, cw_pw_weight, cw_nw_weight = args[:12]
+    fallback = args[12] if len(args) > 12 else None
     output = []
 
     for i in range(len(tokens)):
@@ -205,7 +202,8 @@ def predict(tokens: List[str], *args) -> List[Tuple[str, float]]:
         for pos, prob in cw_nw_dict.get((curr_word, next_word), list()):
             scores[pos] = scores.get(pos, 0) + prob * cw_nw_weight
 
-        o = max(scores.items(), key=lambda t: t[1]) if scores else ('XX', 0.0)
+        if scores: o = max(scores.items(), key=lambda t: t[1])
+        else: o = fallback.predict_token(tokens, i) if fallback else (UNKNOWN_TAG, 0.0)
         output.append(o)
 
     return output
@@ -213,13 +211,14 @@ def predict(tokens: List[str], *args) -> List[Tuple[str, float]]:
 
 if __name__ == '__main__':
     path = 'C:/Users/Owen/PycharmProjects/cs329/'  # path to the cs329 directory
-    trn_data = read_data(path + 'res/pos/wsj-pos.trn.gold.tsv')
-    dev_data = read_data(path + 'res/pos/wsj-pos.dev.gold.tsv')
-    model_path = path + 'src/quiz/quiz3.pkl'
+    import pos_corpus, pos_model
+    trn_data = pos_corpus.read_corpus(path + 'res/pos/wsj-pos.trn.gold.tsv')
+    dev_data = pos_corpus.read_corpus(path + 'res/pos/wsj-pos.dev.gold.tsv')
+    model_path = path + 'src/quiz/quiz3.posmodel'
 
     # save model
     args = train(trn_data, dev_data)
-    pickle.dump(args, open(model_path, 'wb'))
+    pos_model.save(model_path, pos_decoder.Decoder(*args))
     # load model
-    args = pickle.load(open(model_path, 'rb'))
-    print(evaluate(dev_data, *args))
\ No newline at end of file
+    decoder = pos_model.load(model_path)
+    print(pos_decoder.evaluate(decoder, dev_data)[0])
\ No newline at end of file
@@ -17,10 +17,13 @@ import glob
 import itertools
 import os
 from types import SimpleNamespace
-from typing import Iterable, Tuple, Any, List, Set
+from typing import Iterable, Iterator, Tuple, Any, List, Set, Union
 
 import ahocorasick
 
+from ner_automaton import TokenAutomaton
+from ner_intervals import Weight, schedule, span_length
+
 def create_ac(data: Iterable[Tuple[str, Any]]) -> ahocorasick.Automaton:
     """
     Creates the Aho-Corasick automation and adds all (span, value) pairs in the data and finalizes this matcher.
@@ -40,18 +43,25 @@ def create_ac(data: Iterable[Tuple[str, Any]]) -> ahocorasick.Automaton:
     return AC
 
 
-def read_gazetteers(dirname: str) -> ahocorasick.Automaton:
-    data = []
+def iter_gazetteers(dirname: str) -> Iterator[Tuple[str, str]]:
+    """
+    :return: the (span, label) pairs of every *.txt file in the directory, where the label is the file name.
+    """
     for filename in glob.glob(os.path.join(dirname, '*.txt')):
         label = os.path.basename(filename)[:-4]
-        for line in open(filename):
-            data.append((line.strip(), label))
-    return create_ac(data)
+        with open(filename) as fin:
+            for line in fin:
+                yield line.strip(), label
+
+
+def read_gazetteers(dirname: str) -> ahocorasick.Automaton:
+    return create_ac(iter_gazetteers(dirname))
 
 
-def match(AC: ahocorasick.Automaton, tokens: List[str]) -> List[Tuple[str, int, int, Set[str]]]:
+def match(AC: Union[ahocorasick.Automaton, TokenAutomaton], tokens: List[str]) -> List[Tuple[str, int, int, Set[str]]]:
     """
-    :param AC: the finalized Aho-Corasick automation.
+    :param AC: the finalized Aho-Corasick automation, or a ner_automaton.TokenAutomaton, which matches over tokens
+               without joining them into a string.
     :param tokens: the list of input tokens.
     :return: a list of tuples where each tuple consists of
              - span: str,
@@ -59,6 +69,8 @@ def match(AC: ahocorasick.Automaton, tokens: List[str]) -> List[Tuple[str, int,
              - end token index (exclusive): int
              - a set of values for the span: Set[str]
     """
+    if isinstance(AC, TokenAutomaton): return AC.entities(tokens)
+
     smap, emap, idx = dict(), dict(), 0
     for i, token in enumerate(tokens):
         smap[idx] = i
@@ -113,60 +125,18 @@ def bf_remove(sequence):
                 maxseq = seq
     return maxseq
 
-def remove_overlaps(entities: List[Tuple[str, int, int, Set[str]]]) -> List[Tuple[str, int, int, Set[str]]]:
+def remove_overlaps(entities: List[Tuple[str, int, int, Set[str]]], weight: Weight = span_length) -> List[Tuple[str, int, int, Set[str]]]:
     """
     :param entities: a list of tuples where each tuple consists of
              - span: str,
              - start token index (inclusive): int
              - end token index (exclusive): int
              - a set of values for the span: Set[str]
+    :param weight: the weight of an entity (see ner_intervals); the number of tokens it covers by default.
     :return: a list of entities where each entity is represented by a tuple of (span, start index, end index, value set)
+             that do not overlap and have the maximum total weight, sorted by end index.
     """
-    # TODO: to be updated
-    entities = sorted(entities, key=lambda x:x[1])
-    entities.append(('XXX', int(-1), int(-1), {'XXX'}))
-    overlap_sequence = []
-    nonoverlap_sequence = []
-    i = 0
-    max = -1
-    while i < len(entities) - 1:
-        if entities[i][2] > max:
-            max = entities[i][2]
-        seq = []
-        seq.append(entities[i])
-        j = i + 1
-        while j < len(entities) and entities[j][1] >= 0 and entities[j][1] <= max-1:
-            seq.append(entities[j])
-            if entities[j][2] > max:
-                max = entities[j][2]
-            j += 1
-
-        if len(seq) > 1:
-            overlap_sequence.append(seq)
-        else:
-            nonoverlap_sequence.append(seq[0])
-        i = j
-
-    for j in range(len(overlap_sequence)):
-        if overlap_sequence[j][0][2] >= overlap_sequence[j][-1][1]:
-            index = -1
-            max = -1
-            for i in range(len(overlap_sequence[j])):
-                ran = overlap_sequence[j][i][2] - overlap_sequence[j][i][1]
-                if ran > max:
-                    max = ran
-                    index = i
-            overlap_sequence[j] = [tuple(overlap_sequence[j][index])]
-        else:
-            overlap_sequence[j] = bf_remove(overlap_sequence[j])
-    final = []
-    for ovse in overlap_sequence:
-        for item in ovse:
-            final.append(item)
-    for nose in nonoverlap_sequence:
-        final.append(nose)
-    final = sorted(final, key=lambda x:x[2])
-    return final
+    return schedule(entities, weight)
 
 def to_bilou(tokens: List[str], entities: List[Tuple[str, int, int, str]]) -> List[str]:
     """
@@ -178,21 +148,16 @@ def to_bilou(tokens: List[str], entities: List[Tuple[str, int, int, str]]) -> Li
              - a named entity tag
     :return: a list of named entity tags in the BILOU notation with respect to the tokens
     """
-    # TODO: to be updated
     result = ["O"] * len(tokens)
     for item in entities:
         word, bow, eow, tag = item
-        tokens = word.split()
-        if len(tokens) == 1:
+        if eow - bow == 1:
             result[bow] = "U-" + tag
         else:
-            for tok in tokens:
-                if tokens.index(tok) == 0:
-                    result[bow] = "B-" + tag
-                elif tokens.index(tok) == len(tokens) - 1:
-                    result[bow + tokens.index(tok)] = "L-" + tag
-                else:
-                    result[bow + tokens.index(tok)] = "I-" + tag
+            result[bow] = "B-" + tag
+            for i in range(bow + 1, eow - 1):
+                result[i] = "I-" + tag
+            result[eow - 1] = "L-" + tag
 
     return result
 
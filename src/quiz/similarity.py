@@ -0,0 +1,207 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import json
+from typing import Dict, Tuple, Iterator
+
+import numpy as np
+
+from tfidf import CSRMatrix, Vocabulary
+
+QUERY_BLOCK = 256
+MAX_BYTES = 64 * 1024 * 1024
+
+
+def row_norms(matrix: CSRMatrix) -> np.ndarray:
+    """
+    :return: the L2 norm of every row.
+    """
+    return np.sqrt(np.bincount(matrix.row_ids(), weights=matrix.data ** 2, minlength=len(matrix.keys)))
+
+
+def normalize_rows(matrix: CSRMatrix) -> CSRMatrix:
+    """
+    :return: a copy of the matrix whose rows have unit L2 norms; all-zero rows stay zero.
+    """
+    norms = row_norms(matrix)
+    norms[norms == 0] = 1.0
+    return matrix.with_data(matrix.data / np.repeat(norms, np.diff(matrix.indptr)))
+
+
+def align(matrix: CSRMatrix, vocab: Vocabulary) -> CSRMatrix:
+    """
+    Re-indexes the matrix into another vocabulary, dropping the terms that vocabulary does not have.
+    Normalize before aligning so that the dropped terms still count towards the row norms.
+    """
+    if matrix.vocab is vocab: return matrix
+    table = np.array([vocab.get(t) for t in matrix.vocab.terms] + [-1], dtype=np.int64)
+    indices = table[matrix.indices]
+    keep = indices >= 0
+    counts = np.bincount(matrix.row_ids()[keep], minlength=len(matrix.keys))
+    indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    return CSRMatrix(matrix.keys, indptr, indices[keep].astype(np.int32), matrix.data[keep], vocab)
+
+
+class _QueryBlock:
+    """
+    Query rows [qs, qe) with their entries grouped by term, so that a candidate entry of term t
+    meets the query entries terms_start[col_map[t]]:terms_start[col_map[t]] + terms_count[col_map[t]].
+    """
+    def __init__(self, Q: CSRMatrix, qs: int, qe: int, col_map: np.ndarray):
+        b, t = Q.indptr[qs], Q.indptr[qe]
+        indices = Q.indices[b:t]
+        order = np.argsort(indices, kind='stable')
+        self.width = qe - qs
+        self.rows = np.repeat(np.arange(qe - qs), np.diff(Q.indptr[qs:qe + 1]))[order]
+        self.data = Q.data[b:t][order]
+        self.terms, self.starts, self.counts = np.unique(indices[order], return_index=True, return_counts=True)
+        self.col_map = col_map
+        col_map[self.terms] = np.arange(len(self.terms))
+
+    def release(self):
+        self.col_map[self.terms] = -1
+
+    def pairs(self, C: CSRMatrix) -> np.ndarray:
+        """
+        :return: the number of query entries each stored candidate entry is multiplied with.
+        """
+        cols = self.col_map[C.indices]
+        return np.where(cols >= 0, self.counts[cols], 0)
+
+    def tiles(self, C: CSRMatrix, max_bytes: int) -> Iterator[Tuple[int, int]]:
+        # candidate rows [s, e) cost an (e - s) x width score block plus a few arrays per (candidate, query) entry pair
+        n = len(C.keys)
+        pairs = np.concatenate(([0], np.cumsum(self.pairs(C))))
+        cost = np.arange(n + 1) * (8 * self.width) + pairs[C.indptr] * 32
+        s = 0
+        while s < n:
+            e = int(np.searchsorted(cost, cost[s] + max_bytes, side='right')) - 1
+            e = min(max(e, s + 1), n)
+            yield s, e
+            s = e
+
+    def score(self, C: CSRMatrix, s: int, e: int) -> np.ndarray:
+        """
+        :return: the (e - s) x width block of inner products between candidate rows [s, e) and this block.
+        """
+        b, t = C.indptr[s], C.indptr[e]
+        cols = self.col_map[C.indices[b:t]]
+        keep = cols >= 0
+        cols = cols[keep]
+        rows = np.repeat(np.arange(e - s), np.diff(C.indptr[s:e + 1]))[keep]
+        n_pairs = self.counts[cols]
+        total = int(n_pairs.sum())
+
+        # expand every candidate entry into one pair per query entry of the same term
+        ends = np.cumsum(n_pairs)
+        q = np.arange(total) - np.repeat(ends - n_pairs - self.starts[cols], n_pairs)
+        flat = np.repeat(rows * self.width, n_pairs) + self.rows[q]
+        weights = np.repeat(C.data[b:t][keep], n_pairs) * self.data[q]
+        return np.bincount(flat, weights=weights, minlength=(e - s) * self.width).reshape(e - s, self.width)
+
+
+def _select(idx: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # keeps the k best columns of each row; for k = 1 the earliest maximum wins ties
+    if scores.shape[1] <= k: return idx, scores
+    if k == 1:
+        top = np.argmax(scores, axis=1)[:, None]
+    else:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    return np.take_along_axis(idx, top, axis=1), np.take_along_axis(scores, top, axis=1)
+
+
+class CosineSearch:
+    """
+    Batched cosine top-k search over a fixed candidate matrix that is normalized once.
+    Queries are scored block by block with one sparse matrix product per candidate tile, and the tiles are sized
+    so that no intermediate grows beyond max_bytes, however many candidates there are.
+    """
+    def __init__(self, candidates: CSRMatrix, max_bytes: int = MAX_BYTES, query_block: int = QUERY_BLOCK):
+        self.matrix = normalize_rows(candidates)
+        self.max_bytes = max_bytes
+        self.query_block = query_block
+
+    @property
+    def keys(self):
+        return self.matrix.keys
+
+    def search(self, queries: CSRMatrix, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param queries: the query matrix; it is normalized and aligned to the candidates' vocabulary.
+        :param k: the number of candidates to return per query.
+        :return: a pair of (n_queries x k) arrays holding the candidate row indices and their cosine similarities,
+                 best first, ties broken by the earlier candidate.
+        """
+        C = self.matrix
+        Q = align(normalize_rows(queries), C.vocab)
+        k = min(k, len(C.keys))
+        n = len(Q.keys)
+        out_idx = np.zeros((n, k), dtype=np.int64)
+        out_scores = np.zeros((n, k), dtype=np.float64)
+        col_map = np.full(len(C.vocab) + 1, -1, dtype=np.int64)
+
+        for qs in range(0, n, self.query_block):
+            qe = min(qs + self.query_block, n)
+            block = _QueryBlock(Q, qs, qe, col_map)
+            best_idx = np.zeros((qe - qs, 0), dtype=np.int64)
+            best_scores = np.zeros((qe - qs, 0), dtype=np.float64)
+
+            for s, e in block.tiles(C, self.max_bytes):
+                scores = block.score(C, s, e).T
+                idx = np.broadcast_to(np.arange(s, e), scores.shape)
+                idx, scores = _select(idx, scores, k)
+                best_idx, best_scores = _select(np.hstack((best_idx, idx)), np.hstack((best_scores, scores)), k)
+
+            block.release()
+            order = np.lexsort((best_idx, -best_scores), axis=1)
+            out_idx[qs:qe] = np.take_along_axis(best_idx, order, axis=1)
+            out_scores[qs:qe] = np.take_along_axis(best_scores, order, axis=1)
+
+        return out_idx, out_scores
+
+    def most_similar(self, queries: CSRMatrix) -> Dict[str, str]:
+        """
+        :return: a dictionary mapping each query key to the key of its most similar candidate.
+        """
+        idx, _ = self.search(queries, 1)
+        return {key: self.keys[i] for key, i in zip(queries.keys, idx[:, 0].tolist())}
+
+
+if __name__ == '__main__':
+    import time
+    import tfidf
+    from quiz2 import cosine
+
+    fables = json.load(open('../../res/vsm/aesopfables.json'))
+    fables_alt = json.load(open('../../res/vsm/aesopfables-alt.json'))
+
+    def copies(documents, n):
+        return [dict(d, source='{}{}'.format(d['source'], i)) for i in range(n) for d in documents]
+
+    vocab = tfidf.Vocabulary()
+    Y = tfidf.vectorize(copies(fables, 5), vocab=vocab)
+    X = tfidf.vectorize(copies(fables_alt, 10), vocab=vocab)
+    Yd, Xd = tfidf.to_dicts(Y), tfidf.to_dicts(X)
+    print('{} queries x {} candidates'.format(len(Xd), len(Yd)))
+
+    st = time.time()
+    baseline = {k: max(Yd, key=lambda y: cosine(Yd[y], x)) for k, x in Xd.items()}
+    print('cosine loop: {:.3f}s'.format(time.time() - st))
+
+    for max_bytes in [MAX_BYTES, 1024 * 1024]:
+        st = time.time()
+        search = CosineSearch(Y, max_bytes=max_bytes)
+        out = search.most_similar(X)
+        print('batched ({} bytes): {:.3f}s, agrees: {}'.format(max_bytes, time.time() - st, out == baseline))
@@ -0,0 +1,114 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+from hashlib import blake2b
+from typing import Dict, Iterator, Sequence
+
+import numpy as np
+
+
+def string_hash(s: str) -> int:
+    """
+    :return: a 63-bit hash of the string that is stable across processes and runs, unlike hash().
+    """
+    return int.from_bytes(blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little') >> 1
+
+
+class StringTable:
+    """
+    An immutable list of strings stored as flat arrays, with an open-addressing hash index from string to ID.
+    Because every part is a plain array, a table saved with binfile loads through mmap without rebuilding a dict.
+    It supports the read-only part of the tfidf.Vocabulary interface: len(), in, get() and terms.
+    """
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, slots: np.ndarray):
+        """
+        :param blob: the UTF-8 bytes of all strings concatenated.
+        :param offsets: string i is blob[offsets[i]:offsets[i+1]].
+        :param slots: the hash table of string IDs (-1 for empty slots); its size is a power of 2.
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.slots = slots
+        self._mask = len(slots) - 1
+        # memoryviews index into the (possibly memory-mapped) arrays without creating NumPy scalars
+        self._blob = memoryview(np.ascontiguousarray(blob)).cast('B')
+        self._offsets = memoryview(np.ascontiguousarray(offsets, dtype=np.int64)).cast('B').cast('q')
+        self._slots = memoryview(np.ascontiguousarray(slots, dtype=np.int64)).cast('B').cast('q')
+
+    @classmethod
+    def build(cls, strings: Sequence[str]) -> 'StringTable':
+        """
+        :param strings: the strings; string i gets the ID i. If a string occurs more than once, get() returns its first ID.
+        """
+        encoded = [s.encode('utf-8') for s in strings]
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+        # keeps the load factor at or below 0.5
+        size = 1 << max(1, (2 * len(strings) - 1).bit_length())
+        slots = np.full(size, -1, dtype=np.int64)
+        pos = np.array([string_hash(s) for s in strings], dtype=np.int64) & (size - 1)
+        pending = np.arange(len(strings))
+
+        # linear probing, vectorized: every round places each pending string that reached an empty slot
+        # (the first of those competing for the same slot), and the rest move on to the next slot
+        while len(pending):
+            free = pending[slots[pos[pending]] == -1]
+            _, first = np.unique(pos[free], return_index=True)
+            placed = free[first]
+            slots[pos[placed]] = placed
+            pending = pending[slots[pos[pending]] != pending]
+            pos[pending] = (pos[pending] + 1) & (size - 1)
+
+        return cls(blob, offsets, slots)
+
+    def arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {prefix + '.blob': self.blob, prefix + '.offsets': self.offsets, prefix + '.slots': self.slots}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], prefix: str) -> 'StringTable':
+        return cls(arrays[prefix + '.blob'], arrays[prefix + '.offsets'], arrays[prefix + '.slots'])
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        data, offsets = self.blob.tobytes(), self.offsets.tolist()
+        return (data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1))
+
+    def __contains__(self, s: str) -> bool:
+        return self.get(s) >= 0
+
+    @property
+    def terms(self) -> 'StringTable':
+        return self
+
+    def get(self, s: str, default: int = -1) -> int:
+        """
+        :return: the ID of the string, or default if the table does not have it.
+        """
+        b = s.encode('utf-8')
+        i = string_hash(s) & self._mask
+        slots, offsets, blob = self._slots, self._offsets, self._blob
+        while True:
+            sid = slots[i]
+            if sid < 0: return default
+            start, end = offsets[sid], offsets[sid + 1]
+            if end - start == len(b) and blob[start:end] == b: return sid
+            i = (i + 1) & self._mask
@@ -0,0 +1,141 @@
+# ========================================================================
+# Copyright 2021 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+"""
+Runs quiz1.normalize() over files or standard input, one line or one blank-line-delimited document at a time.
+Either way, the blank lines of the input are written as they are.
+Chunks of texts are normalized in a process pool through parallel.ordered_map, which bounds the chunks in flight
+and yields them in the input order, so the output matches the input line for line however large it is.
+
+Usage: python text_normalizer.py [INPUT ...] [-o OUTPUT] [-w WORKERS] [-d] [--ordinals] [--decimals]
+where no INPUT or "-" reads standard input.
+"""
+import argparse
+import sys
+import time
+from collections import Counter
+from functools import partial
+from typing import List, Tuple, Sequence, Iterable, Iterator, Optional
+
+import quiz1
+from corpus_reader import iter_lines
+from parallel import chunked, ordered_map
+
+CHUNK_SIZE = 1000
+
+
+def read_lines(filenames: Sequence[str]) -> Iterator[str]:
+    for filename in filenames or ['-']:
+        if filename == '-': yield from (line.rstrip('\r\n') for line in sys.stdin)
+        else: yield from iter_lines(filename)
+
+
+def read_documents(lines: Iterable[str]) -> Iterator[str]:
+    """
+    :return: the documents separated by blank lines, each as its lines followed by the blank lines after it
+             (the first one also by those before it), every line ending with a newline, so that writing the
+             documents back to back reproduces the runs of blank lines.
+    """
+    document, started, ended = [], False, False
+    for line in lines:
+        if line.strip():
+            if ended:
+                yield ''.join(document)
+                document, ended = [], False
+            started = True
+        elif started:
+            ended = True
+        document.append(line + '\n')
+    if document: yield ''.join(document)
+
+
+def normalize_chunk(texts: List[str], ordinals: bool = False, decimals: bool = False) -> Tuple[List[str], Counter]:
+    """
+    :param ordinals: see quiz1.number_phrases().
+    :param decimals: see quiz1.number_phrases().
+    :return: the normalized texts, and the counts of texts, characters, tokens, number phrases and hits and misses
+             of the conversion cache, and the seconds spent tokenizing and converting.
+    """
+    counts, out = Counter(), []
+    cache = quiz1.convert.cache_info()
+    for text in texts:
+        st = time.perf_counter()
+        tokens, offsets = quiz1.tokenize_with_offsets(text)
+        t = time.perf_counter()
+        phrases = list(quiz1.number_phrases(tokens, ordinals, decimals))
+        out.append(quiz1.replace_phrases(text, offsets, phrases))
+        counts['convert'] += time.perf_counter() - t
+        counts['tokenize'] += t - st
+        counts['tokens'] += len(tokens)
+        counts['phrases'] += len(phrases)
+        counts['chars'] += len(text)
+    counts['texts'] += len(texts)
+    info = quiz1.convert.cache_info()
+    counts['cache_hits'] += info.hits - cache.hits
+    counts['cache_misses'] += info.misses - cache.misses
+    return out, counts
+
+
+def run(texts: Iterable[str], workers: int = 0, chunk_size: int = CHUNK_SIZE, ordinals: bool = False,
+        decimals: bool = False, stats: Optional[Counter] = None) -> Iterator[str]:
+    """
+    :param texts: read lazily, so this can be a stream over a large file.
+    :param workers: the number of processes; 0 uses every available core, 1 runs in this process.
+    :param stats: if given, accumulates the counts of normalize_chunk() summed over the workers.
+    :return: the normalized texts in the input order.
+    """
+    fn = partial(normalize_chunk, ordinals=ordinals, decimals=decimals)
+    for out, counts in ordered_map(fn, chunked(texts, chunk_size), workers):
+        if stats is not None: stats.update(counts)
+        yield from out
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description='Replaces number words with digits in text files, as quiz1.normalize().')
+    parser.add_argument('input', nargs='*', help='the input files; standard input if none or "-"')
+    parser.add_argument('-o', '--output', help='the output file; standard output by default')
+    parser.add_argument('-w', '--workers', type=int, default=0, help='the number of processes; 0 for every core')
+    parser.add_argument('-c', '--chunk-size', type=int, default=CHUNK_SIZE, help='the number of texts per task')
+    parser.add_argument('-d', '--documents', action='store_true',
+                        help='normalizes blank-line-delimited documents instead of lines; blank lines are kept as they are')
+    parser.add_argument('--ordinals', action='store_true', help='converts ordinals, e.g., "twenty-fourth" to "24th"')
+    parser.add_argument('--decimals', action='store_true', help='converts decimals, e.g., "four point six five" to "4.65"')
+    args = parser.parse_args(argv)
+
+    stats = Counter()
+    st = time.time()
+    texts = read_lines(args.input)
+    if args.documents: texts = read_documents(texts)
+    # documents end with their own newlines and the blank lines after them
+    separator = '' if args.documents else '\n'
+    fout = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for text in run(texts, args.workers, args.chunk_size, args.ordinals, args.decimals, stats):
+            fout.write(text)
+            fout.write(separator)
+    finally:
+        if fout is not sys.stdout: fout.close()
+
+    elapsed = max(time.time() - st, 1e-9)
+    print('{:,} texts, {:,} chars, {:,} tokens, {:,} number phrases in {:.2f}s: {:.2f} MB/sec, {:,.0f} tokens/sec'.format(
+        stats['texts'], stats['chars'], stats['tokens'], stats['phrases'], elapsed,
+        stats['chars'] / elapsed / 1e6, stats['tokens'] / elapsed), file=sys.stderr)
+    lookups = max(stats['cache_hits'] + stats['cache_misses'], 1)
+    print('tokenize {:.2f}s, convert {:.2f}s, conversion cache hits {:.2f}%'.format(
+        stats['tokenize'], stats['convert'], 100.0 * stats['cache_hits'] / lookups), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
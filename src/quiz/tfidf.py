@@ -0,0 +1,252 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import json
+import math
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Any, Optional
+
+import numpy as np
+
+NTF_ALPHA = 0.2
+
+
+def document_key(source: str) -> str:
+    return source[source.rfind('&') + 1:]
+
+
+class Vocabulary:
+    """
+    Maps terms to consecutive integer IDs in the order they are first seen.
+    A vocabulary can be shared across corpora so that their vectors live in the same space.
+    """
+    def __init__(self, terms: Iterable[str] = ()):
+        self.index: Dict[str, int] = dict()
+        self.terms: List[str] = []
+        for term in terms: self.add(term)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.index
+
+    def add(self, term: str) -> int:
+        tid = self.index.get(term)
+        if tid is None:
+            tid = self.index[term] = len(self.terms)
+            self.terms.append(term)
+        return tid
+
+    def get(self, term: str, default: int = -1) -> int:
+        return self.index.get(term, default)
+
+
+class CSRMatrix(NamedTuple):
+    """
+    A document-term matrix in the compressed sparse row format.
+    Row i holds the document keys[i]; its term IDs are indices[indptr[i]:indptr[i+1]], in the order the terms
+    first occur in the document, and its weights are data[indptr[i]:indptr[i+1]].
+    """
+    keys: List[str]
+    indptr: np.ndarray
+    indices: np.ndarray
+    data: np.ndarray
+    vocab: Vocabulary
+
+    @property
+    def shape(self):
+        return len(self.keys), len(self.vocab)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.indices)
+
+    def row_ids(self) -> np.ndarray:
+        """
+        :return: the row index of every stored entry, aligned with indices and data.
+        """
+        return np.repeat(np.arange(len(self.keys)), np.diff(self.indptr))
+
+    def row(self, i: int) -> Dict[str, float]:
+        b, e = self.indptr[i], self.indptr[i + 1]
+        terms = self.vocab.terms
+        return {terms[t]: w for t, w in zip(self.indices[b:e].tolist(), self.data[b:e].tolist())}
+
+    def with_data(self, data: np.ndarray) -> 'CSRMatrix':
+        return self._replace(data=data)
+
+
+def count_matrix(fables: Iterable[Dict[str, Any]], vocab: Optional[Vocabulary] = None) -> CSRMatrix:
+    """
+    Counts term frequencies of every document in a single pass.
+    :param fables: an iterable of documents, each with the 'source' and 'tokens' fields.
+    :param vocab: the vocabulary to extend; a new one is created if not given.
+    :return: the document-term matrix whose data are raw term counts.
+    """
+    vocab = Vocabulary() if vocab is None else vocab
+    get, add = vocab.index.get, vocab.add
+    keys, indptr, indices, counts = [], array('q', [0]), array('q'), array('q')
+
+    for fable in fables:
+        tc = Counter(fable['tokens'].split())
+        ids = list(map(get, tc))
+        if None in ids: ids = [add(t) for t in tc]
+        keys.append(document_key(fable['source']))
+        indices.extend(ids)
+        counts.extend(tc.values())
+        indptr.append(len(indices))
+
+    indptr = np.frombuffer(indptr, dtype=np.int64).copy()
+    indices = np.frombuffer(indices, dtype=np.int64).astype(np.int32)
+    counts = np.frombuffer(counts, dtype=np.int64).copy()
+    return CSRMatrix(keys, indptr, indices, counts, vocab)
+
+
+def document_frequencies(counts: CSRMatrix) -> np.ndarray:
+    """
+    :param counts: a document-term matrix.
+    :return: the number of documents containing each term, indexed by term ID.
+    """
+    return np.bincount(counts.indices, minlength=len(counts.vocab))
+
+
+def num_documents(counts: CSRMatrix) -> int:
+    """
+    :return: the number of distinct document keys, which is what term_frequencies() keeps.
+    """
+    return len(set(counts.keys))
+
+
+def _lookup(counts: np.ndarray, f) -> np.ndarray:
+    # applies f once per distinct count instead of once per entry
+    values, inverse = np.unique(counts, return_inverse=True)
+    table = np.array([f(v) for v in values.tolist()], dtype=np.float64)
+    return table[inverse.reshape(-1)]
+
+
+def idf(dfs: np.ndarray, D: int) -> np.ndarray:
+    """
+    :param dfs: document frequencies indexed by term ID.
+    :param D: the total number of documents.
+    :return: log(D / df) for every term; terms that do not occur get 0.
+    """
+    return _lookup(dfs, lambda df: math.log(D / df) if df > 0 else 0.0)
+
+
+def raw_tf(counts: CSRMatrix) -> np.ndarray:
+    return counts.data.astype(np.float64)
+
+
+def ntf(counts: CSRMatrix, alpha: float = NTF_ALPHA) -> np.ndarray:
+    """
+    :return: the augmented term frequency alpha + (1 - alpha) * tf / max(tf) of each entry.
+    """
+    lengths = np.diff(counts.indptr)
+    rowmax = np.zeros(len(lengths), dtype=np.int64)
+    nonempty = lengths > 0
+    if counts.nnz: rowmax[nonempty] = np.maximum.reduceat(counts.data, counts.indptr[:-1][nonempty])
+    return alpha + (1.0 - alpha) * (counts.data / np.repeat(rowmax, lengths))
+
+
+def wf(counts: CSRMatrix) -> np.ndarray:
+    """
+    :return: the sublinear term frequency 1 + log(tf) of each entry.
+    """
+    return _lookup(counts.data, lambda tf: 1 + math.log(tf) if tf > 0 else 0.0)
+
+
+def tf_idf(counts: CSRMatrix) -> np.ndarray:
+    weights = idf(document_frequencies(counts), num_documents(counts))
+    return counts.data * weights[counts.indices]
+
+
+SCHEMES = {
+    'tf': raw_tf,
+    'tfidf': tf_idf,
+    'ntf': ntf,
+    'wf': wf,
+}
+
+
+def vectorize(fables: Iterable[Dict[str, Any]], scheme: str = 'tfidf', vocab: Optional[Vocabulary] = None) -> CSRMatrix:
+    """
+    :param fables: an iterable of documents, each with the 'source' and 'tokens' fields.
+    :param scheme: the weighting scheme, one of 'tf', 'tfidf', 'ntf', 'wf'.
+    :param vocab: the vocabulary to extend; pass the same one to vectorize several corpora into the same space.
+    :return: the weighted document-term matrix.
+    """
+    if scheme not in SCHEMES: raise ValueError('Unknown weighting scheme: {}'.format(scheme))
+    counts = count_matrix(fables, vocab)
+    return counts.with_data(SCHEMES[scheme](counts))
+
+
+def to_dicts(matrix: CSRMatrix) -> Dict[str, Dict[str, float]]:
+    """
+    Converts the matrix to the {document key: {term: weight}} shape returned by vector_space_models.tf_idfs().
+    As with term_frequencies(), a later document overrides an earlier one with the same key.
+    """
+    terms = matrix.vocab.terms
+    indptr, indices, data = matrix.indptr.tolist(), matrix.indices.tolist(), matrix.data.tolist()
+    out = dict()
+
+    for i, key in enumerate(matrix.keys):
+        b, e = indptr[i], indptr[i + 1]
+        out[key] = {terms[t]: w for t, w in zip(indices[b:e], data[b:e])}
+
+    return out
+
+
+def from_dicts(vectors: Dict[str, Dict[str, float]], vocab: Optional[Vocabulary] = None) -> CSRMatrix:
+    """
+    Converts {document key: {term: weight}} vectors, e.g., the output of to_dicts(), back to a matrix.
+    :param vocab: the vocabulary to extend; a new one is created if not given.
+    """
+    vocab = Vocabulary() if vocab is None else vocab
+    add = vocab.add
+    indptr, indices, data = array('q', [0]), array('q'), array('d')
+
+    for vector in vectors.values():
+        indices.extend([add(t) for t in vector])
+        data.extend(vector.values())
+        indptr.append(len(indices))
+
+    indptr = np.frombuffer(indptr, dtype=np.int64).copy()
+    indices = np.frombuffer(indices, dtype=np.int64).astype(np.int32)
+    data = np.frombuffer(data, dtype=np.float64).copy()
+    return CSRMatrix(list(vectors.keys()), indptr, indices, data, vocab)
+
+
+if __name__ == '__main__':
+    import time
+    from vector_space_models import term_frequencies, document_frequencies as dict_document_frequencies
+
+    fables = json.load(open('../../res/vsm/aesopfables.json'))
+    fables = fables * 50
+
+    st = time.time()
+    tfs, dfs = term_frequencies(fables), dict_document_frequencies(fables)
+    D = len(tfs)
+    {k: {t: tf * math.log(D / dfs[t]) for t, tf in c.items()} for k, c in tfs.items()}
+    print('dicts: {:.3f}s'.format(time.time() - st))
+
+    st = time.time()
+    matrix = vectorize(fables)
+    print('sparse: {:.3f}s, {} x {}, nnz = {}'.format(time.time() - st, *matrix.shape, matrix.nnz))
+
+    st = time.time()
+    to_dicts(matrix)
+    print('sparse + to_dicts: {:.3f}s'.format(time.time() - st))
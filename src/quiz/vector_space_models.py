@@ -16,13 +16,18 @@
 
 __author__ = 'Jinho D. Choi'
 
-import json
+from array import array
 from collections import Counter
-from typing import Dict, Tuple
+from typing import Dict, Tuple, List
 
-import math
 import requests
 
+import tfidf
+from corpus_reader import iter_documents
+from parallel import chunked, ordered_map
+
+CHUNKSIZE = 1000
+
 
 def download(remote_addr: str, local_addr: str):
     r = requests.get(remote_addr)
@@ -30,29 +35,89 @@ def download(remote_addr: str, local_addr: str):
     fin.write(r.content)
 
 
-def term_frequencies(fables) -> Dict[str, Counter]:
+def term_frequencies(fables, workers: int = 1, chunksize: int = CHUNKSIZE) -> Dict[str, Counter]:
+    """
+    :param workers: the number of processes to count with (0 for all cores); see frequencies().
+    """
+    if workers != 1: return _parallel_frequencies(fables, workers, chunksize, df=False)[0]
+
     def key(t): return t[t.rfind('&') + 1:]
 
     return {key(fable['source']): Counter(fable['tokens'].split()) for fable in fables}
 
 
-def document_frequencies(fables) -> Dict[str, int]:
+def document_frequencies(fables, workers: int = 1, chunksize: int = CHUNKSIZE) -> Dict[str, int]:
+    """
+    :param workers: the number of processes to count with (0 for all cores); see frequencies().
+    """
+    if workers != 1: return _parallel_frequencies(fables, workers, chunksize, tf=False)[1]
+
     dfs = Counter()
     for fable in fables:
         dfs.update(set(fable['tokens'].split()))
     return dfs
 
 
-def tf_idfs(fables) -> Dict[str, Dict[str, int]]:
-    tfs = term_frequencies(fables)
-    dfs = document_frequencies(fables)
-    out = dict()
-    D = len(tfs)
+def frequencies(fables, workers: int = 1, chunksize: int = CHUNKSIZE) -> Tuple[Dict[str, Counter], Dict[str, int]]:
+    """
+    Computes term_frequencies() and document_frequencies() in one pass, so fables can be a stream.
+    :param workers: the number of processes to count with (0 for all cores); with more than one, chunks of
+                    chunksize documents are counted in a process pool and merged, giving the same output.
+    """
+    if workers != 1: return _parallel_frequencies(fables, workers, chunksize)
 
-    for dkey, term_counts in tfs.items():
-        out[dkey] = {t: tf * math.log(D / dfs[t]) for t, tf in term_counts.items()}
+    tfs, dfs = dict(), Counter()
+    for fable in fables:
+        counts = Counter(fable['tokens'].split())
+        tfs[tfidf.document_key(fable['source'])] = counts
+        dfs.update(counts.keys())
+    return tfs, dfs
+
+
+def _count_chunk(task: Tuple[List[Tuple[str, str]], bool]):
+    """
+    The map step: counts a chunk of (source, tokens) pairs with a chunk-local integer vocabulary.
+    :return: (keys, terms, offsets, ids, counts, dfs) where document i has the term IDs ids[offsets[i]:offsets[i+1]]
+             with the counts counts[offsets[i]:offsets[i+1]], and dfs[j] is the document frequency of terms[j].
+    """
+    chunk, tf = task
+    index = dict()
+    keys, offsets, ids, counts = [], array('I', [0]), array('I'), array('I')
+
+    for source, tokens in chunk:
+        tc = Counter(tokens.split())
+        ids.extend([index.setdefault(t, len(index)) for t in tc])
+        if tf:
+            keys.append(tfidf.document_key(source))
+            counts.extend(tc.values())
+            offsets.append(len(ids))
+
+    dfs = array('I', bytes(4 * len(index)))
+    for i, c in Counter(ids).items(): dfs[i] = c
+    return keys, list(index), offsets, ids if tf else None, counts, dfs
+
+
+def _parallel_frequencies(fables, workers: int, chunksize: int, tf: bool = True, df: bool = True) -> Tuple[Dict[str, Counter], Dict[str, int]]:
+    tfs, dfs = dict(), Counter()
+    chunks = ((chunk, tf) for chunk in chunked(((f['source'], f['tokens']) for f in fables), chunksize))
+
+    # the reduce step: maps local IDs back to terms and merges in input order
+    for keys, terms, offsets, ids, counts, local_dfs in ordered_map(_count_chunk, chunks, workers):
+        if tf:
+            term = terms.__getitem__
+            for i, key in enumerate(keys):
+                b, e = offsets[i], offsets[i + 1]
+                tfs[key] = c = Counter()
+                dict.update(c, zip(map(term, ids[b:e]), counts[b:e]))
+        if df:
+            for term, c in zip(terms, local_dfs):
+                dfs[term] += c
+
+    return tfs, dfs
 
-    return out
+
+def tf_idfs(fables) -> Dict[str, Dict[str, int]]:
+    return tfidf.to_dicts(tfidf.vectorize(fables, 'tfidf'))
 
 
 def euclidean(x1: Dict[str, float], x2: Dict[str, float]) -> float:
@@ -76,11 +141,11 @@ if __name__ == '__main__':
     # download(aesop_link, aesop_file)
 
     # read json
-    fables = json.load(open(aesop_file))
+    fables = list(iter_documents(aesop_file, ('source', 'title', 'tokens')))
     print(len(fables))
     for fable in fables[:10]: print(fable['title'])
 
-    # retrieve term frequencies
+    # retrieve term frequencies (pass workers=0 to count on all cores)
     tfs = term_frequencies(fables)
     print(tfs['Androcles'])
 
@@ -111,7 +176,7 @@ if __name__ == '__main__':
     file = '../../res/vsm/aesopfables-alt.json'
     # download(link, file)
 
-    fables_alt = json.load(open(file))
+    fables_alt = iter_documents(file)
     tfidf_alt = tf_idfs(fables_alt)
 
     for k, x in tfidf_alt.items():
@@ -0,0 +1,106 @@
+# ========================================================================
+# Copyright 2022 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import os
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+import binfile
+import tfidf
+from corpus_reader import iter_documents
+from string_table import StringTable
+from tfidf import CSRMatrix
+
+MAGIC = b'VSMCORP'
+VERSION = 1
+
+
+class VectorizedCorpus(NamedTuple):
+    """
+    A vectorized corpus loaded from disk; the matrix's vocab is a StringTable rather than a Vocabulary.
+    """
+    matrix: CSRMatrix
+    idf: np.ndarray
+    scheme: str
+
+
+def save(filename: str, matrix: CSRMatrix, scheme: str = 'tfidf', idf: Optional[np.ndarray] = None):
+    """
+    :param matrix: the weighted document-term matrix, e.g., the output of tfidf.vectorize().
+    :param scheme: the weighting scheme the matrix was built with, recorded in the header.
+    :param idf: the IDF weights indexed by term ID; empty if not given.
+    """
+    vocab = matrix.vocab if isinstance(matrix.vocab, StringTable) else StringTable.build(matrix.vocab.terms)
+    keys = matrix.keys if isinstance(matrix.keys, StringTable) else StringTable.build(matrix.keys)
+    arrays = dict(vocab.arrays('vocab'))
+    arrays.update(keys.arrays('keys'))
+    arrays['idf'] = np.zeros(0, dtype=np.float64) if idf is None else np.asarray(idf, dtype=np.float64)
+    arrays['indptr'] = np.asarray(matrix.indptr, dtype=np.int64)
+    arrays['indices'] = np.asarray(matrix.indices, dtype=np.int32)
+    arrays['data'] = np.asarray(matrix.data, dtype=np.float64)
+    binfile.write(filename, MAGIC, VERSION, arrays, {'scheme': scheme})
+
+
+def load(filename: str, mmap: bool = True) -> VectorizedCorpus:
+    """
+    :param mmap: if True, nothing but the header is read up front; every array is a read-only view of a memory map
+                 whose pages are shared by all processes that load the same file.
+    """
+    arrays, meta = binfile.read(filename, MAGIC, VERSION, mmap)
+    vocab = StringTable.from_arrays(arrays, 'vocab')
+    keys = StringTable.from_arrays(arrays, 'keys')
+    matrix = CSRMatrix(keys, arrays['indptr'], arrays['indices'], arrays['data'], vocab)
+    return VectorizedCorpus(matrix, arrays['idf'], meta['scheme'])
+
+
+def cached_vectorize(source: str, filename: str, scheme: str = 'tfidf') -> VectorizedCorpus:
+    """
+    Loads the vectorized corpus from filename, or vectorizes the documents in source and saves them there first
+    if the file does not exist, is older than source, or was built with another scheme or format version.
+    """
+    try:
+        if os.path.getmtime(filename) >= os.path.getmtime(source):
+            corpus = load(filename)
+            if corpus.scheme == scheme: return corpus
+    except (OSError, binfile.FormatError):
+        pass
+
+    counts = tfidf.count_matrix(iter_documents(source))
+    idf = tfidf.idf(tfidf.document_frequencies(counts), tfidf.num_documents(counts)) if scheme == 'tfidf' else None
+    save(filename, counts.with_data(tfidf.SCHEMES[scheme](counts)), scheme, idf)
+    return load(filename)
+
+
+if __name__ == '__main__':
+    import json
+    import time
+
+    aesop_file = '../../res/vsm/aesopfables.json'
+    store_file = '/tmp/aesopfables.vsm'
+    if os.path.exists(store_file): os.remove(store_file)
+
+    st = time.time()
+    tfidf.vectorize(iter_documents(aesop_file))
+    print('vectorize from JSON: {:.4f}s'.format(time.time() - st))
+
+    cached_vectorize(aesop_file, store_file)
+    st = time.time()
+    corpus = load(store_file)
+    print('load: {:.4f}s, {} documents, {} terms, {} bytes'.format(
+        time.time() - st, len(corpus.matrix.keys), len(corpus.matrix.vocab), os.path.getsize(store_file)))
+
+    fables = json.load(open(aesop_file))
+    print(tfidf.to_dicts(corpus.matrix) == tfidf.to_dicts(tfidf.vectorize(fables)))